@@ -0,0 +1,101 @@
+"""
+Микробенчмарк декодера строк логов Loki.
+
+Сравнивает прежний LokiClient._parse_log_line с LogLineDecoder - без fields
+и с полями, которые использует DashboardService (fields сужает только logfmt).
+
+Запуск из корня репозитория:
+    python -m benchmarks.loki_decoder
+"""
+import json
+import re
+import timeit
+from typing import Any, Dict, Optional
+
+from infrastructure.loki.decoder import LogLineDecoder
+
+DASHBOARD_FIELDS = ["span_id", "account_id", "telegram_user_username", "message"]
+
+SAMPLES = {
+    "plain": "loom-tg-bot | Начало MainMenuService.handle_go_to_personal_profile",
+    "json": json.dumps({
+        "message": "loom-tg-bot | Завершение MainMenuService.handle_go_to_personal_profile",
+        "span_id": "a1b2c3d4e5f60718",
+        "trace_id": "0af7651916cd43dd8448eb211c80319c",
+        "account_id": 52,
+        "telegram_user_username": "loom_user",
+        "telegram_chat_id": "123456789",
+        "file": "/root/internal/service/main_menu/service.py:42",
+        "level": "INFO",
+    }, ensure_ascii=False),
+    "logfmt": (
+        'level=info span_id=a1b2c3d4e5f60718 trace_id=0af7651916cd43dd8448eb211c80319c '
+        'account_id=52 telegram_user_username=loom_user telegram_chat_id=123456789 '
+        'duration=1.648 cached=true message="loom-tg-bot | Начало MainMenuService.handle_go_to_content"'
+    ),
+}
+
+
+def legacy_parse_log_line(log_line: str) -> Optional[Dict[str, Any]]:
+    """Прежняя реализация LokiClient._parse_log_line."""
+    try:
+        parsed = json.loads(log_line)
+        if isinstance(parsed, dict):
+            return parsed
+    except (json.JSONDecodeError, ValueError):
+        pass
+
+    try:
+        fields = {}
+        pattern = r'(\w+)=("(?:[^"\\]|\\.)*"|[^\s]+)'
+        matches = re.findall(pattern, log_line)
+
+        if matches:
+            for key, value in matches:
+                if value.startswith('"') and value.endswith('"'):
+                    value = value[1:-1]
+
+                try:
+                    if '.' in value:
+                        fields[key] = float(value)
+                    else:
+                        fields[key] = int(value)
+                except ValueError:
+                    if value.lower() in ('true', 'false'):
+                        fields[key] = value.lower() == 'true'
+                    else:
+                        fields[key] = value
+
+            if fields:
+                return fields
+    except Exception:
+        pass
+
+    return None
+
+
+def main(number: int = 100_000) -> None:
+    full_decoder = LogLineDecoder()
+    projected_decoder = LogLineDecoder(DASHBOARD_FIELDS)
+
+    parsers = {
+        "legacy": legacy_parse_log_line,
+        "decoder": full_decoder.decode,
+        "decoder[fields]": projected_decoder.decode,
+    }
+
+    print(f"{'sample':<8} {'parser':<16} {'us/line':>8} {'speedup':>8}")
+    for sample_name, log_line in SAMPLES.items():
+        assert full_decoder.decode(log_line) == legacy_parse_log_line(log_line)
+
+        baseline = None
+        for parser_name, parser in parsers.items():
+            seconds = min(timeit.repeat(lambda: parser(log_line), number=number, repeat=3))
+            per_line_us = seconds / number * 1e6
+            if baseline is None:
+                baseline = per_line_us
+            print(f"{sample_name:<8} {parser_name:<16} {per_line_us:>8.3f} {baseline / per_line_us:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
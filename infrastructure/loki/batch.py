@@ -0,0 +1,167 @@
+from array import array
+from datetime import datetime
+from typing import Any, Iterator, Optional
+
+from .decoder import LogLineDecoder
+
+MISSING = object()
+
+
+def ns_to_datetime(timestamp_ns: int) -> datetime:
+    seconds, nanoseconds = divmod(timestamp_ns, 1_000_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=nanoseconds // 1000)
+
+
+def datetime_to_ns(value: datetime) -> int:
+    return round(value.timestamp() * 1_000_000) * 1000
+
+
+class LabelTable:
+    """
+    Таблица уникальных наборов labels. Каждый стрим хранится один раз,
+    строки LogBatch ссылаются на него по номеру.
+    """
+
+    def __init__(self):
+        self.rows: list[dict] = []
+        self._ids: dict[tuple, int] = {}
+
+    def intern(self, labels: dict) -> int:
+        key = tuple(sorted(labels.items()))
+        label_id = self._ids.get(key)
+        if label_id is None:
+            label_id = len(self.rows)
+            self._ids[key] = label_id
+            self.rows.append(labels)
+        return label_id
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class LogBatch:
+    """
+    Колоночное представление логов
+
+    timestamps - int64 наносекунды, messages - исходные строки, label_ids - номер
+    набора labels в общей LabelTable. Поля из строк разбираются только по запросу
+    column() и кэшируются по колонкам.
+
+    Для кода, ожидающего словари, есть row(), __iter__ и to_dicts() - они собирают
+    те же словари, что и LokiClient.query_logs.
+    """
+
+    def __init__(
+            self,
+            labels: Optional[LabelTable] = None,
+            decoder: Optional[LogLineDecoder] = None,
+    ):
+        self.timestamps = array("q")
+        self.messages: list[str] = []
+        self.label_ids = array("I")
+        self.labels = labels if labels is not None else LabelTable()
+        self.decoder = decoder
+
+        self._columns: dict[str, list] = {}
+
+    def append(self, timestamp_ns: int, message: str, label_id: int) -> None:
+        self.timestamps.append(timestamp_ns)
+        self.messages.append(message)
+        self.label_ids.append(label_id)
+        if self._columns:
+            self._columns.clear()
+
+    def extend(self, other: "LogBatch") -> None:
+        if other.labels is self.labels:
+            self.label_ids.extend(other.label_ids)
+        else:
+            self.label_ids.extend(self.labels.intern(other.labels.rows[label_id]) for label_id in other.label_ids)
+        self.timestamps.extend(other.timestamps)
+        self.messages.extend(other.messages)
+        self._columns.clear()
+
+    def column(self, name: str) -> list:
+        """
+        Значения поля name по строкам: из разобранной строки лога, а если его там нет - из labels.
+        Строки разбираются один раз на колонку, результат кэшируется.
+        """
+        values = self._columns.get(name)
+        if values is not None:
+            return values
+
+        label_rows = self.labels.rows
+        values = [label_rows[label_id].get(name) for label_id in self.label_ids]
+
+        if self.decoder is not None and (self.decoder.fields is None or name in self.decoder.fields):
+            decoder = LogLineDecoder([name])
+            for i, message in enumerate(self.messages):
+                parsed = decoder.decode(message)
+                if parsed:
+                    value = parsed.get(name, MISSING)
+                    if value is not MISSING:
+                        values[i] = value
+
+        self._columns[name] = values
+        return values
+
+    def row(self, i: int) -> dict[str, Any]:
+        message = self.messages[i]
+        log_entry = {
+            "timestamp": ns_to_datetime(self.timestamps[i]),
+            "timestamp_ns": self.timestamps[i],
+            "message": message,
+        }
+
+        log_entry.update(self.labels.rows[self.label_ids[i]])
+
+        if self.decoder is not None:
+            parsed_fields = self.decoder.decode(message)
+            if parsed_fields:
+                log_entry.update(parsed_fields)
+
+        return log_entry
+
+    def to_dicts(self) -> list[dict]:
+        return [self.row(i) for i in range(len(self))]
+
+    def __iter__(self) -> Iterator[dict]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def take(self, indices: list[int]) -> "LogBatch":
+        """Строки с номерами indices в указанном порядке"""
+        batch = LogBatch(self.labels, self.decoder)
+        batch.timestamps = array("q", [self.timestamps[i] for i in indices])
+        batch.messages = [self.messages[i] for i in indices]
+        batch.label_ids = array("I", [self.label_ids[i] for i in indices])
+        return batch
+
+    def __getitem__(self, index: slice) -> "LogBatch":
+        if not isinstance(index, slice):
+            raise TypeError("LogBatch поддерживает только срезы; для одной строки используйте row()")
+
+        batch = LogBatch(self.labels, self.decoder)
+        batch.timestamps = self.timestamps[index]
+        batch.messages = self.messages[index]
+        batch.label_ids = self.label_ids[index]
+        return batch
+
+
+def first_rows(batch_logs: list[dict] | LogBatch, count: int, direction: str) -> list[dict] | LogBatch:
+    """
+    Первые count строк страницы в порядке direction. Внутри страницы Loki строки
+    сгруппированы по стримам, поэтому срез [:count] взял бы строки не с начала страницы,
+    а с произвольных timestamp её диапазона.
+    """
+    if len(batch_logs) <= count:
+        return batch_logs
+
+    reverse = direction == "backward"
+    if isinstance(batch_logs, LogBatch):
+        timestamps = batch_logs.timestamps
+        indices = sorted(range(len(batch_logs)), key=timestamps.__getitem__, reverse=reverse)
+        return batch_logs.take(indices[:max(count, 0)])
+    return sorted(batch_logs, key=lambda log: log["timestamp_ns"], reverse=reverse)[:max(count, 0)]
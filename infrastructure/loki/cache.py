@@ -0,0 +1,113 @@
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Hashable, Optional
+
+# Оценка накладных расходов на один лог: dict, datetime, int и ссылки на labels
+LOG_ENTRY_OVERHEAD_BYTES = 400
+
+
+class LokiSegmentCache:
+    """
+    LRU-кэш результатов query_range по фиксированным временным сегментам
+
+    Окно запроса делится на сегменты длиной segment, выровненные по эпохе (для 15 минут -
+    по четвертям часа). Кэшируются только неизменяемые сегменты - закончившиеся раньше,
+    чем now - mutable_window, куда уже не доезжают запоздавшие логи. Сегменты, задевающие
+    "сейчас", всегда запрашиваются у Loki заново.
+
+    Объём ограничен max_bytes по оценке размера логов; при переполнении вытесняются
+    давно не использованные сегменты. Закэшированные логи отдаются без копирования,
+    изменять их нельзя.
+    """
+
+    def __init__(
+            self,
+            segment: timedelta = timedelta(minutes=15),
+            max_bytes: int = 256 * 1024 * 1024,
+            mutable_window: timedelta = timedelta(minutes=5),
+    ):
+        self.segment_ns = int(segment.total_seconds()) * 1_000_000_000
+        self.max_bytes = max_bytes
+        self.mutable_window_ns = int(mutable_window.total_seconds()) * 1_000_000_000
+
+        self._segments: OrderedDict[tuple[Hashable, int], tuple[list[dict], int]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def split(self, start_ns: int, end_ns: int) -> list[tuple[int, int]]:
+        """Границы сегментов, покрывающих [start_ns, end_ns), в порядке возрастания"""
+        first_segment_ns = start_ns - start_ns % self.segment_ns
+        return [
+            (segment_start_ns, segment_start_ns + self.segment_ns)
+            for segment_start_ns in range(first_segment_ns, end_ns, self.segment_ns)
+        ]
+
+    def is_cacheable(self, segment_end_ns: int, now_ns: Optional[int] = None) -> bool:
+        if now_ns is None:
+            now_ns = time.time_ns()
+        return segment_end_ns <= now_ns - self.mutable_window_ns
+
+    def get(self, key: Hashable, segment_start_ns: int) -> Optional[list[dict]]:
+        cached = self._segments.get((key, segment_start_ns))
+        if cached is None:
+            self.misses += 1
+            return None
+
+        self._segments.move_to_end((key, segment_start_ns))
+        self.hits += 1
+        return cached[0]
+
+    def put(self, key: Hashable, segment_start_ns: int, logs: list[dict]) -> None:
+        """Сохраняет логи сегмента, отсортированные по timestamp_ns по возрастанию"""
+        size = self.estimate_bytes(logs)
+        if size > self.max_bytes:
+            return
+
+        previous = self._segments.pop((key, segment_start_ns), None)
+        if previous is not None:
+            self.bytes -= previous[1]
+
+        self._segments[(key, segment_start_ns)] = (logs, size)
+        self.bytes += size
+
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self._segments.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    @staticmethod
+    def slice(logs: list[dict], start_ns: int, end_ns: int, direction: str) -> list[dict]:
+        """Логи сегмента из [start_ns, end_ns) в порядке direction"""
+        left = bisect_left(logs, start_ns, key=lambda log: log["timestamp_ns"])
+        right = bisect_left(logs, end_ns, key=lambda log: log["timestamp_ns"])
+        if left == 0 and right == len(logs) and direction != "backward":
+            return logs
+
+        selected = logs[left:right]
+        if direction == "backward":
+            selected.reverse()
+        return selected
+
+    @staticmethod
+    def estimate_bytes(logs: list[dict]) -> int:
+        return sum(len(log.get("message", "")) + LOG_ENTRY_OVERHEAD_BYTES for log in logs)
+
+    def stats(self) -> dict:
+        return {
+            "segments": len(self._segments),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self) -> None:
+        self._segments.clear()
+        self.bytes = 0
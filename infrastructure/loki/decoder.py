@@ -0,0 +1,116 @@
+import json
+import re
+from typing import Any, Dict, Iterable, Optional
+
+import orjson
+
+# key=value или key="значение с \"экранированием\""
+LOGFMT_PATTERN = re.compile(r'\b(\w++)=("[^"\\]*+(?:\\.[^"\\]*+)*+"|\S+)')
+
+# Целые за пределами int64 orjson отдаёт как float с потерей точности
+ORJSON_INT_LIMIT = float(2 ** 63)
+LARGE_FLOAT_CONTAINERS = frozenset((float, dict, list))
+
+# Надмножество ASCII-строк, которые принимают int()/float() (без inf/nan)
+NUMBER_PATTERN = re.compile(r'\s*[+-]?(?:\d(?:_?\d)*)?(?:\.(?:\d(?:_?\d)*)?)?(?:[eE][+-]?\d(?:_?\d)*)?\s*')
+
+
+class LogLineDecoder:
+    """
+    Декодер строк логов Loki в словарь полей.
+
+    Формат выбирается по первому значимому символу: строка, начинающаяся с "{",
+    разбирается как JSON (orjson), остальные - как logfmt, причём строки без "="
+    отбрасываются без запуска регулярного выражения.
+
+    Если задан fields, из logfmt извлекаются и конвертируются только эти ключи.
+    JSON-строка возвращается целиком: orjson не умеет пропускать значения при разборе,
+    а выборка ключей из готового словаря медленнее, чем сам разбор (см. benchmarks/loki_decoder.py).
+    """
+
+    def __init__(self, fields: Optional[Iterable[str]] = None):
+        self.fields = frozenset(fields) if fields is not None else None
+
+    def decode(self, log_line: str) -> Optional[Dict[str, Any]]:
+        first_char = log_line[:1]
+        if first_char == "{" or (first_char.isspace() and log_line.lstrip().startswith("{")):
+            parsed = self._load_json(log_line)
+            if parsed is not None:
+                return parsed
+
+        if "=" not in log_line:
+            return None
+
+        return self._decode_logfmt(log_line)
+
+    @staticmethod
+    def _load_json(log_line: str) -> Optional[Dict[str, Any]]:
+        try:
+            parsed = orjson.loads(log_line)
+        except orjson.JSONDecodeError:
+            # orjson строже json (например, к NaN и Infinity), пробуем стандартный парсер
+            pass
+        else:
+            if not isinstance(parsed, dict):
+                return None
+            if not LogLineDecoder._has_large_float(parsed):
+                return parsed
+
+        # Большое число могло быть целым, которое orjson округлил до float - json разберёт его точно
+        try:
+            parsed = json.loads(log_line)
+        except ValueError:
+            return None
+
+        if not isinstance(parsed, dict):
+            return None
+
+        return parsed
+
+    @staticmethod
+    def _has_large_float(value: dict | list) -> bool:
+        items = value.values() if type(value) is dict else value
+        # Обычно в строке лога нет ни float, ни вложенных объектов - тогда обходить значения не нужно
+        if LARGE_FLOAT_CONTAINERS.isdisjoint(map(type, items)):
+            return False
+
+        for item in items:
+            item_type = type(item)
+            if item_type is float:
+                if not -ORJSON_INT_LIMIT < item < ORJSON_INT_LIMIT:
+                    return True
+            elif (item_type is dict or item_type is list) and LogLineDecoder._has_large_float(item):
+                return True
+        return False
+
+    def _decode_logfmt(self, log_line: str) -> Optional[Dict[str, Any]]:
+        fields = {}
+        for key, value in LOGFMT_PATTERN.findall(log_line):
+            if self.fields is not None and key not in self.fields:
+                continue
+
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1]
+
+            fields[key] = self._convert_value(value)
+
+        return fields or None
+
+    @staticmethod
+    def _convert_value(value: str) -> Any:
+        # Не поднимаем исключения int()/float() на заведомо нечисловых значениях
+        if value.isascii() and NUMBER_PATTERN.fullmatch(value) is None:
+            lowered = value.lower()
+            if lowered in ('true', 'false'):
+                return lowered == 'true'
+            return value
+
+        try:
+            if '.' in value:
+                return float(value)
+            return int(value)
+        except ValueError:
+            lowered = value.lower()
+            if lowered in ('true', 'false'):
+                return lowered == 'true'
+            return value
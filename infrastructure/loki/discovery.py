@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Hashable, Optional
+
+
+class LokiLabelCache:
+    """
+    TTL-кэш ответов /labels, /label/<name>/values и /series
+
+    Окно запроса расширяется наружу до границ align (start - вниз, end - вверх), чтобы запросы
+    за "последние N часов", сделанные с разницей в минуты, попадали в одну запись. Ответ за более
+    широкое окно - надмножество ответа за исходное, поэтому для проверки, индексирован ли label,
+    он подходит. Записи живут ttl и вытесняются по LRU сверх max_entries.
+    """
+
+    def __init__(
+            self,
+            ttl: timedelta = timedelta(minutes=5),
+            align: timedelta = timedelta(hours=1),
+            max_entries: int = 1024,
+    ):
+        self.ttl_seconds = ttl.total_seconds()
+        self.align_ns = int(align.total_seconds()) * 1_000_000_000
+        self.max_entries = max_entries
+
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def window(self, start_ns: int, end_ns: int) -> tuple[int, int]:
+        aligned_start_ns = start_ns - start_ns % self.align_ns
+        aligned_end_ns = end_ns + (-end_ns) % self.align_ns
+        return aligned_start_ns, aligned_end_ns
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def clear(self) -> None:
+        self._entries.clear()
@@ -0,0 +1,113 @@
+import gzip
+import os
+from datetime import datetime
+from typing import BinaryIO, Iterator
+
+import ijson
+import orjson
+
+from .model import ExportPart
+
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+
+
+def is_ndjson(path: str) -> bool:
+    return path.removesuffix(".gz").endswith(NDJSON_SUFFIXES)
+
+
+def split_export(path: str, chunk_bytes: int) -> list[ExportPart]:
+    """
+    Делит файл выгрузки на части примерно по chunk_bytes для параллельной обработки.
+
+    Делится только несжатый NDJSON: каждая строка целиком принадлежит части, в которой
+    она начинается. JSON-документ и .gz читаются одной частью.
+    """
+    if not is_ndjson(path) or path.endswith(".gz") or chunk_bytes <= 0:
+        return [ExportPart(path)]
+
+    size = os.path.getsize(path)
+    if size <= chunk_bytes:
+        return [ExportPart(path)]
+
+    return [
+        ExportPart(path, start_offset, min(start_offset + chunk_bytes, size))
+        for start_offset in range(0, size, chunk_bytes)
+    ]
+
+
+def iter_export_values(part: ExportPart) -> Iterator[tuple[dict, int, str]]:
+    """
+    Тройки (labels, timestamp в нс, строка) из выгрузки Loki.
+
+    Поддерживаются:
+    - JSON-ответ /query_range ({"data": {"result": [...]}}) или список стримов;
+    - NDJSON, где строка - стрим {"stream": {...}, "values": [[ts, line], ...]}
+      или запись logcli --output=jsonl {"labels": {...}, "line": "...", "timestamp": "..."}.
+    """
+    with _open_export(part.path) as export_file:
+        if is_ndjson(part.path):
+            yield from _iter_ndjson_values(export_file, part.start_offset, part.end_offset)
+        else:
+            yield from _iter_json_values(export_file)
+
+
+def _open_export(path: str) -> BinaryIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _iter_json_values(export_file: BinaryIO) -> Iterator[tuple[dict, int, str]]:
+    first_char = export_file.read(1)
+    while first_char.isspace():
+        first_char = export_file.read(1)
+    export_file.seek(0)
+
+    prefix = "item" if first_char == b"[" else "data.result.item"
+    for stream in ijson.items(export_file, prefix):
+        yield from _iter_stream_values(stream)
+
+
+def _iter_ndjson_values(
+        export_file: BinaryIO,
+        start_offset: int,
+        end_offset: int | None,
+) -> Iterator[tuple[dict, int, str]]:
+    if start_offset > 0:
+        # Строка, начавшаяся до start_offset, принадлежит предыдущей части
+        export_file.seek(start_offset - 1)
+        export_file.readline()
+
+    while end_offset is None or export_file.tell() < end_offset:
+        line = export_file.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+
+        record = orjson.loads(line)
+        if "values" in record:
+            yield from _iter_stream_values(record)
+        elif "line" in record:
+            yield record.get("labels") or {}, _parse_timestamp(record["timestamp"]), record["line"]
+
+
+def _iter_stream_values(stream: dict) -> Iterator[tuple[dict, int, str]]:
+    labels = stream.get("stream") or {}
+    for timestamp, log_line in stream.get("values", []):
+        yield labels, _parse_timestamp(timestamp), log_line
+
+
+def _parse_timestamp(timestamp: str | int) -> int:
+    """Timestamp выгрузки в нс: строка или число наносекунд (API Loki) либо RFC3339 (logcli)"""
+    if isinstance(timestamp, int) or timestamp.isdigit():
+        return int(timestamp)
+
+    value = datetime.fromisoformat(timestamp)
+    # fromisoformat отбрасывает доли секунды после микросекунд, наносекунды добираем из строки
+    fraction = timestamp.partition(".")[2]
+    nanoseconds = 0
+    if fraction:
+        digits = len(fraction) - len(fraction.lstrip("0123456789"))
+        nanoseconds = int(fraction[:digits][:9].ljust(9, "0")) % 1000
+    return int(value.timestamp()) * 1_000_000_000 + value.microsecond * 1000 + nanoseconds
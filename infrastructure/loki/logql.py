@@ -0,0 +1,9 @@
+import re
+
+# Метасимволы RE2; re.escape экранирует ещё и пробелы, что RE2 не принимает
+RE2_SPECIAL_CHARS = re.compile(r'[\\.+*?()|\[\]{}^$]')
+
+
+def escape_re2(value: str) -> str:
+    """Экранирует метасимволы RE2, чтобы строка совпадала в регулярке LogQL буквально"""
+    return RE2_SPECIAL_CHARS.sub(r"\\\g<0>", value)
@@ -1,12 +1,53 @@
 import asyncio
+import time
+from dataclasses import replace
+from urllib.parse import urlencode
 
-from typing import Dict, List, Optional, Any
+from typing import AsyncIterator, Callable, Dict, List, Optional
 from datetime import datetime, timedelta
 from pkg.client.client import AsyncHTTPClient
-import re
 import json
 
-from internal import interface
+import httpx
+import ijson
+import orjson
+from opentelemetry import metrics, trace
+from websockets.asyncio.client import connect as websocket_connect
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+
+from .batch import LabelTable, LogBatch, datetime_to_ns, first_rows, ns_to_datetime
+from .cache import LokiSegmentCache
+from .decoder import LogLineDecoder
+from .discovery import LokiLabelCache
+from .logql import escape_re2
+from .model import (
+    LOG_QUERY_FIELDS,
+    AdaptivePageSize,
+    LogQuery,
+    LokiQueryStats,
+    MetricSeries,
+    MetricVector,
+    QueryBudget,
+    QueryCheckpoint,
+    QueryPlan,
+    QueryRangePage,
+    RangeCheckpoint,
+    VolumeEstimate,
+)
+from .observer import LokiQueryMetrics, LokiQueryObserver, window_bucket
+from .paging import PageSizer
+from .planner import QueryPlanner
+from .pool import LokiEndpointPool
+from .resumable import LokiQueryHandle
+
+from internal import common, interface
+
+LOG_RANGE_FUNCTIONS = {"count_over_time", "rate", "bytes_over_time", "bytes_rate", "absent_over_time"}
+UNWRAP_RANGE_FUNCTIONS = {
+    "sum_over_time", "avg_over_time", "min_over_time", "max_over_time", "stddev_over_time",
+    "stdvar_over_time", "quantile_over_time", "first_over_time", "last_over_time", "rate_counter",
+}
+VECTOR_AGGREGATIONS = {"sum", "avg", "min", "max", "count", "stddev", "stdvar"}
 
 
 class LokiClient(interface.ILokiClient):
@@ -15,200 +56,1352 @@ class LokiClient(interface.ILokiClient):
             self,
             host: str,
             port: int,
+            cache: LokiSegmentCache = None,
+            stream_decoding: bool = True,
+            budget: QueryBudget = None,
+            tel: interface.ITelemetry = None,
+            adaptive_paging: AdaptivePageSize = None,
+            label_cache: LokiLabelCache = None,
+            planner: QueryPlanner = None,
+            endpoints: list[tuple[str, int]] = None,
+            routing: str = "least_outstanding",
     ):
-        self.client = AsyncHTTPClient(
-            host,
-            port,
-            prefix="/loki/api/v1",
-            use_tracing=True,
-        )
+        if endpoints:
+            # Несколько реплик: host:port и endpoints образуют пул с балансировкой и исключением
+            # неработающих реплик (см. LokiEndpointPool)
+            pool_endpoints = list(dict.fromkeys([(host, port), *endpoints]))
+            self.client = LokiEndpointPool(
+                pool_endpoints,
+                prefix="/loki/api/v1",
+                routing=routing,
+                use_tracing=True,
+            )
+        else:
+            self.client = AsyncHTTPClient(
+                host,
+                port,
+                prefix="/loki/api/v1",
+                use_tracing=True,
+            )
+        self.cache = cache
+        self.stream_decoding = stream_decoding
+        self.budget = budget or QueryBudget()
+        self.adaptive_paging = adaptive_paging
+        self.label_cache = label_cache
+        self.planner = planner
 
-    async def query_logs(
-            self,
-            filters: dict = None,
-            content_filters: dict = None,
-            search_text: str | list[str] = None,
-            search_mode: str = "and",
-            start_time: datetime = None,
-            end_time: datetime = None,
-            direction: str = "backward",
-            parse_json: bool = True,
-            limit: int = None,
-            batch_size: int = 5000
-    ) -> list[dict]:
+        # Без Telemetry спаны и метрики идут через глобальные провайдеры OpenTelemetry
+        self.tracer = tel.tracer() if tel is not None else trace.get_tracer(__name__)
+        self.query_metrics = LokiQueryMetrics(tel.meter() if tel is not None else metrics.get_meter(__name__))
+
+    async def query_logs(self, *query_args, **query_kwargs) -> list[dict]:
         """
         Получение логов с фильтрацией и автоматической пагинацией
 
-        Args:
-            filters: Словарь с label selectors (например, {"service_name": "my-service"})
-            content_filters: Словарь для поиска в содержимом логов (например, {"account_id": "1"})
-            search_text: Текст для поиска в логах (строка или список строк)
-            search_mode: Режим поиска - "and" (все строки должны присутствовать) или "or" (хотя бы одна)
-            start_time: Начало временного диапазона (по умолчанию - 1 час назад)
-            end_time: Конец временного диапазона (по умолчанию - сейчас)
-            direction: Направление сортировки ("backward" или "forward")
-            parse_json: Автоматически парсить JSON из message (по умолчанию True)
-            limit: Максимальное количество логов (None = без ограничений, получить все)
-            batch_size: Размер одного запроса к Loki (по умолчанию 5000, не рекомендуется увеличивать)
+        Принимает те же аргументы, что и iter_batches.
+
+        Raises:
+            ErrQueryTooLarge: планировщик отклонил запрос - нужно сузить диапазон или фильтры
 
         Returns:
             Список логов в виде словарей
         """
-        if filters is None:
-            filters = {}
-        if content_filters is None:
-            content_filters = {}
+        all_logs = []
+        async for batch_logs in self.iter_batches(*query_args, **query_kwargs):
+            all_logs.extend(batch_logs)
 
-        if end_time is None:
-            end_time = datetime.now()
-        if start_time is None:
-            start_time = end_time - timedelta(hours=1)
+        return all_logs
 
-        query = self._build_logql_query(filters, content_filters, search_text, search_mode)
+    async def query_log_batch(self, **query_kwargs) -> LogBatch:
+        """
+        Получение логов в колоночном виде одним LogBatch
 
-        all_logs = []
-        current_end_time = end_time
+        Принимает те же аргументы, что и iter_batches (кроме columnar). Вместо словаря на
+        каждую строку хранит массив timestamp, строки и номер набора labels в общей таблице.
+        """
+        result = LogBatch()
+        async for batch in self.iter_batches(columnar=True, **query_kwargs):
+            if len(result) == 0:
+                result = batch
+            else:
+                result.extend(batch)
+
+        return result
+
+    async def iter_logs(self, *query_args, **query_kwargs) -> AsyncIterator[dict]:
+        """
+        Потоковое получение логов по одному.
+
+        Принимает те же аргументы, что и iter_batches. В памяти одновременно
+        находится не больше одной страницы; прерывание цикла останавливает
+        дальнейшие запросы к Loki.
+        """
+        async for batch_logs in self.iter_batches(*query_args, **query_kwargs):
+            for log_entry in batch_logs:
+                yield log_entry
+
+    async def iter_batches(
+            self,
+            *query_args,
+            max_concurrency: int = 4,
+            use_cache: bool = True,
+            columnar: bool = False,
+            budget: QueryBudget = None,
+            stats: LokiQueryStats = None,
+            adaptive_paging: AdaptivePageSize = None,
+            **query_kwargs,
+    ) -> AsyncIterator[list[dict] | LogBatch]:
+        """
+        Потоковое получение логов постранично: каждая страница отдаётся сразу после её
+        получения, без накопления результата целиком. При shards > 1 страницы шардов,
+        до которых ещё не дошла очередь, ждут в ограниченном буфере.
+
+        Args:
+            query_args, query_kwargs: Параметры запроса - поля LogQuery; позиционно - в исходном
+                порядке query_logs (filters, ..., start_time, end_time, ..., limit, batch_size),
+                остальные (line_regex, shards, plan, ...) - только по имени
+            max_concurrency: Максимальное количество шардов (или сегментов кэша), запрашиваемых одновременно
+            use_cache: Использовать кэш сегментов, если он настроен (только при limit=None)
+            columnar: Отдавать LogBatch с общей таблицей labels вместо списков словарей
+                (кэш сегментов в этом режиме не используется)
+            budget: Ограничения на строки, байты и страницы (дополнительно к общим ограничениям клиента)
+            stats: Объект, в который записываются итоги запроса, в том числе признак truncated
+            adaptive_paging: Подстраивать limit страниц под целевой размер ответа и время страницы
+                (по умолчанию - настройка клиента)
+
+        Raises:
+            ErrQueryTooLarge: планировщик отклонил запрос - нужно сузить диапазон или фильтры
+        """
+        log_query, query = await self._prepare_query(LogQuery(*query_args, **query_kwargs))
+        start_ns = self._datetime_to_ns(log_query.start_time)
+        end_ns = self._datetime_to_ns(log_query.end_time)
+        decoder = LogLineDecoder(log_query.fields) if log_query.parse_json else None
+        label_table = LabelTable() if columnar else None
+        direction = log_query.direction
+        limit = log_query.limit
+        batch_size = log_query.batch_size
+        shards = log_query.shards
+
+        if stats is None:
+            stats = LokiQueryStats()
+
+        cached = self.cache is not None and use_cache and limit is None and not columnar
+
+        query_plan = None
+        if log_query.plan and self.planner is not None:
+            query_plan = await self._plan_query(log_query)
+            if cached and query_plan.strategy != "refuse":
+                # Кэш читает окно своими сегментами, стратегия и шарды плана не применяются
+                query_plan = None
+            else:
+                stats.plan = query_plan
+                shards = query_plan.shards
+
+        if cached:
+            mode = "cached"
+        elif shards > 1:
+            mode = "sharded"
+        else:
+            mode = "range"
+
+        # Форма запроса - атрибуты с низкой кардинальностью для span и гистограмм
+        shape = {
+            "loki.mode": mode,
+            "loki.direction": direction,
+            "loki.selector": ",".join(sorted(log_query.filters)) or "*",
+            "loki.parser": log_query.parser or "none",
+            "loki.line_filter": bool(log_query.search_text or log_query.line_regex),
+            "loki.content_filter": bool(log_query.content_filters),
+            "loki.window": window_bucket(start_ns, end_ns),
+            "loki.columnar": columnar,
+        }
+        if adaptive_paging is None:
+            adaptive_paging = self.adaptive_paging
+        shape["loki.adaptive_paging"] = adaptive_paging is not None
+        shape["loki.plan"] = query_plan.strategy if query_plan is not None else "none"
+        observer = LokiQueryObserver(self.tracer, self.query_metrics, query, shape, stats)
+
+        if query_plan is not None:
+            observer.span.set_attributes(query_plan.attributes())
+            if query_plan.strategy == "refuse":
+                error = self._refusal_error(query_plan)
+                observer.finish(error)
+                raise error
+
+        budget = self.budget.merge(budget)
+        if budget.max_rows is not None:
+            # Страницы не просят больше, чем осталось в бюджете строк, плюс одна строка -
+            # по ней видно, что за бюджетом есть ещё данные
+            limit = budget.max_rows + 1 if limit is None else min(limit, budget.max_rows + 1)
+
+        if mode == "cached":
+            batches = self._iter_cached_batches(
+                query, start_ns, end_ns, direction, decoder, batch_size, max_concurrency, observer, adaptive_paging,
+                budget, stats,
+            )
+        elif mode == "sharded":
+            batches = self._iter_sharded_batches(
+                query, start_ns, end_ns, direction, decoder, limit, batch_size, shards, max_concurrency, label_table,
+                observer, adaptive_paging,
+            )
+        else:
+            batches = self._iter_range_batches(
+                query, start_ns, end_ns, direction, decoder, limit, batch_size, label_table, observer, adaptive_paging
+            )
+
+        stats.covered_start_ns = start_ns if direction != "backward" else end_ns
+        stats.covered_end_ns = start_ns if direction != "backward" else end_ns
+
+        error = None
+        try:
+            async for batch_logs in batches:
+                # Бюджет строк заполняется до конца: страница обрезается по остатку
+                rows_exceeded = budget.max_rows is not None and stats.rows + len(batch_logs) > budget.max_rows
+                if rows_exceeded:
+                    batch_logs = first_rows(batch_logs, budget.max_rows - stats.rows, direction)
+
+                batch_bytes = self._batch_bytes(batch_logs)
+                exceeded = budget.exceeded_by(stats.rows + len(batch_logs), stats.bytes + batch_bytes, stats.pages + 1)
+                if exceeded is None and rows_exceeded and not batch_logs:
+                    exceeded = "max_rows"
+                if exceeded is not None:
+                    stats.truncated = True
+                    stats.truncated_reason = exceeded
+                    return
+
+                stats.rows += len(batch_logs)
+                stats.bytes += batch_bytes
+                stats.pages += 1
+
+                # Строки на граничном timestamp могли попасть не все, поэтому он в покрытый диапазон не входит
+                timestamps = batch_logs.timestamps if isinstance(batch_logs, LogBatch) else [
+                    log["timestamp_ns"] for log in batch_logs
+                ]
+                if timestamps and direction == "backward":
+                    stats.covered_start_ns = min(stats.covered_start_ns, min(timestamps) + 1)
+                elif timestamps:
+                    stats.covered_end_ns = max(stats.covered_end_ns, max(timestamps))
+
+                yield batch_logs
+
+                if rows_exceeded:
+                    stats.truncated = True
+                    stats.truncated_reason = "max_rows"
+                    return
+
+            if not stats.truncated:
+                stats.covered_start_ns = start_ns
+                stats.covered_end_ns = end_ns
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            await batches.aclose()
+            observer.finish(error)
+
+    @staticmethod
+    def _batch_bytes(batch_logs: list[dict] | LogBatch) -> int:
+        if isinstance(batch_logs, LogBatch):
+            return sum(map(len, batch_logs.messages))
+        return sum(len(log["message"]) for log in batch_logs)
+
+    async def open_query(self, *query_args, **query_kwargs) -> LokiQueryHandle:
+        """
+        Возобновляемый запрос логов: принимает поля LogQuery, как iter_batches, и возвращает
+        LokiQueryHandle, который после каждой отданной страницы сохраняет позицию пагинации.
+
+        Кэш сегментов не используется. Остальные аргументы передаются в LokiQueryHandle
+        (max_concurrency, resume_attempts, resume_delay, columnar, adaptive_paging, prefetch_pages).
+
+        Raises:
+            ErrQueryTooLarge: планировщик отклонил запрос
+        """
+        handle_kwargs = {
+            key: query_kwargs.pop(key)
+            for key in list(query_kwargs)
+            if key not in LOG_QUERY_FIELDS
+        }
+        log_query, query = await self._prepare_query(LogQuery(*query_args, **query_kwargs))
+
+        shards = log_query.shards
+        if log_query.plan and self.planner is not None:
+            query_plan = await self._plan_query(log_query)
+            if query_plan.strategy == "refuse":
+                raise self._refusal_error(query_plan)
+            shards = query_plan.shards
+
+        ranges = self._shard_ranges(
+            self._datetime_to_ns(log_query.start_time),
+            self._datetime_to_ns(log_query.end_time),
+            shards,
+            log_query.direction,
+        )
+
+        checkpoint = QueryCheckpoint(
+            query=query,
+            direction=log_query.direction,
+            ranges=[RangeCheckpoint(start_ns=range_start_ns, end_ns=range_end_ns) for range_start_ns, range_end_ns in ranges],
+            parse_json=log_query.parse_json,
+            fields=log_query.fields,
+            limit=log_query.limit,
+            batch_size=log_query.batch_size,
+        )
+        return LokiQueryHandle(self, checkpoint, **handle_kwargs)
+
+    async def _prepare_query(self, log_query: LogQuery) -> tuple[LogQuery, str]:
+        """
+        Подставляет значения по умолчанию (пустые фильтры, последний час), переносит
+        content_filters в stream selector (narrow_selector) и строит LogQL запрос
+        """
+        filters = log_query.filters if log_query.filters is not None else {}
+        content_filters = log_query.content_filters if log_query.content_filters is not None else {}
+        end_time = log_query.end_time if log_query.end_time is not None else datetime.now()
+        start_time = log_query.start_time if log_query.start_time is not None else end_time - timedelta(hours=1)
+
+        if log_query.narrow_selector and self.label_cache is not None:
+            filters, content_filters = await self.narrow_filters(filters, content_filters, start_time, end_time)
+
+        log_query = replace(
+            log_query,
+            filters=filters,
+            content_filters=content_filters,
+            start_time=start_time,
+            end_time=end_time,
+        )
+        query = self._build_logql_query(
+            log_query.filters,
+            log_query.content_filters,
+            log_query.search_text,
+            log_query.search_mode,
+            log_query.line_regex,
+            log_query.parser,
+            log_query.keep_labels,
+            log_query.drop_labels,
+            log_query.line_format,
+        )
+        return log_query, query
+
+    def resume_query(self, checkpoint: QueryCheckpoint | dict, **handle_kwargs) -> LokiQueryHandle:
+        """Продолжение запроса с сохранённого checkpoint (объекта или результата to_dict)"""
+        if isinstance(checkpoint, dict):
+            checkpoint = QueryCheckpoint.from_dict(checkpoint)
+        return LokiQueryHandle(self, checkpoint, **handle_kwargs)
+
+    @staticmethod
+    def _shard_ranges(start_ns: int, end_ns: int, shards: int, direction: str) -> list[tuple[int, int]]:
+        """shards равных поддиапазонов [start_ns, end_ns) в порядке direction"""
+        bounds = [start_ns + (end_ns - start_ns) * i // shards for i in range(shards)] + [end_ns]
+        ranges = list(zip(bounds[:-1], bounds[1:]))
+        if direction == "backward":
+            ranges.reverse()
+        return ranges
+
+    async def _iter_sharded_batches(
+            self,
+            query: str,
+            start_ns: int,
+            end_ns: int,
+            direction: str,
+            decoder: Optional[LogLineDecoder],
+            limit: Optional[int],
+            batch_size: int,
+            shards: int,
+            max_concurrency: int,
+            label_table: Optional[LabelTable] = None,
+            observer: Optional[LokiQueryObserver] = None,
+            adaptive_paging: Optional[AdaptivePageSize] = None,
+    ) -> AsyncIterator[list[dict] | LogBatch]:
+        """
+        Делит окно на shards равных поддиапазонов и пагинирует каждый независимо,
+        одновременно не более max_concurrency запросов.
+
+        Страницы отдаются в порядке direction: сначала целиком первый по порядку шард,
+        затем следующий. Страницы следующих шардов ждут своей очереди в ограниченном буфере
+        (см. _iter_ordered_ranges), поэтому в памяти - несколько страниц, а не всё окно.
+        """
+        ranges = self._shard_ranges(start_ns, end_ns, shards, direction)
+
+        def iter_shard(shard_start_ns: int, shard_end_ns: int) -> AsyncIterator[list[dict] | LogBatch]:
+            return self._iter_range_batches(
+                query, shard_start_ns, shard_end_ns, direction, decoder, limit, batch_size, label_table, observer,
+                adaptive_paging,
+            )
+
+        async for batch_logs in self._iter_ordered_ranges(ranges, iter_shard, max_concurrency, limit, direction):
+            yield batch_logs
+
+    async def _iter_cached_batches(
+            self,
+            query: str,
+            start_ns: int,
+            end_ns: int,
+            direction: str,
+            decoder: Optional[LogLineDecoder],
+            batch_size: int,
+            max_concurrency: int,
+            observer: Optional[LokiQueryObserver] = None,
+            adaptive_paging: Optional[AdaptivePageSize] = None,
+            budget: Optional[QueryBudget] = None,
+            stats: Optional[LokiQueryStats] = None,
+    ) -> AsyncIterator[list[dict]]:
+        """
+        Собирает окно из сегментов кэша: неизменяемые сегменты берутся из кэша или
+        запрашиваются целиком и кэшируются, сегменты около "сейчас" запрашиваются
+        только в пределах окна и не кэшируются. Строки отдаются пачками по batch_size.
+
+        budget ограничивает и чтение из Loki: сегмент перестаёт читаться, как только уже отданное
+        вызывающему вместе с прочитанным этим сегментом превышает бюджет. Отданное считается
+        только при отдаче, поэтому сегменты, читаемые заранее, не расходуют бюджет друг друга
+        и дочитанный сегмент попадает в кэш, даже если до его отдачи дело не дойдёт.
+        Недочитанный сегмент в кэш не попадает, а окно обрывается на нём с stats.truncated -
+        дальше по порядку был бы пропуск.
+        """
+        cache_key = (query, decoder.fields if decoder is not None else None, decoder is not None)
+        now_ns = time.time_ns()
+        if budget is None:
+            budget = QueryBudget()
+        # Отдано вызывающему: строки, байты, страницы
+        delivered = [0, 0, 0]
+
+        segments = self.cache.split(start_ns, end_ns)
+        if direction == "backward":
+            segments.reverse()
+
+        async def iter_segment(segment_start_ns: int, segment_end_ns: int) -> AsyncIterator[list[dict]]:
+            # Прочитано из Loki этим сегментом: строки, байты, страницы
+            fetched = [0, 0, 0]
+
+            def exceeded_by(batch_logs: list[dict]) -> Optional[str]:
+                fetched[0] += len(batch_logs)
+                fetched[1] += self._batch_bytes(batch_logs)
+                fetched[2] += 1
+                return budget.exceeded_by(*(total + own for total, own in zip(delivered, fetched)))
+
+            if not self.cache.is_cacheable(segment_end_ns, now_ns):
+                self.cache.bypasses += 1
+                async for batch_logs in self._iter_range_batches(
+                        query,
+                        max(segment_start_ns, start_ns),
+                        min(segment_end_ns, end_ns),
+                        direction,
+                        decoder,
+                        None,
+                        batch_size,
+                        observer=observer,
+                        adaptive_paging=adaptive_paging,
+                ):
+                    exceeded = exceeded_by(batch_logs)
+                    yield batch_logs
+                    if exceeded is not None:
+                        raise _FetchBudgetExceeded(exceeded)
+                return
+
+            exceeded = None
+            segment_logs = self.cache.get(cache_key, segment_start_ns)
+            if segment_logs is None:
+                # Читаем в порядке запроса: если бюджет оборвёт чтение, прочитанное примыкает к началу окна
+                segment_logs = []
+                async for batch_logs in self._iter_range_batches(
+                        query, segment_start_ns, segment_end_ns, direction, decoder, None, batch_size,
+                        observer=observer, adaptive_paging=adaptive_paging,
+                ):
+                    segment_logs.extend(batch_logs)
+                    exceeded = exceeded_by(batch_logs)
+                    if exceeded is not None:
+                        break
+                segment_logs.sort(key=lambda log: log["timestamp_ns"])
+                if exceeded is None:
+                    self.cache.put(cache_key, segment_start_ns, segment_logs)
+
+            selected = self.cache.slice(segment_logs, start_ns, end_ns, direction)
+            for offset in range(0, len(selected), batch_size):
+                yield selected[offset:offset + batch_size]
+            if exceeded is not None:
+                raise _FetchBudgetExceeded(exceeded)
+
+        try:
+            async for batch_logs in self._iter_ordered_ranges(segments, iter_segment, max_concurrency, None, direction):
+                delivered[0] += len(batch_logs)
+                delivered[1] += self._batch_bytes(batch_logs)
+                delivered[2] += 1
+                yield batch_logs
+        except _FetchBudgetExceeded as exc:
+            if stats is not None:
+                stats.truncated = True
+                stats.truncated_reason = exc.reason
+
+    @staticmethod
+    async def _iter_ordered_ranges(
+            ranges: list[tuple[int, int]],
+            iter_range: Callable[[int, int], AsyncIterator[list[dict] | LogBatch]],
+            max_concurrency: int,
+            limit: Optional[int],
+            direction: str = "backward",
+            prefetch_pages: int = 2,
+    ) -> AsyncIterator[list[dict] | LogBatch]:
+        """
+        Читает диапазоны через iter_range, одновременно не более max_concurrency, и отдаёт
+        страницы строго в порядке ranges, обрезая результат по limit (последняя страница
+        обрезается по первым в порядке direction строкам).
+
+        Страницы диапазонов, до которых очередь ещё не дошла, ждут в очереди не длиннее
+        prefetch_pages: читающий диапазон останавливается, пока её не разберут, поэтому
+        в памяти не больше max_concurrency * prefetch_pages страниц. Разрешения семафора
+        выдаются в порядке ranges, так что текущий диапазон всегда читается.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        queues = [asyncio.Queue(maxsize=prefetch_pages) for _ in ranges]
+        range_done = object()
+
+        async def produce(queue: asyncio.Queue, range_start_ns: int, range_end_ns: int) -> None:
+            async with semaphore:
+                try:
+                    async for batch_logs in iter_range(range_start_ns, range_end_ns):
+                        await queue.put(batch_logs)
+                except Exception as exc:
+                    await queue.put(exc)
+                    return
+                await queue.put(range_done)
+
+        tasks = [
+            asyncio.create_task(produce(queue, range_start_ns, range_end_ns))
+            for queue, (range_start_ns, range_end_ns) in zip(queues, ranges)
+        ]
+        try:
+            fetched_count = 0
+            for queue in queues:
+                while True:
+                    batch_logs = await queue.get()
+                    if batch_logs is range_done:
+                        break
+                    if isinstance(batch_logs, Exception):
+                        raise batch_logs
+
+                    if limit is not None:
+                        remaining = limit - fetched_count
+                        if remaining <= 0:
+                            return
+                        batch_logs = first_rows(batch_logs, remaining, direction)
+
+                    fetched_count += len(batch_logs)
+                    yield batch_logs
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _iter_range_batches(
+            self,
+            query: str,
+            start_ns: int,
+            end_ns: int,
+            direction: str,
+            decoder: Optional[LogLineDecoder],
+            limit: Optional[int],
+            batch_size: int,
+            label_table: Optional[LabelTable] = None,
+            observer: Optional[LokiQueryObserver] = None,
+            adaptive_paging: Optional[AdaptivePageSize] = None,
+            checkpoint: Optional[RangeCheckpoint] = None,
+    ) -> AsyncIterator[list[dict] | LogBatch]:
+        """
+        Пагинация по диапазону [start_ns, end_ns) с курсором в целых наносекундах.
+
+        Loki включает start и не включает end. Курсор ставится на граничный timestamp
+        последней страницы включительно, поэтому строки с тем же timestamp, не попавшие
+        в страницу, не теряются, а уже полученные отбрасываются по ключу
+        (stream, timestamp, строка).
+
+        С adaptive_paging limit каждой следующей страницы подбирает PageSizer.
+        """
+        page_sizer = PageSizer(batch_size, adaptive_paging)
+        # Состояние пагинации; если передан checkpoint - продолжаем с него и обновляем его
+        # перед отдачей каждой страницы
+        cursor = checkpoint if checkpoint is not None else RangeCheckpoint(start_ns=start_ns, end_ns=end_ns)
 
         # Пагинация: делаем запросы пока есть данные или пока не достигнем лимита
-        while True:
+        while not cursor.done:
             # Определяем размер текущего батча
             if limit is not None:
-                remaining = limit - len(all_logs)
+                remaining = limit - cursor.fetched
                 if remaining <= 0:
+                    cursor.done = True
                     break
-                current_batch_size = min(batch_size, remaining)
+                current_batch_size = min(page_sizer.next_limit(len(cursor.boundary_keys)), remaining)
             else:
-                current_batch_size = batch_size
+                current_batch_size = page_sizer.next_limit(len(cursor.boundary_keys))
 
             params = {
                 "query": query,
-                "start": int(start_time.timestamp() * 1e9),
-                "end": int(current_end_time.timestamp() * 1e9),
+                "start": cursor.cursor_start_ns,
+                "end": cursor.cursor_end_ns,
                 "direction": direction,
                 "limit": current_batch_size
             }
 
-            try:
-                response = await self.client.get(
-                    "/query_range",
-                    params=params,
+            if self.stream_decoding:
+                # Потоковый ответ нельзя повторить с середины - повторяем чтение страницы целиком
+                async for attempt in self.client.retrying():
+                    with attempt:
+                        page = await self._read_page(
+                            params, direction, decoder, label_table, cursor.boundary_ts, cursor.boundary_keys
+                        )
+            else:
+                page = await self._read_page(
+                    params, direction, decoder, label_table, cursor.boundary_ts, cursor.boundary_keys
                 )
 
-                data = response.json()
+            if observer is not None:
+                observer.record_page(page, params)
+            page_sizer.observe(page)
 
-                batch_logs = []
-                if data.get("status") == "success":
-                    results = data.get("data", {}).get("result", [])
+            batch_logs = page.logs
+            cursor.fetched += len(batch_logs)
 
-                    for stream in results:
-                        labels = stream.get("stream", {})
-                        values = stream.get("values", [])
+            # Если получили меньше логов чем запрашивали, значит это последний батч;
+            # если достигли лимита - тоже останавливаемся
+            if page.lines < current_batch_size or (limit is not None and cursor.fetched >= limit):
+                cursor.done = True
+            else:
+                self._advance_cursor(cursor, page, direction)
 
-                        for value in values:
-                            timestamp_ns, log_line = value
+            if batch_logs:
+                yield batch_logs
 
-                            log_entry = {
-                                "timestamp": datetime.fromtimestamp(int(timestamp_ns) / 1e9),
-                                "timestamp_ns": timestamp_ns,
-                                "message": log_line,
-                            }
+    @staticmethod
+    def _advance_cursor(cursor: RangeCheckpoint, page: QueryRangePage, direction: str) -> None:
+        if page.edge_ts == cursor.boundary_ts:
+            cursor.boundary_keys = cursor.boundary_keys | page.edge_keys
+        else:
+            cursor.boundary_ts = page.edge_ts
+            cursor.boundary_keys = page.edge_keys
 
-                            log_entry.update(labels)
+        if not page.logs:
+            # Вся страница состоит из строк с одним timestamp, которые уже получены:
+            # строк на этом timestamp больше, чем помещается в страницу, перешагиваем его
+            cursor.boundary_keys = set()
+            if direction == "backward":
+                cursor.cursor_end_ns = cursor.boundary_ts
+            else:
+                cursor.cursor_start_ns = cursor.boundary_ts + 1
+            return
 
-                            if parse_json:
-                                parsed_fields = self._parse_log_line(log_line)
-                                if parsed_fields:
-                                    log_entry.update(parsed_fields)
+        if direction == "backward":
+            # При backward сортировке логи идут от новых к старым, сдвигаем end (не включается)
+            cursor.cursor_end_ns = cursor.boundary_ts + 1
+        else:
+            # При forward сортировке логи идут от старых к новым, сдвигаем start (включается)
+            cursor.cursor_start_ns = cursor.boundary_ts
 
-                            batch_logs.append(log_entry)
+    async def _read_page(
+            self,
+            params: dict,
+            direction: str,
+            decoder: Optional[LogLineDecoder],
+            label_table: Optional[LabelTable],
+            boundary_ts: Optional[int],
+            boundary_keys: set[tuple],
+    ) -> QueryRangePage:
+        """
+        Читает одну страницу /query_range, отбрасывая строки, полученные на прошлых страницах,
+        и вычисляет граничный timestamp для следующего курсора.
+        """
+        page = QueryRangePage(logs=LogBatch(label_table, decoder) if label_table is not None else [])
+        started_at = time.perf_counter()
 
-                # Если получили меньше логов чем запрашивали, значит это последний батч
-                if len(batch_logs) < current_batch_size:
-                    all_logs.extend(batch_logs)
-                    break
+        current_labels = None
+        stream_key = None
+        label_id = None
+        # Последний timestamp текущего стрима и ключи строк на нём: внутри стрима значения
+        # отсортированы по direction, поэтому последний timestamp стрима - его граница
+        stream_edge_ts: Optional[int] = None
+        stream_edge_keys: set[tuple] = set()
 
-                all_logs.extend(batch_logs)
+        async for labels, timestamp_ns, log_line in self._iter_page_values(params, page):
+            if labels is not current_labels:
+                if stream_edge_ts is not None:
+                    self._merge_page_edge(page, stream_edge_ts, stream_edge_keys, direction)
+                current_labels = labels
+                stream_key = tuple(sorted(labels.items()))
+                label_id = label_table.intern(labels) if label_table is not None else None
+                stream_edge_ts = None
 
-                # Если достигли лимита, останавливаемся
-                if limit is not None and len(all_logs) >= limit:
-                    break
+            page.lines += 1
+            timestamp_ns = int(timestamp_ns)
+            key = (stream_key, timestamp_ns, log_line)
 
-                # Обновляем end_time для следующего запроса
-                # Берём timestamp самого старого лога из текущего батча
-                if batch_logs:
-                    if direction == "backward":
-                        # При backward сортировке логи идут от новых к старым
-                        oldest_log = batch_logs[-1]
-                        # Вычитаем 1 наносекунду чтобы не получить тот же лог снова
-                        current_end_time = datetime.fromtimestamp(int(oldest_log["timestamp_ns"]) / 1e9 - 0.000000001)
+            if timestamp_ns == stream_edge_ts:
+                stream_edge_keys.add(key)
+            else:
+                stream_edge_ts = timestamp_ns
+                stream_edge_keys = {key}
+
+            if boundary_ts is not None:
+                # Строки за курсором уже были получены на предыдущих страницах
+                if direction == "backward" and timestamp_ns > boundary_ts:
+                    continue
+                if direction != "backward" and timestamp_ns < boundary_ts:
+                    continue
+                if timestamp_ns == boundary_ts and key in boundary_keys:
+                    continue
+
+            if label_id is not None:
+                page.logs.append(timestamp_ns, log_line, label_id)
+            else:
+                page.logs.append(self._build_log_entry(timestamp_ns, log_line, labels, decoder))
+
+        if stream_edge_ts is not None:
+            self._merge_page_edge(page, stream_edge_ts, stream_edge_keys, direction)
+
+        page.latency_seconds = time.perf_counter() - started_at
+        page.parse_seconds = max(page.latency_seconds - page.wait_seconds, 0.0)
+        return page
+
+    @staticmethod
+    def _merge_page_edge(page: QueryRangePage, stream_edge_ts: int, stream_edge_keys: set[tuple], direction: str) -> None:
+        if page.edge_ts is None or (
+                stream_edge_ts < page.edge_ts if direction == "backward" else stream_edge_ts > page.edge_ts
+        ):
+            page.edge_ts = stream_edge_ts
+            page.edge_keys = set(stream_edge_keys)
+        elif stream_edge_ts == page.edge_ts:
+            page.edge_keys |= stream_edge_keys
+
+    async def _iter_page_values(self, params: dict, page: QueryRangePage) -> AsyncIterator[tuple[dict, str, str]]:
+        """
+        Пары (timestamp, строка) ответа /query_range вместе с labels их стрима.
+
+        При stream_decoding ответ разбирается инкрементально из потока байт: пары отдаются
+        по мере разбора, и ни тело ответа целиком, ни дерево JSON в памяти не держатся.
+        Labels одного стрима отдаются одним и тем же объектом.
+
+        В page записываются размер ответа, время ожидания Loki и сети и data.stats.summary -
+        в ответе Loki они идут после result, поэтому заполнены только после последней пары.
+        """
+        if not self.stream_decoding:
+            requested_at = time.perf_counter()
+            response = await self.client.get(
+                "/query_range",
+                params=params,
+            )
+            page.wait_seconds = time.perf_counter() - requested_at
+            page.response_bytes = len(response.content)
+
+            data = response.json()
+            if data.get("status") != "success":
+                return
+
+            page.loki_stats = data.get("data", {}).get("stats", {}).get("summary", {})
+            for stream in data.get("data", {}).get("result", []):
+                labels = stream.get("stream", {})
+                for timestamp_ns, log_line in stream.get("values", []):
+                    yield labels, timestamp_ns, log_line
+            return
+
+        requested_at = time.perf_counter()
+        async with self.client.stream("GET", "/query_range", params=params) as response:
+            reader = _AsyncByteReader(response.aiter_bytes())
+            reader.wait_seconds = time.perf_counter() - requested_at
+            labels: dict = {}
+            label_key = None
+            value_pair: list[str] = []
+
+            try:
+                async for prefix, event, value in ijson.parse_async(reader):
+                    if prefix == "data.result.item.values.item.item":
+                        value_pair.append(value)
+                        if len(value_pair) == 2:
+                            yield labels, value_pair[0], value_pair[1]
+                            value_pair = []
+                    elif prefix == "data.result.item" and event == "start_map":
+                        labels = {}
+                    elif prefix == "data.result.item.stream" and event == "map_key":
+                        label_key = value
+                    elif prefix.startswith("data.result.item.stream.") and event not in ("start_map", "start_array"):
+                        labels[label_key] = value
+                    elif prefix.startswith("data.stats.summary.") and event == "number":
+                        # ijson отдаёт дробные числа как Decimal
+                        page.loki_stats[prefix[len("data.stats.summary."):]] = (
+                            value if isinstance(value, int) else float(value)
+                        )
+                    elif prefix == "status" and value != "success":
+                        return
+            finally:
+                page.wait_seconds = reader.wait_seconds
+                page.response_bytes = reader.bytes_read
+
+    def _build_log_entry(
+            self,
+            timestamp_ns: int,
+            log_line: str,
+            labels: dict,
+            decoder: Optional[LogLineDecoder],
+    ) -> dict:
+        log_entry = {
+            "timestamp": ns_to_datetime(timestamp_ns),
+            "timestamp_ns": timestamp_ns,
+            "message": log_line,
+        }
+
+        log_entry.update(labels)
+
+        if decoder is not None:
+            parsed_fields = decoder.decode(log_line)
+            if parsed_fields:
+                log_entry.update(parsed_fields)
+
+        return log_entry
+
+    @staticmethod
+    def _datetime_to_ns(value: datetime) -> int:
+        return datetime_to_ns(value)
+
+    async def tail(
+            self,
+            filters: dict = None,
+            content_filters: dict = None,
+            search_text: str | list[str] = None,
+            search_mode: str = "and",
+            line_regex: str | list[str] = None,
+            parser: str = None,
+            keep_labels: list[str] = None,
+            drop_labels: list[str] = None,
+            line_format: str = None,
+            start_time: datetime = None,
+            parse_json: bool = True,
+            fields: list[str] = None,
+            delay_for: int = 0,
+            buffer_size: int = 10000,
+            use_websocket: bool = True,
+            poll_interval: float = 2.0,
+            batch_size: int = 5000,
+            reconnect_delay: float = 1.0,
+            max_reconnect_delay: float = 30.0,
+    ) -> AsyncIterator[dict]:
+        """
+        Бесконечный поток новых логов (live tail)
+
+        Читает websocket /tail, а если Loki (или прокси перед ним) не принимает websocket -
+        опрашивает /query_range от последнего полученного timestamp. При обрыве соединения
+        переподключается и продолжает с последнего timestamp, отбрасывая уже отданные строки.
+
+        Args:
+            filters, content_filters, search_text, search_mode, line_regex, parser,
+            keep_labels, drop_labels, line_format, parse_json, fields: как в query_logs
+            start_time: С какого момента начать (по умолчанию - сейчас)
+            delay_for: Задержка в секундах, которую Loki ждёт запоздавшие логи (не больше 5)
+            buffer_size: Ёмкость внутреннего буфера; при заполнении чтение из Loki приостанавливается
+            use_websocket: Использовать /tail; False - сразу опрос /query_range
+            poll_interval: Интервал опроса в режиме /query_range, секунды
+            batch_size: Размер страницы в режиме /query_range
+            reconnect_delay: Начальная задержка перед переподключением, секунды
+            max_reconnect_delay: Максимальная задержка перед переподключением, секунды
+        """
+        query = self._build_logql_query(
+            filters or {},
+            content_filters or {},
+            search_text,
+            search_mode,
+            line_regex,
+            parser,
+            keep_labels,
+            drop_labels,
+            line_format,
+        )
+        decoder = LogLineDecoder(fields) if parse_json else None
+        cursor = _TailCursor(self._datetime_to_ns(start_time or datetime.now()))
+        buffer: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+
+        async def produce() -> None:
+            websocket_enabled = use_websocket
+            current_delay = reconnect_delay
+            while True:
+                try:
+                    if websocket_enabled:
+                        await self._tail_websocket(query, cursor, decoder, buffer, delay_for, batch_size)
                     else:
-                        # При forward сортировке логи идут от старых к новым
-                        newest_log = batch_logs[-1]
-                        # Для forward меняем start_time
-                        start_time = datetime.fromtimestamp(int(newest_log["timestamp_ns"]) / 1e9 + 0.000000001)
-                else:
-                    break
+                        await self._tail_polling(query, cursor, decoder, buffer, delay_for, batch_size)
+                        await asyncio.sleep(poll_interval)
+                    current_delay = reconnect_delay
+                except InvalidHandshake:
+                    # /tail недоступен - дальше работаем опросом
+                    websocket_enabled = False
+                except (ConnectionClosed, httpx.HTTPError, OSError):
+                    await asyncio.sleep(current_delay)
+                    current_delay = min(current_delay * 2, max_reconnect_delay)
+                except Exception as err:
+                    await buffer.put(err)
+                    return
 
-            except Exception as e:
-                raise e
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                item = await buffer.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
 
-        return all_logs
+    async def _tail_websocket(
+            self,
+            query: str,
+            cursor: "_TailCursor",
+            decoder: Optional[LogLineDecoder],
+            buffer: asyncio.Queue,
+            delay_for: int,
+            batch_size: int,
+    ) -> None:
+        params = urlencode({
+            "query": query,
+            "start": cursor.timestamp_ns,
+            "delay_for": delay_for,
+            "limit": batch_size,
+        })
+        url = self.client.base_url.replace("http", "ws", 1) + "/tail?" + params
+
+        async with websocket_connect(url, max_size=None) as websocket:
+            async for message in websocket:
+                data = json.loads(message)
+                for stream in data.get("streams") or []:
+                    await self._put_tail_values(stream, cursor, decoder, buffer)
+
+    async def _tail_polling(
+            self,
+            query: str,
+            cursor: "_TailCursor",
+            decoder: Optional[LogLineDecoder],
+            buffer: asyncio.Queue,
+            delay_for: int,
+            batch_size: int,
+    ) -> None:
+        end_ns = time.time_ns() - delay_for * 1_000_000_000
+        if end_ns <= cursor.timestamp_ns:
+            return
+
+        async for batch_logs in self._iter_range_batches(
+                query, cursor.timestamp_ns, end_ns, "forward", decoder, None, batch_size
+        ):
+            for log_entry in batch_logs:
+                if cursor.accept(log_entry["timestamp_ns"], log_entry["message"]):
+                    await buffer.put(log_entry)
+
+    async def _put_tail_values(
+            self,
+            stream: dict,
+            cursor: "_TailCursor",
+            decoder: Optional[LogLineDecoder],
+            buffer: asyncio.Queue,
+    ) -> None:
+        labels = stream.get("stream", {})
+        for timestamp_ns, log_line in stream.get("values", []):
+            timestamp_ns = int(timestamp_ns)
+            if cursor.accept(timestamp_ns, log_line):
+                await buffer.put(self._build_log_entry(timestamp_ns, log_line, labels, decoder))
+
+    async def push(self, streams: list[tuple[dict, list[tuple]]]) -> None:
+        """
+        Запись логов через /push.
+
+        Args:
+            streams: Пары (labels стрима, записи), запись - (timestamp в нс, строка) или
+                (timestamp в нс, строка, structured metadata). Записи стрима сортируются по времени.
+        """
+        payload = {"streams": []}
+        for labels, entries in streams:
+            values = []
+            for entry in sorted(entries, key=lambda entry: entry[0]):
+                value = [str(entry[0]), entry[1]]
+                if len(entry) > 2 and entry[2]:
+                    value.append({key: str(item) for key, item in entry[2].items() if item is not None})
+                values.append(value)
+            if values:
+                payload["streams"].append({"stream": labels, "values": values})
+
+        if not payload["streams"]:
+            return
+
+        await self.client.post(
+            "/push",
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"},
+        )
+
+    async def query_metric(
+            self,
+            query: str,
+            time: datetime = None,
+    ) -> MetricVector:
+        """
+        Instant-запрос метрики LogQL (count_over_time, sum by (...), quantile_over_time, unwrap ...)
+
+        Агрегация выполняется на стороне Loki, по сети передаются только итоговые значения.
+
+        Args:
+            query: Метрический LogQL запрос (см. build_metric_query)
+            time: Момент вычисления (по умолчанию - сейчас)
+
+        Returns:
+            MetricVector с labels и значениями каждого ряда
+        """
+        if time is None:
+            time = datetime.now()
+
+        response = await self.client.get(
+            "/query",
+            params={
+                "query": query,
+                "time": self._datetime_to_ns(time),
+            },
+        )
+        data = response.json()
+
+        vector = MetricVector(timestamp=time.timestamp())
+        if data.get("status") != "success":
+            return vector
+
+        result_type = data.get("data", {}).get("resultType")
+        result = data.get("data", {}).get("result", [])
+
+        if result_type == "scalar":
+            vector.metrics.append({})
+            vector.values.append(float(result[1]))
+        elif result_type == "vector":
+            for sample in result:
+                vector.metrics.append(sample.get("metric", {}))
+                vector.values.append(float(sample["value"][1]))
+        else:
+            raise ValueError(f"Запрос вернул {result_type}, а не vector. Для логов используйте query_logs")
+
+        return vector
+
+    async def query_metric_range(
+            self,
+            query: str,
+            start_time: datetime = None,
+            end_time: datetime = None,
+            step: timedelta = timedelta(minutes=1),
+    ) -> list[MetricSeries]:
+        """
+        Range-запрос метрики LogQL
+
+        Args:
+            query: Метрический LogQL запрос (см. build_metric_query)
+            start_time: Начало временного диапазона (по умолчанию - 1 час назад)
+            end_time: Конец временного диапазона (по умолчанию - сейчас)
+            step: Шаг между точками ряда
+
+        Returns:
+            Список рядов MetricSeries с timestamps и values в виде массивов float
+        """
+        if end_time is None:
+            end_time = datetime.now()
+        if start_time is None:
+            start_time = end_time - timedelta(hours=1)
+
+        response = await self.client.get(
+            "/query_range",
+            params={
+                "query": query,
+                "start": self._datetime_to_ns(start_time),
+                "end": self._datetime_to_ns(end_time),
+                "step": step.total_seconds(),
+            },
+        )
+        data = response.json()
+
+        if data.get("status") != "success":
+            return []
+
+        result_type = data.get("data", {}).get("resultType")
+        if result_type != "matrix":
+            raise ValueError(f"Запрос вернул {result_type}, а не matrix. Для логов используйте query_logs")
+
+        series_list = []
+        for stream in data.get("data", {}).get("result", []):
+            series = MetricSeries(metric=stream.get("metric", {}))
+            for timestamp, value in stream.get("values", []):
+                series.timestamps.append(float(timestamp))
+                series.values.append(float(value))
+            series_list.append(series)
+
+        return series_list
+
+    def build_metric_query(
+            self,
+            function: str,
+            range_interval: str,
+            filters: dict = None,
+            content_filters: dict = None,
+            search_text: str | list[str] = None,
+            search_mode: str = "and",
+            line_regex: str | list[str] = None,
+            parser: str = None,
+            unwrap: str = None,
+            quantile: float = None,
+            aggregation: str = None,
+            by: list[str] = None,
+    ) -> str:
+        """
+        Собирает метрический LogQL запрос поверх тех же фильтров, что и query_logs
+
+        Примеры:
+            build_metric_query("count_over_time", "5m", ..., aggregation="sum", by=["method"])
+            -> sum by (method) (count_over_time({...} [5m]))
+
+            build_metric_query("quantile_over_time", "5m", ..., parser="logfmt",
+                               unwrap="duration_ms", quantile=0.99, by=["method"])
+            -> quantile_over_time(0.99, {...} | logfmt | unwrap duration_ms [5m]) by (method)
+
+        Args:
+            function: Range-функция (count_over_time, rate, sum_over_time, quantile_over_time, ...)
+            range_interval: Окно range-функции в формате LogQL ("1m", "5m", "1h")
+            unwrap: Label, значение которого агрегируется (обязателен для *_over_time кроме count/rate/bytes)
+            quantile: Квантиль для quantile_over_time
+            aggregation: Внешняя агрегация (sum, avg, min, max, count)
+            by: Labels для группировки
+        """
+        if function not in LOG_RANGE_FUNCTIONS and function not in UNWRAP_RANGE_FUNCTIONS:
+            raise ValueError(f"Неподдерживаемая функция: {function}")
+        if function in UNWRAP_RANGE_FUNCTIONS and not unwrap:
+            raise ValueError(f"Функции {function} нужен unwrap")
+        if function == "quantile_over_time" and quantile is None:
+            raise ValueError("Для quantile_over_time нужен quantile")
+        if aggregation is not None and aggregation not in VECTOR_AGGREGATIONS:
+            raise ValueError(f"Неподдерживаемая агрегация: {aggregation}")
+
+        log_query = self._build_logql_query(
+            filters or {},
+            content_filters or {},
+            search_text,
+            search_mode,
+            line_regex,
+            parser,
+        )
+        if unwrap:
+            log_query += f" | unwrap {unwrap}"
+
+        range_expression = f"{log_query} [{range_interval}]"
+        if function == "quantile_over_time":
+            range_expression = f"{quantile}, {range_expression}"
+        query = f"{function}({range_expression})"
+
+        grouping = f" by ({', '.join(by)})" if by else ""
+        if aggregation is not None:
+            return f"{aggregation}{grouping} ({query})"
+        if grouping and function in UNWRAP_RANGE_FUNCTIONS:
+            return query + grouping
+        if grouping:
+            # count_over_time и прочие функции над строками не поддерживают by без внешней агрегации
+            return f"sum{grouping} ({query})"
+
+        return query
+
+    async def estimate_volume(
+            self,
+            filters: dict,
+            start_time: datetime,
+            end_time: datetime,
+    ) -> Optional[VolumeEstimate]:
+        """
+        Оценка объёма логов стримов filters в окне по индексу Loki.
+
+        Сначала запрашивается /index/stats (строки, байты, стримы), если он недоступен -
+        /index/volume (только байты). None, если Loki не поддерживает ни один из них.
+        """
+        selector = self._build_stream_selector(filters)
+        params = {
+            "query": selector,
+            "start": self._datetime_to_ns(start_time),
+            "end": self._datetime_to_ns(end_time),
+        }
 
-    def _parse_log_line(self, log_line: str) -> Optional[Dict[str, Any]]:
         try:
-            parsed = json.loads(log_line)
-            if isinstance(parsed, dict):
-                return parsed
-        except (json.JSONDecodeError, ValueError):
+            response = await self.client.get("/index/stats", params=params)
+            data = response.json()
+            return VolumeEstimate(
+                bytes=int(data.get("bytes", 0)),
+                entries=int(data.get("entries", 0)),
+                streams=int(data.get("streams", 0)),
+                source="index_stats",
+            )
+        except (httpx.HTTPStatusError, ValueError):
             pass
 
         try:
-            fields = {}
-            pattern = r'(\w+)=("(?:[^"\\]|\\.)*"|[^\s]+)'
-            matches = re.findall(pattern, log_line)
-
-            if matches:
-                for key, value in matches:
-                    if value.startswith('"') and value.endswith('"'):
-                        value = value[1:-1]
-
-                    try:
-                        if '.' in value:
-                            fields[key] = float(value)
-                        else:
-                            fields[key] = int(value)
-                    except ValueError:
-                        if value.lower() in ('true', 'false'):
-                            fields[key] = value.lower() == 'true'
-                        else:
-                            fields[key] = value
-
-                if fields:
-                    return fields
-        except Exception:
-            pass
+            # Агрегируем по первому label селектора, чтобы не упереться в limit по числу рядов
+            target_label = next(iter(filters), "service_name")
+            response = await self.client.get(
+                "/index/volume",
+                params={**params, "aggregateBy": "labels", "targetLabels": target_label},
+            )
+            data = response.json()
+        except (httpx.HTTPStatusError, ValueError):
+            return None
+
+        if data.get("status") != "success":
+            return None
+
+        result = data.get("data", {}).get("result", [])
+        return VolumeEstimate(
+            bytes=sum(int(float(sample["value"][1])) for sample in result),
+            streams=None,
+            source="index_volume",
+        )
+
+    async def _plan_query(self, log_query: LogQuery) -> QueryPlan:
+        """
+        План запроса по оценке объёма стримов filters. Индекс знает только stream selector,
+        поэтому при content_filters, search_text или line_regex оценка помечается как верхняя
+        граница (filtered=False) и планировщик по ней не отклоняет запрос.
+        """
+        estimate = await self.estimate_volume(log_query.filters, log_query.start_time, log_query.end_time)
+        if estimate is not None and (log_query.content_filters or log_query.search_text or log_query.line_regex):
+            estimate.filtered = False
+        return self.planner.plan(estimate, log_query.batch_size, log_query.limit, log_query.shards)
+
+    @staticmethod
+    def _refusal_error(query_plan: QueryPlan) -> common.ErrQueryTooLarge:
+        estimate = query_plan.estimate
+        if estimate.entries is not None:
+            volume = f"~{estimate.entries} строк, ~{estimate.bytes // (1024 * 1024)} МБ"
+        else:
+            volume = f"~{estimate.bytes // (1024 * 1024)} МБ"
+        return common.ErrQueryTooLarge(
+            f"Слишком большой объём логов за выбранный период ({volume}). Сузьте диапазон времени или добавьте фильтры",
+            estimated_entries=estimate.entries,
+            estimated_bytes=estimate.bytes,
+        )
+
+    async def labels(
+            self,
+            start_time: datetime = None,
+            end_time: datetime = None,
+    ) -> list[str]:
+        """Имена индексированных labels стримов, у которых есть логи в окне"""
+        return await self._discover("/labels", {}, start_time, end_time)
+
+    async def label_values(
+            self,
+            name: str,
+            start_time: datetime = None,
+            end_time: datetime = None,
+            query: str = None,
+    ) -> list[str]:
+        """
+        Значения label name в окне.
 
-        return None
+        Args:
+            name: Имя label
+            start_time: Начало окна (по умолчанию - 1 час назад)
+            end_time: Конец окна (по умолчанию - сейчас)
+            query: Stream selector, которым ограничиваются стримы (например, '{service_name="loom-tg-bot"}')
+        """
+        params = {"query": query} if query else {}
+        return await self._discover(f"/label/{name}/values", params, start_time, end_time)
+
+    async def series(
+            self,
+            match: str | list[str],
+            start_time: datetime = None,
+            end_time: datetime = None,
+    ) -> list[dict]:
+        """Наборы labels стримов, подходящих под stream selector (или любой из списка)"""
+        if isinstance(match, str):
+            match = [match]
+        return await self._discover("/series", {"match[]": list(match)}, start_time, end_time)
+
+    async def narrow_filters(
+            self,
+            filters: dict,
+            content_filters: dict,
+            start_time: datetime = None,
+            end_time: datetime = None,
+    ) -> tuple[dict, dict]:
+        """
+        Переносит фильтры по индексированным labels из content_filters в stream selector.
+
+        Фильтр | label=`value` Loki применяет к каждой строке всех выбранных стримов, а
+        {label="value"} отсекает лишние стримы по индексу. Переносится только label, который
+        есть у каждого стрима, выбранного filters, за окно запроса (/series по их selector):
+        тот же ключ может быть label у других сервисов и structured metadata у этого - в
+        selector он отсёк бы все строки. Фильтры по полям строк и structured metadata
+        остаются в content_filters.
+
+        Returns:
+            (filters, content_filters) - новые словари, исходные не изменяются
+        """
+        if not content_filters:
+            return dict(filters or {}), {}
+
+        streams = await self.series(self._build_stream_selector(filters or {}), start_time, end_time)
+        indexed_labels = set(streams[0]).intersection(*streams[1:]) if streams else set()
+
+        narrowed_filters = dict(filters or {})
+        remaining_filters = {}
+        for key, value in content_filters.items():
+            if key in indexed_labels and key not in narrowed_filters:
+                narrowed_filters[key] = value
+            else:
+                remaining_filters[key] = value
+
+        return narrowed_filters, remaining_filters
+
+    async def _discover(
+            self,
+            path: str,
+            params: dict,
+            start_time: Optional[datetime],
+            end_time: Optional[datetime],
+    ) -> list:
+        if end_time is None:
+            end_time = datetime.now()
+        if start_time is None:
+            start_time = end_time - timedelta(hours=1)
+
+        start_ns = self._datetime_to_ns(start_time)
+        end_ns = self._datetime_to_ns(end_time)
+
+        cache_key = None
+        if self.label_cache is not None:
+            start_ns, end_ns = self.label_cache.window(start_ns, end_ns)
+            cache_key = (path, tuple(sorted((key, str(value)) for key, value in params.items())), start_ns, end_ns)
+            cached = self.label_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        response = await self.client.get(
+            path,
+            params={**params, "start": start_ns, "end": end_ns},
+        )
+        data = response.json()
+        if data.get("status") != "success":
+            return []
+
+        result = data.get("data") or []
+        if cache_key is not None:
+            self.label_cache.put(cache_key, result)
+        return result
 
     def _build_logql_query(
             self,
             filters: Dict[str, str],
             content_filters: Dict[str, str],
             search_text: Optional[str | List[str]] = None,
-            search_mode: str = "and"
+            search_mode: str = "and",
+            line_regex: Optional[str | List[str]] = None,
+            parser: Optional[str] = None,
+            keep_labels: Optional[List[str]] = None,
+            drop_labels: Optional[List[str]] = None,
+            line_format: Optional[str] = None,
     ) -> str:
-
-        if not filters:
-            query = '{service_name=~".+"}'
-        else:
-            label_selectors = []
-            for key, value in filters.items():
-                label_selectors.append(f'{key}="{value}"')
-            query = "{" + ", ".join(label_selectors) + "}"
-
-        if content_filters:
-            for key, value in content_filters.items():
-                query += f' | {key}=`{value}`'
+        """
+        Собирает LogQL запрос: stream selector, строковые фильтры, парсер, фильтры по полям,
+        keep/drop и line_format - именно в таком порядке, чтобы дешёвые строковые фильтры
+        отсекали строки до парсинга.
+        """
+        query = self._build_stream_selector(filters)
 
         if search_text:
             if isinstance(search_text, str):
@@ -218,14 +1411,131 @@ class LokiClient(interface.ILokiClient):
                     for text in search_text:
                         query += f' |= "{text}"'
                 elif search_mode.lower() == "or":
-                    escaped_texts = [re.escape(text) for text in search_text]
+                    escaped_texts = [escape_re2(text) for text in search_text]
                     regex_pattern = "|".join(escaped_texts)
-                    query += f' |~ "({regex_pattern})"'
+                    query += f' |~ {self._quote_logql_string(f"({regex_pattern})")}'
                 else:
                     raise ValueError(f"Неподдерживаемый режим поиска: {search_mode}. Используйте 'and' или 'or'")
 
+        if line_regex:
+            if isinstance(line_regex, str):
+                line_regex = [line_regex]
+            for pattern in line_regex:
+                query += f' |~ {self._quote_logql_string(pattern)}'
+
+        if parser:
+            if parser not in ("json", "logfmt"):
+                raise ValueError(f"Неподдерживаемый парсер: {parser}. Используйте 'json' или 'logfmt'")
+            query += f' | {parser}'
+
+        if content_filters:
+            for key, value in content_filters.items():
+                if isinstance(value, (list, tuple, set, frozenset)):
+                    query += f' | {key}=~{self._quote_logql_string(self._any_value_regex(value))}'
+                else:
+                    query += f' | {key}=`{value}`'
+
+        if keep_labels:
+            query += ' | keep ' + ", ".join(keep_labels)
+
+        if drop_labels:
+            query += ' | drop ' + ", ".join(drop_labels)
+
+        if line_format:
+            query += f' | line_format {self._quote_logql_string(line_format)}'
+
         return query
 
+    @staticmethod
+    def _build_stream_selector(filters: Dict[str, str]) -> str:
+        if not filters:
+            return '{service_name=~".+"}'
+
+        label_selectors = []
+        for key, value in filters.items():
+            if isinstance(value, (list, tuple, set, frozenset)):
+                label_selectors.append(f'{key}=~{LokiClient._quote_logql_string(LokiClient._any_value_regex(value))}')
+            else:
+                label_selectors.append(f'{key}="{value}"')
+        return "{" + ", ".join(label_selectors) + "}"
+
+    @staticmethod
+    def _any_value_regex(values) -> str:
+        """
+        Регулярное выражение "одно из значений" для фильтра со списком значений
+        (account_id=~`1|2|3`). Регулярки в матчерах labels Loki якорит сам.
+        """
+        return "|".join(escape_re2(str(value)) for value in values)
+
+    @staticmethod
+    def _quote_logql_string(value: str) -> str:
+        # В обратных кавычках LogQL не обрабатывает escape-последовательности, что удобно для regex
+        if "`" not in value:
+            return f"`{value}`"
+        return json.dumps(value, ensure_ascii=False)
+
+class _FetchBudgetExceeded(Exception):
+    """Чтение сегментов кэша остановлено бюджетом запроса"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _AsyncByteReader:
+    """Адаптер потока байт httpx к интерфейсу read(), который ожидает ijson"""
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks
+        # Сколько байт прочитано и сколько времени ушло на ожидание очередного куска
+        self.bytes_read = 0
+        self.wait_seconds = 0.0
+
+    async def read(self, size: int = -1) -> bytes:
+        # ijson вызывает read(0), чтобы определить тип потока
+        if size == 0:
+            return b""
+        requested_at = time.perf_counter()
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+        finally:
+            self.wait_seconds += time.perf_counter() - requested_at
+
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+class _TailCursor:
+    """
+    Позиция live tail: максимальный отданный timestamp и хэши строк на нём.
+
+    После переподключения Loki повторно присылает строки с timestamp курсора,
+    уже отданные из них отбрасываются. Labels в ключ не входят: в режиме опроса
+    строки приходят уже собранными в словари.
+    """
+
+    def __init__(self, timestamp_ns: int):
+        self.timestamp_ns = timestamp_ns
+        self.keys: set[int] = set()
+
+    def accept(self, timestamp_ns: int, log_line: str) -> bool:
+        if timestamp_ns < self.timestamp_ns:
+            # Запоздавшая строка из другого стрима - в поток, курсор не двигаем
+            return True
+
+        key = hash(log_line)
+        if timestamp_ns == self.timestamp_ns:
+            if key in self.keys:
+                return False
+            self.keys.add(key)
+        else:
+            self.timestamp_ns = timestamp_ns
+            self.keys = {key}
+        return True
+
+
 async def main() -> None:
     loki = LokiClient(
         "62.109.23.129",
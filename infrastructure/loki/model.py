@@ -0,0 +1,345 @@
+from array import array
+from dataclasses import KW_ONLY, asdict, dataclass, field, replace
+from datetime import datetime
+from typing import Optional
+
+from .batch import ns_to_datetime
+
+
+@dataclass
+class MetricVector:
+    """
+    Результат instant-запроса (resultType=vector) в колоночном виде:
+    i-й элемент values относится к набору labels metrics[i].
+    """
+    timestamp: float
+    metrics: list[dict] = field(default_factory=list)
+    values: array = field(default_factory=lambda: array("d"))
+
+    def as_dict(self) -> dict[tuple, float]:
+        return {
+            tuple(sorted(metric.items())): value
+            for metric, value in zip(self.metrics, self.values)
+        }
+
+
+@dataclass
+class MetricSeries:
+    """
+    Один ряд результата range-запроса (resultType=matrix).
+    timestamps - unix-время в секундах, values - значения в тех же точках.
+    """
+    metric: dict
+    timestamps: array = field(default_factory=lambda: array("d"))
+    values: array = field(default_factory=lambda: array("d"))
+
+
+@dataclass
+class QueryRangePage:
+    """
+    Одна страница /query_range после разбора.
+
+    logs - новые строки страницы (без уже полученных на прошлых страницах),
+    lines - сколько строк вернул Loki, edge_ts/edge_keys - самый дальний
+    по направлению пагинации timestamp и ключи строк на нём.
+
+    response_bytes, wait_seconds (ожидание Loki и сети), parse_seconds и loki_stats
+    (data.stats.summary ответа) нужны только для телеметрии.
+    """
+    logs: list
+    lines: int = 0
+    edge_ts: Optional[int] = None
+    edge_keys: set = field(default_factory=set)
+    response_bytes: int = 0
+    latency_seconds: float = 0.0
+    wait_seconds: float = 0.0
+    parse_seconds: float = 0.0
+    loki_stats: dict = field(default_factory=dict)
+
+
+@dataclass
+class RangeCheckpoint:
+    """
+    Позиция пагинации одного диапазона [start_ns, end_ns).
+
+    cursor_start_ns/cursor_end_ns - границы следующего запроса, boundary_ts/boundary_keys -
+    граничный timestamp уже отданных строк и ключи (stream, timestamp, строка) строк на нём,
+    fetched - сколько строк диапазона уже отдано, done - диапазон прочитан целиком.
+    """
+    start_ns: int
+    end_ns: int
+    cursor_start_ns: Optional[int] = None
+    cursor_end_ns: Optional[int] = None
+    boundary_ts: Optional[int] = None
+    boundary_keys: set = field(default_factory=set)
+    fetched: int = 0
+    done: bool = False
+
+    def __post_init__(self):
+        if self.cursor_start_ns is None:
+            self.cursor_start_ns = self.start_ns
+        if self.cursor_end_ns is None:
+            self.cursor_end_ns = self.end_ns
+
+    def copy(self) -> "RangeCheckpoint":
+        return replace(self, boundary_keys=set(self.boundary_keys))
+
+    def to_dict(self) -> dict:
+        checkpoint = asdict(self)
+        checkpoint["boundary_keys"] = [
+            [[list(label) for label in stream_key], timestamp_ns, log_line]
+            for stream_key, timestamp_ns, log_line in self.boundary_keys
+        ]
+        return checkpoint
+
+    @classmethod
+    def from_dict(cls, checkpoint: dict) -> "RangeCheckpoint":
+        boundary_keys = {
+            (tuple(tuple(label) for label in stream_key), timestamp_ns, log_line)
+            for stream_key, timestamp_ns, log_line in checkpoint.get("boundary_keys", [])
+        }
+        return cls(**{**checkpoint, "boundary_keys": boundary_keys})
+
+
+@dataclass
+class QueryCheckpoint:
+    """
+    Состояние возобновляемого запроса логов (см. LokiQueryHandle): запрос, параметры разбора
+    и позиции всех диапазонов в порядке выдачи. Сериализуется в JSON через to_dict.
+    """
+    query: str
+    direction: str
+    ranges: list[RangeCheckpoint]
+    parse_json: bool = True
+    fields: Optional[list[str]] = None
+    limit: Optional[int] = None
+    batch_size: int = 5000
+    delivered: int = 0
+
+    @property
+    def done(self) -> bool:
+        return all(range_checkpoint.done for range_checkpoint in self.ranges) or (
+                self.limit is not None and self.delivered >= self.limit
+        )
+
+    def to_dict(self) -> dict:
+        checkpoint = asdict(self)
+        checkpoint["ranges"] = [range_checkpoint.to_dict() for range_checkpoint in self.ranges]
+        return checkpoint
+
+    @classmethod
+    def from_dict(cls, checkpoint: dict) -> "QueryCheckpoint":
+        ranges = [RangeCheckpoint.from_dict(range_checkpoint) for range_checkpoint in checkpoint["ranges"]]
+        return cls(**{**checkpoint, "ranges": ranges})
+
+
+@dataclass
+class LogQuery:
+    """
+    Параметры запроса логов - общие для query_logs, iter_logs, iter_batches и open_query.
+    Позиционно передаются только исходные параметры query_logs (filters ... batch_size),
+    добавленные позже - только по имени.
+
+    filters: Словарь с label selectors (например, {"service_name": "my-service"})
+    content_filters: Словарь для поиска в содержимом логов (например, {"account_id": "1"})
+    search_text: Текст для поиска в логах (строка или список строк)
+    search_mode: Режим поиска - "and" (все строки должны присутствовать) или "or" (хотя бы одна)
+    start_time: Начало временного диапазона (по умолчанию - 1 час назад)
+    end_time: Конец временного диапазона (по умолчанию - сейчас)
+    direction: Направление сортировки ("backward" или "forward")
+    parse_json: Автоматически парсить JSON/logfmt из message
+    limit: Максимальное количество логов (None = без ограничений, получить все)
+    batch_size: Размер одного запроса к Loki (5000 - лимит Loki max_entries_limit_per_query);
+        при adaptive_paging - limit первой страницы
+    line_regex: RE2 выражение (или список выражений) для фильтра |~ по строке лога
+    parser: Парсер строк на стороне Loki - "json" или "logfmt"
+    keep_labels: Оставить в ответе только эти labels (| keep)
+    drop_labels: Убрать из ответа эти labels (| drop)
+    line_format: Шаблон line_format, заменяющий строку лога
+    fields: Какие поля извлекать из logfmt в message (None = все поля; JSON разбирается целиком)
+    shards: На сколько временных поддиапазонов разбить окно (1 = последовательная пагинация)
+    narrow_selector: Переносить content_filters по индексированным labels в stream selector
+        (только если у клиента настроен label_cache, см. LokiClient.narrow_filters)
+    plan: Выбрать стратегию по оценке объёма из индекса Loki (только если у клиента настроен
+        planner); shards тогда используется, только если оценку получить не удалось.
+        В режиме кэша план только отклоняет слишком большие запросы
+    """
+    filters: Optional[dict] = None
+    content_filters: Optional[dict] = None
+    search_text: Optional[str | list[str]] = None
+    search_mode: str = "and"
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    direction: str = "backward"
+    parse_json: bool = True
+    limit: Optional[int] = None
+    batch_size: int = 5000
+    _: KW_ONLY
+    line_regex: Optional[str | list[str]] = None
+    parser: Optional[str] = None
+    keep_labels: Optional[list[str]] = None
+    drop_labels: Optional[list[str]] = None
+    line_format: Optional[str] = None
+    fields: Optional[list[str]] = None
+    shards: int = 1
+    narrow_selector: bool = True
+    plan: bool = True
+
+
+LOG_QUERY_FIELDS = frozenset(LogQuery.__dataclass_fields__)
+
+
+@dataclass
+class QueryBudget:
+    """
+    Ограничения на один запрос логов. None - без ограничения.
+    Проверяются постранично: страница, после которой был бы превышен max_bytes или max_pages,
+    не отдаётся, а по max_rows страница обрезается так, что бюджет строк заполняется целиком.
+    """
+    max_rows: Optional[int] = None
+    max_bytes: Optional[int] = None
+    max_pages: Optional[int] = None
+
+    def merge(self, other: Optional["QueryBudget"]) -> "QueryBudget":
+        """Более строгое из двух ограничений по каждому полю"""
+        if other is None:
+            return self
+
+        def stricter(first: Optional[int], second: Optional[int]) -> Optional[int]:
+            if first is None:
+                return second
+            if second is None:
+                return first
+            return min(first, second)
+
+        return QueryBudget(
+            max_rows=stricter(self.max_rows, other.max_rows),
+            max_bytes=stricter(self.max_bytes, other.max_bytes),
+            max_pages=stricter(self.max_pages, other.max_pages),
+        )
+
+    def exceeded_by(self, rows: int, size: int, pages: int) -> Optional[str]:
+        if self.max_rows is not None and rows > self.max_rows:
+            return "max_rows"
+        if self.max_bytes is not None and size > self.max_bytes:
+            return "max_bytes"
+        if self.max_pages is not None and pages > self.max_pages:
+            return "max_pages"
+        return None
+
+
+@dataclass
+class AdaptivePageSize:
+    """
+    Подбор limit страниц /query_range под целевой размер ответа и время страницы.
+
+    После каждой полной страницы limit пересчитывается по байтам и секундам на строку,
+    сглаженным по предыдущим страницам, так, чтобы следующая страница уложилась и в
+    target_bytes, и в target_seconds. За один шаг limit меняется не более чем в max_step раз
+    и всегда остаётся в [min_limit, max_limit]. max_limit не должен превышать
+    max_entries_limit_per_query Loki (по умолчанию 5000).
+    """
+    target_bytes: int = 2 * 1024 * 1024
+    target_seconds: float = 1.0
+    min_limit: int = 100
+    max_limit: int = 5000
+    max_step: float = 4.0
+    smoothing: float = 0.5
+
+
+@dataclass
+class VolumeEstimate:
+    """
+    Оценка объёма запроса по индексу Loki до фильтров по строкам - оценка сверху.
+    source - "index_stats" (есть число строк) или "index_volume" (только байты).
+    filtered=False - у запроса есть фильтры по содержимому или строкам, которых индекс не знает,
+    и оценка может быть намного больше настоящего объёма.
+    """
+    bytes: int
+    entries: Optional[int] = None
+    streams: Optional[int] = None
+    source: str = "index_stats"
+    filtered: bool = True
+
+
+@dataclass
+class QueryPlan:
+    """
+    Выбранная стратегия выполнения запроса логов:
+    single_page, serial, sharded (с shards шардами) или refuse.
+    """
+    strategy: str
+    shards: int = 1
+    estimate: Optional[VolumeEstimate] = None
+    reason: str = ""
+
+    def attributes(self) -> dict:
+        attributes = {
+            "loki.plan.strategy": self.strategy,
+            "loki.plan.shards": self.shards,
+            "loki.plan.reason": self.reason,
+            "loki.plan.source": self.estimate.source if self.estimate is not None else "none",
+        }
+        if self.estimate is not None:
+            attributes["loki.plan.estimated_bytes"] = self.estimate.bytes
+            if self.estimate.entries is not None:
+                attributes["loki.plan.estimated_entries"] = self.estimate.entries
+            if self.estimate.streams is not None:
+                attributes["loki.plan.estimated_streams"] = self.estimate.streams
+        return attributes
+
+
+@dataclass
+class ExportPart:
+    """
+    Часть файла выгрузки Loki для отдельного обработчика: строки, которые начинаются
+    в байтах [start_offset, end_offset). end_offset=None - до конца файла.
+    """
+    path: str
+    start_offset: int = 0
+    end_offset: Optional[int] = None
+
+    @property
+    def name(self) -> str:
+        if self.start_offset == 0 and self.end_offset is None:
+            return self.path
+        return f"{self.path}[{self.start_offset}:{self.end_offset if self.end_offset is not None else ''}]"
+
+
+@dataclass
+class LokiQueryStats:
+    """
+    Итоги запроса логов, заполняются по мере чтения страниц.
+
+    Если сработал бюджет, truncated=True, а [covered_start_ns, covered_end_ns) - диапазон,
+    который был прочитан полностью.
+
+    pages - отданные страницы результата, requests - запросы /query_range к Loki
+    (страницы из кэша сегментов в requests не входят). Время и объёмы по запросам
+    суммируются: wait_seconds - ожидание Loki и сети, parse_seconds - наш разбор,
+    loki_* - то, что Loki сообщил в data.stats.summary.
+    """
+    rows: int = 0
+    bytes: int = 0
+    pages: int = 0
+    requests: int = 0
+    response_bytes: int = 0
+    wait_seconds: float = 0.0
+    parse_seconds: float = 0.0
+    loki_bytes_processed: int = 0
+    loki_lines_processed: int = 0
+    loki_exec_seconds: float = 0.0
+    loki_queue_seconds: float = 0.0
+    truncated: bool = False
+    truncated_reason: Optional[str] = None
+    covered_start_ns: Optional[int] = None
+    covered_end_ns: Optional[int] = None
+    plan: Optional[QueryPlan] = None
+
+    @property
+    def covered_start(self) -> Optional[datetime]:
+        return ns_to_datetime(self.covered_start_ns) if self.covered_start_ns is not None else None
+
+    @property
+    def covered_end(self) -> Optional[datetime]:
+        return ns_to_datetime(self.covered_end_ns) if self.covered_end_ns is not None else None
@@ -0,0 +1,173 @@
+import time
+from typing import Optional
+
+from opentelemetry import metrics, trace
+from opentelemetry.trace import SpanKind, StatusCode
+
+from .model import LokiQueryStats, QueryRangePage
+
+# Поля data.stats.summary ответа Loki и имена атрибутов событий для них
+LOKI_SUMMARY_ATTRIBUTES = {
+    "totalBytesProcessed": "loki.bytes_processed",
+    "totalLinesProcessed": "loki.lines_processed",
+    "execTime": "loki.exec_time",
+    "queueTime": "loki.queue_time",
+}
+
+# Верхние границы корзин длины окна запроса для атрибута loki.window
+WINDOW_BUCKETS = (
+    (3600, "1h"),
+    (6 * 3600, "6h"),
+    (24 * 3600, "24h"),
+    (7 * 24 * 3600, "7d"),
+)
+
+
+def window_bucket(start_ns: int, end_ns: int) -> str:
+    seconds = (end_ns - start_ns) / 1_000_000_000
+    for bucket_seconds, name in WINDOW_BUCKETS:
+        if seconds <= bucket_seconds:
+            return name
+    return ">7d"
+
+
+class LokiQueryMetrics:
+    """
+    Гистограммы страниц и запросов /query_range.
+
+    Создаются один раз на клиента, атрибуты у всех - форма запроса (см. LokiQueryObserver),
+    чтобы по медленному дашборду было видно, где уходит время: в Loki (exec/queue time),
+    в сети (wait минус exec) или в нашем разборе (parse).
+    """
+
+    def __init__(self, meter: metrics.Meter):
+        self.page_duration = meter.create_histogram(
+            "loki.page.duration", unit="s", description="Полное время получения и разбора страницы"
+        )
+        self.page_wait = meter.create_histogram(
+            "loki.page.wait", unit="s", description="Ожидание ответа Loki и сети за страницу"
+        )
+        self.page_parse = meter.create_histogram(
+            "loki.page.parse", unit="s", description="Время разбора страницы на стороне клиента"
+        )
+        self.page_size = meter.create_histogram(
+            "loki.page.size", unit="By", description="Размер ответа /query_range"
+        )
+        self.page_lines = meter.create_histogram(
+            "loki.page.lines", unit="{line}", description="Строк в странице"
+        )
+        self.loki_exec_time = meter.create_histogram(
+            "loki.page.exec_time", unit="s", description="execTime из data.stats.summary"
+        )
+        self.loki_queue_time = meter.create_histogram(
+            "loki.page.queue_time", unit="s", description="queueTime из data.stats.summary"
+        )
+        self.loki_bytes_processed = meter.create_histogram(
+            "loki.page.bytes_processed", unit="By", description="totalBytesProcessed из data.stats.summary"
+        )
+        self.query_duration = meter.create_histogram(
+            "loki.query.duration", unit="s", description="Полное время запроса логов"
+        )
+        self.query_requests = meter.create_histogram(
+            "loki.query.requests", unit="{request}", description="Запросов /query_range на один запрос логов"
+        )
+
+
+class LokiQueryObserver:
+    """
+    Телеметрия одного запроса логов.
+
+    Открывает дочерний span (текущим он не становится, т.к. живёт между yield генератора),
+    добавляет в него событие на каждую страницу, пишет гистограммы и накапливает
+    суммарные показатели в LokiQueryStats.
+    """
+
+    def __init__(
+            self,
+            tracer: trace.Tracer,
+            query_metrics: LokiQueryMetrics,
+            query: str,
+            shape: dict,
+            stats: LokiQueryStats,
+    ):
+        self.metrics = query_metrics
+        self.shape = shape
+        self.stats = stats
+        self.span = tracer.start_span(
+            "LokiClient.query_range",
+            kind=SpanKind.CLIENT,
+            attributes={**shape, "loki.query": query},
+        )
+        self._started_at = time.perf_counter()
+        self._finished = False
+
+    def record_page(self, page: QueryRangePage, params: dict) -> None:
+        attributes = {
+            "loki.start": params["start"],
+            "loki.end": params["end"],
+            "loki.limit": params["limit"],
+            "page.latency": page.latency_seconds,
+            "page.wait": page.wait_seconds,
+            "page.parse": page.parse_seconds,
+            "page.bytes": page.response_bytes,
+            "page.lines": page.lines,
+            "page.new_lines": len(page.logs),
+        }
+        for field, attribute in LOKI_SUMMARY_ATTRIBUTES.items():
+            if field in page.loki_stats:
+                attributes[attribute] = page.loki_stats[field]
+        self.span.add_event("loki.page", attributes=attributes)
+
+        self.metrics.page_duration.record(page.latency_seconds, self.shape)
+        self.metrics.page_wait.record(page.wait_seconds, self.shape)
+        self.metrics.page_parse.record(page.parse_seconds, self.shape)
+        self.metrics.page_size.record(page.response_bytes, self.shape)
+        self.metrics.page_lines.record(page.lines, self.shape)
+
+        exec_time = page.loki_stats.get("execTime")
+        queue_time = page.loki_stats.get("queueTime")
+        bytes_processed = page.loki_stats.get("totalBytesProcessed")
+        if exec_time is not None:
+            self.metrics.loki_exec_time.record(exec_time, self.shape)
+        if queue_time is not None:
+            self.metrics.loki_queue_time.record(queue_time, self.shape)
+        if bytes_processed is not None:
+            self.metrics.loki_bytes_processed.record(bytes_processed, self.shape)
+
+        self.stats.requests += 1
+        self.stats.response_bytes += page.response_bytes
+        self.stats.wait_seconds += page.wait_seconds
+        self.stats.parse_seconds += page.parse_seconds
+        self.stats.loki_bytes_processed += bytes_processed or 0
+        self.stats.loki_lines_processed += page.loki_stats.get("totalLinesProcessed", 0)
+        self.stats.loki_exec_seconds += exec_time or 0.0
+        self.stats.loki_queue_seconds += queue_time or 0.0
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self._finished:
+            return
+        self._finished = True
+
+        duration = time.perf_counter() - self._started_at
+        self.metrics.query_duration.record(duration, self.shape)
+        self.metrics.query_requests.record(self.stats.requests, self.shape)
+
+        self.span.set_attributes({
+            "loki.rows": self.stats.rows,
+            "loki.pages": self.stats.pages,
+            "loki.requests": self.stats.requests,
+            "loki.response_bytes": self.stats.response_bytes,
+            "loki.wait_seconds": self.stats.wait_seconds,
+            "loki.parse_seconds": self.stats.parse_seconds,
+            "loki.exec_seconds": self.stats.loki_exec_seconds,
+            "loki.truncated": self.stats.truncated,
+        })
+        if self.stats.truncated_reason is not None:
+            self.span.set_attribute("loki.truncated_reason", self.stats.truncated_reason)
+
+        if error is not None:
+            self.span.record_exception(error)
+            self.span.set_status(StatusCode.ERROR, str(error))
+        else:
+            self.span.set_status(StatusCode.OK)
+        self.span.end()
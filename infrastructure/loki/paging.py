@@ -0,0 +1,59 @@
+from typing import Optional
+
+from .model import AdaptivePageSize, QueryRangePage
+
+
+class PageSizer:
+    """
+    limit очередной страницы одной пагинации.
+
+    Без AdaptivePageSize limit постоянный. С ним - стартует с initial_limit и после
+    каждой страницы подстраивается по наблюдаемым байтам и времени на строку (EWMA).
+    """
+
+    def __init__(self, initial_limit: int, config: Optional[AdaptivePageSize] = None):
+        self.config = config
+        self.limit = initial_limit
+        if config is not None:
+            self.limit = self._clamp(initial_limit, config.min_limit, config.max_limit)
+
+        self._bytes_per_line: Optional[float] = None
+        self._seconds_per_line: Optional[float] = None
+
+    def next_limit(self, boundary_lines: int) -> int:
+        """
+        limit следующей страницы. boundary_lines - сколько строк на граничном timestamp уже получено:
+        страница не больше этого числа могла бы целиком состоять из них, и пагинация перешагнула бы
+        timestamp, не дочитав его, поэтому уменьшенный limit не опускается ниже boundary_lines + 1.
+        """
+        if self.config is None:
+            return self.limit
+        return min(max(self.limit, boundary_lines + 1), self.config.max_limit)
+
+    def observe(self, page: QueryRangePage) -> None:
+        config = self.config
+        if config is None or page.lines == 0:
+            return
+
+        self._bytes_per_line = self._smooth(self._bytes_per_line, page.response_bytes / page.lines)
+        self._seconds_per_line = self._smooth(self._seconds_per_line, page.latency_seconds / page.lines)
+
+        candidates = []
+        if self._bytes_per_line > 0:
+            candidates.append(config.target_bytes / self._bytes_per_line)
+        if self._seconds_per_line > 0:
+            candidates.append(config.target_seconds / self._seconds_per_line)
+        if not candidates:
+            return
+
+        target = self._clamp(min(candidates), self.limit / config.max_step, self.limit * config.max_step)
+        self.limit = int(self._clamp(target, config.min_limit, config.max_limit))
+
+    def _smooth(self, previous: Optional[float], observed: float) -> float:
+        if previous is None:
+            return observed
+        return previous + self.config.smoothing * (observed - previous)
+
+    @staticmethod
+    def _clamp(value: float, lower: float, upper: float) -> float:
+        return max(lower, min(upper, value))
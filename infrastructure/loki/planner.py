@@ -0,0 +1,73 @@
+import math
+from typing import Optional
+
+from .model import QueryPlan, VolumeEstimate
+
+
+class QueryPlanner:
+    """
+    Выбор стратегии запроса логов по оценке объёма из индекса Loki
+
+    - single_page: оценка укладывается в одну страницу - один запрос без шардов;
+    - serial: до shard_entries строк - последовательная пагинация;
+    - sharded: больше - параллельные шарды по entries_per_shard строк, не больше max_shards;
+    - refuse: больше max_entries строк или max_bytes байт - запрос не выполняется.
+
+    Оценка индекса не учитывает фильтры по строкам и поэтому завышена. Если у запроса есть такие
+    фильтры (estimate.filtered=False), оценка - только верхняя граница: по ней запрос шардируется,
+    но не отклоняется, иначе запрос по одному аккаунту отклонялся бы из-за объёма всего сервиса.
+
+    Если у Loki есть только /index/volume, число строк оценивается как bytes / bytes_per_entry.
+    Без оценки остаётся стратегия, которую запросил вызывающий код. С limit запрос не
+    отклоняется - он всё равно остановится на limit строках.
+    """
+
+    def __init__(
+            self,
+            shard_entries: int = 200_000,
+            entries_per_shard: int = 100_000,
+            max_shards: int = 8,
+            max_entries: int = 5_000_000,
+            max_bytes: int = 4 * 1024 * 1024 * 1024,
+            bytes_per_entry: int = 400,
+    ):
+        self.shard_entries = shard_entries
+        self.entries_per_shard = entries_per_shard
+        self.max_shards = max_shards
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes_per_entry = bytes_per_entry
+
+    def plan(
+            self,
+            estimate: Optional[VolumeEstimate],
+            batch_size: int,
+            limit: Optional[int],
+            requested_shards: int,
+    ) -> QueryPlan:
+        if estimate is None:
+            return QueryPlan(
+                strategy="sharded" if requested_shards > 1 else "serial",
+                shards=requested_shards,
+                reason="no_estimate",
+            )
+
+        entries = estimate.entries
+        if entries is None:
+            entries = math.ceil(estimate.bytes / self.bytes_per_entry)
+
+        if limit is not None:
+            entries = min(entries, limit)
+        elif estimate.filtered and entries > self.max_entries:
+            return QueryPlan(strategy="refuse", estimate=estimate, reason="max_entries")
+        elif estimate.filtered and estimate.bytes > self.max_bytes:
+            return QueryPlan(strategy="refuse", estimate=estimate, reason="max_bytes")
+
+        if entries < batch_size:
+            return QueryPlan(strategy="single_page", estimate=estimate, reason="fits_page")
+
+        if limit is not None or entries <= self.shard_entries:
+            return QueryPlan(strategy="serial", estimate=estimate, reason="below_shard_threshold")
+
+        shards = max(2, min(self.max_shards, math.ceil(entries / self.entries_per_shard)))
+        return QueryPlan(strategy="sharded", shards=shards, estimate=estimate, reason="above_shard_threshold")
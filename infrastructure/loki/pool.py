@@ -0,0 +1,268 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+from tenacity import AsyncRetrying, RetryCallState, stop_after_attempt, wait_exponential
+
+from pkg.client.client import AsyncHTTPClient, should_retry
+
+ROUTING_STRATEGIES = ("least_outstanding", "ewma")
+
+
+class LokiEndpoint:
+    """Одна реплика Loki (read или query-frontend) и её состояние для балансировки"""
+
+    def __init__(self, host: str, port: int, client: AsyncHTTPClient, root_url: str):
+        self.host = host
+        self.port = port
+        self.client = client
+        self.root_url = root_url
+
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.failed_at = 0.0
+        # Исключённая реплика не получает запросов, пока проба /ready после probe_at не пройдёт
+        self.ejected = False
+        self.ejections = 0
+        self.probe_at = 0.0
+        self.probing = False
+
+    @property
+    def name(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+class LokiEndpointPool:
+    """
+    Пул реплик Loki с интерфейсом AsyncHTTPClient (get, post, stream, retrying, base_url).
+
+    Каждый запрос уходит на доступную реплику с наименьшим числом выполняющихся запросов
+    (least_outstanding) или с наименьшей ожидаемой задержкой - EWMA задержки, умноженной
+    на (outstanding + 1) (ewma). Параллельные страницы и шарды поэтому расходятся по пулу.
+
+    После failure_threshold ошибок подряд (сеть, таймаут, 5xx) реплика исключается на
+    eject_seconds, при повторных исключениях - вдвое дольше, до max_eject_seconds. Когда срок
+    истекает, в фоне запрашивается /ready; реплика возвращается в пул при ответе 200. Если
+    исключены все реплики, запрос идёт на ту, что будет проверена раньше всех.
+
+    Повторы выполняет пул, а не клиенты реплик, поэтому повтор уходит на другую реплику.
+    Кроме ошибок сети пул повторяет и 5xx: ответ неисправной реплики не доходит до вызывающего,
+    пока в пределах retry_attempts есть другие.
+    """
+
+    def __init__(
+            self,
+            endpoints: list[tuple[str, int]],
+            prefix: str = "/loki/api/v1",
+            routing: str = "least_outstanding",
+            ewma_decay: float = 0.3,
+            failure_threshold: int = 3,
+            eject_seconds: float = 10.0,
+            max_eject_seconds: float = 300.0,
+            retry_attempts: int = 3,
+            retry_min_wait: float = 0.1,
+            retry_max_wait: float = 10.0,
+            **client_kwargs,
+    ):
+        if not endpoints:
+            raise ValueError("Нужен хотя бы один endpoint Loki")
+        if routing not in ROUTING_STRATEGIES:
+            raise ValueError(f"Неподдерживаемая стратегия маршрутизации: {routing}. Используйте {', '.join(ROUTING_STRATEGIES)}")
+
+        self.endpoints = []
+        for host, port in endpoints:
+            client = AsyncHTTPClient(host, port, prefix=prefix, retry_attempts=1, **client_kwargs)
+            root_url = client.base_url[:-len(prefix)] if prefix else client.base_url
+            self.endpoints.append(LokiEndpoint(host, port, client, root_url))
+
+        self.routing = routing
+        self.ewma_decay = ewma_decay
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+
+        self.retry_attempts = retry_attempts
+        self.retry_min_wait = retry_min_wait
+        self.retry_max_wait = retry_max_wait
+
+        self._probes: set[asyncio.Task] = set()
+
+    @property
+    def base_url(self) -> str:
+        """base_url реплики, выбранной для следующего запроса (для websocket /tail)"""
+        return self.pick().client.base_url
+
+    def pick(self, exclude: Optional[set] = None) -> LokiEndpoint:
+        """Реплика для следующего запроса; exclude - уже опробованные в этом запросе, если есть другие"""
+        now = time.monotonic()
+        available = []
+        for endpoint in self.endpoints:
+            if not endpoint.ejected:
+                available.append(endpoint)
+            elif endpoint.probe_at <= now:
+                self._start_probe(endpoint)
+
+        if not available:
+            return min(self.endpoints, key=lambda endpoint: endpoint.probe_at)
+
+        if exclude:
+            available = [endpoint for endpoint in available if endpoint.name not in exclude] or available
+
+        # Реплики с ошибкой за последние eject_seconds идут последними: повтор потокового
+        # запроса через retrying() не передаёт exclude и иначе мог бы снова попасть на ту же реплику
+        def recently_failed(endpoint: LokiEndpoint) -> bool:
+            return endpoint.consecutive_failures > 0 and now - endpoint.failed_at < self.eject_seconds
+
+        if self.routing == "ewma":
+            # Реплики без замеров пробуем первыми, чтобы получить по ним EWMA
+            return min(available, key=lambda endpoint: (
+                recently_failed(endpoint),
+                endpoint.ewma_latency is not None,
+                (endpoint.ewma_latency or 0.0) * (endpoint.outstanding + 1),
+            ))
+        return min(available, key=lambda endpoint: (
+            recently_failed(endpoint),
+            endpoint.outstanding,
+            endpoint.ewma_latency or 0.0,
+        ))
+
+    def retrying(self) -> AsyncRetrying:
+        return AsyncRetrying(
+            stop=stop_after_attempt(max(self.retry_attempts, 1)),
+            wait=wait_exponential(
+                multiplier=1,
+                min=self.retry_min_wait,
+                max=self.retry_max_wait,
+            ),
+            retry=self._should_retry,
+            reraise=True,
+        )
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        tried = set()
+        async for attempt in self.retrying():
+            with attempt:
+                endpoint = self.pick(tried)
+                tried.add(endpoint.name)
+                endpoint.outstanding += 1
+                started_at = time.monotonic()
+                try:
+                    response = await endpoint.client._request_with_retry(method, url, **kwargs)
+                except Exception as err:
+                    self._record_failure(endpoint, err)
+                    raise
+                finally:
+                    endpoint.outstanding -= 1
+
+                self._record_success(endpoint, time.monotonic() - started_at)
+                return response
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Потоковый запрос на одну реплику без повторов (см. AsyncHTTPClient.stream)"""
+        endpoint = self.pick()
+        endpoint.outstanding += 1
+        started_at = time.monotonic()
+        try:
+            async with endpoint.client.stream(method, url, **kwargs) as response:
+                # Для EWMA берём время до заголовков ответа - чтение тела зависит от нашего разбора
+                self._record_success(endpoint, time.monotonic() - started_at)
+                yield response
+        except Exception as err:
+            self._record_failure(endpoint, err)
+            raise
+        finally:
+            endpoint.outstanding -= 1
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "endpoint": endpoint.name,
+                "available": not endpoint.ejected,
+                "outstanding": endpoint.outstanding,
+                "ewma_latency": endpoint.ewma_latency,
+                "consecutive_failures": endpoint.consecutive_failures,
+                "ejections": endpoint.ejections,
+            }
+            for endpoint in self.endpoints
+        ]
+
+    async def close(self) -> None:
+        for probe in self._probes:
+            probe.cancel()
+        for endpoint in self.endpoints:
+            await endpoint.client.close()
+
+    def _record_success(self, endpoint: LokiEndpoint, latency: float) -> None:
+        endpoint.consecutive_failures = 0
+        endpoint.ejected = False
+        endpoint.ejections = 0
+        if endpoint.ewma_latency is None:
+            endpoint.ewma_latency = latency
+        else:
+            endpoint.ewma_latency += self.ewma_decay * (latency - endpoint.ewma_latency)
+
+    def _record_failure(self, endpoint: LokiEndpoint, err: BaseException) -> None:
+        if not self._is_endpoint_failure(err):
+            return
+
+        endpoint.consecutive_failures += 1
+        endpoint.failed_at = time.monotonic()
+        if endpoint.consecutive_failures >= self.failure_threshold:
+            self._eject(endpoint)
+
+    def _eject(self, endpoint: LokiEndpoint) -> None:
+        eject_seconds = min(self.eject_seconds * 2 ** endpoint.ejections, self.max_eject_seconds)
+        endpoint.ejected = True
+        endpoint.ejections += 1
+        endpoint.consecutive_failures = 0
+        endpoint.probe_at = time.monotonic() + eject_seconds
+
+    def _start_probe(self, endpoint: LokiEndpoint) -> None:
+        if endpoint.probing:
+            return
+        try:
+            probe = asyncio.get_running_loop().create_task(self._probe(endpoint))
+        except RuntimeError:
+            return
+
+        endpoint.probing = True
+        self._probes.add(probe)
+        probe.add_done_callback(self._probes.discard)
+
+    async def _probe(self, endpoint: LokiEndpoint) -> None:
+        try:
+            # /ready лежит в корне Loki, вне prefix клиента
+            response = await endpoint.client.session.get(f"{endpoint.root_url}/ready")
+            if response.status_code == 200:
+                endpoint.ejected = False
+                endpoint.consecutive_failures = 0
+            else:
+                self._eject(endpoint)
+        except httpx.HTTPError:
+            self._eject(endpoint)
+        finally:
+            endpoint.probing = False
+
+    @classmethod
+    def _should_retry(cls, retry_state: RetryCallState) -> bool:
+        if should_retry(retry_state):
+            return True
+        return retry_state.outcome.failed and cls._is_endpoint_failure(retry_state.outcome.exception())
+
+    @staticmethod
+    def _is_endpoint_failure(err: BaseException) -> bool:
+        if isinstance(err, httpx.TransportError):
+            return True
+        if isinstance(err, httpx.HTTPStatusError):
+            return err.response.status_code >= 500
+        return False
@@ -0,0 +1,241 @@
+import asyncio
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Optional
+
+import httpx
+
+from .batch import LabelTable, LogBatch, first_rows
+from .decoder import LogLineDecoder
+from .model import AdaptivePageSize, LokiQueryStats, QueryBudget, QueryCheckpoint, RangeCheckpoint
+from .observer import LokiQueryObserver, window_bucket
+
+if TYPE_CHECKING:
+    from .loki import LokiClient
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Ошибки, после которых имеет смысл продолжить запрос: сеть, таймауты, 429 и 5xx от Loki"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code == 429 or status_code >= 500
+    return False
+
+
+class LokiQueryHandle:
+    """
+    Возобновляемый запрос логов
+
+    Окно разбито на диапазоны (один при последовательной пагинации, по одному на шард),
+    позиция каждого хранится в checkpoint. Позиция диапазона фиксируется, когда потребитель
+    забрал страницу целиком: в iter_batches - при отдаче страницы, в iter_logs - при отдаче
+    её последней строки. Страницы, полученные, но не отданные целиком (буфер следующих
+    шардов, страница сверх бюджета, итерация, прерванная посреди страницы), после
+    возобновления запрашиваются заново - частично отданная страница отдаётся повторно
+    целиком, но не теряется.
+
+    Если страница не получена и после повторов HTTP-клиента, а ошибка временная, чтение
+    продолжается с checkpoint - до resume_attempts раз подряд без успешной страницы.
+    Незавершённый запрос (ошибка, бюджет, прерванная итерация) можно продолжить позже,
+    в том числе в другом процессе: LokiClient.resume_query(handle.checkpoint.to_dict()).
+    """
+
+    def __init__(
+            self,
+            loki: "LokiClient",
+            checkpoint: QueryCheckpoint,
+            max_concurrency: int = 4,
+            resume_attempts: int = 3,
+            resume_delay: float = 1.0,
+            columnar: bool = False,
+            adaptive_paging: AdaptivePageSize = None,
+            prefetch_pages: int = 2,
+    ):
+        self.loki = loki
+        self.checkpoint = checkpoint
+        self.max_concurrency = max_concurrency
+        self.resume_attempts = resume_attempts
+        self.resume_delay = resume_delay
+        self.columnar = columnar
+        self.adaptive_paging = adaptive_paging if adaptive_paging is not None else loki.adaptive_paging
+        self.prefetch_pages = prefetch_pages
+
+        self.decoder = LogLineDecoder(checkpoint.fields) if checkpoint.parse_json else None
+        self.label_table = LabelTable() if columnar else None
+        self.resumes = 0
+
+    @property
+    def done(self) -> bool:
+        return self.checkpoint.done
+
+    async def iter_logs(
+            self,
+            budget: QueryBudget = None,
+            stats: LokiQueryStats = None,
+    ) -> AsyncIterator[dict]:
+        async for batch_logs, commit in self._iter_uncommitted_batches(budget, stats):
+            last = len(batch_logs) - 1
+            if last < 0:
+                commit()
+            for i, log_entry in enumerate(batch_logs):
+                if i == last:
+                    commit()
+                yield log_entry
+
+    async def iter_batches(
+            self,
+            budget: QueryBudget = None,
+            stats: LokiQueryStats = None,
+    ) -> AsyncIterator[list[dict] | LogBatch]:
+        """
+        Отдаёт оставшиеся страницы запроса в порядке direction.
+
+        Бюджет считается от начала этого вызова; при его срабатывании stats.truncated=True,
+        а checkpoint остаётся незавершённым.
+        """
+        async for batch_logs, commit in self._iter_uncommitted_batches(budget, stats):
+            commit()
+            yield batch_logs
+
+    async def _iter_uncommitted_batches(
+            self,
+            budget: Optional[QueryBudget],
+            stats: Optional[LokiQueryStats],
+    ) -> AsyncIterator[tuple[list[dict] | LogBatch, Callable[[], None]]]:
+        """
+        Страницы вместе с функцией, фиксирующей их в checkpoint: её вызывает потребитель,
+        когда страница отдана целиком
+        """
+        checkpoint = self.checkpoint
+        budget = self.loki.budget.merge(budget)
+        if stats is None:
+            stats = LokiQueryStats()
+
+        shape = {
+            "loki.mode": "resumable",
+            "loki.direction": checkpoint.direction,
+            "loki.window": window_bucket(
+                min(range_checkpoint.start_ns for range_checkpoint in checkpoint.ranges),
+                max(range_checkpoint.end_ns for range_checkpoint in checkpoint.ranges),
+            ),
+            "loki.columnar": self.columnar,
+            "loki.adaptive_paging": self.adaptive_paging is not None,
+        }
+        observer = LokiQueryObserver(self.loki.tracer, self.loki.query_metrics, checkpoint.query, shape, stats)
+
+        rows = 0
+        size = 0
+        pages = 0
+        attempts = 0
+        error = None
+        try:
+            while not checkpoint.done:
+                try:
+                    async for index, batch_logs, snapshot in self._iter_pending_ranges(observer):
+                        attempts = 0
+                        if batch_logs is None:
+                            checkpoint.ranges[index] = snapshot
+                            continue
+
+                        if checkpoint.limit is not None:
+                            batch_logs = first_rows(batch_logs, checkpoint.limit - checkpoint.delivered, checkpoint.direction)
+
+                        batch_bytes = self.loki._batch_bytes(batch_logs)
+                        exceeded = budget.exceeded_by(rows + len(batch_logs), size + batch_bytes, pages + 1)
+                        if exceeded is not None:
+                            stats.truncated = True
+                            stats.truncated_reason = exceeded
+                            return
+
+                        def commit(index=index, snapshot=snapshot, delivered=len(batch_logs)) -> None:
+                            checkpoint.ranges[index] = snapshot
+                            checkpoint.delivered += delivered
+
+                        rows += len(batch_logs)
+                        size += batch_bytes
+                        pages += 1
+                        stats.rows += len(batch_logs)
+                        stats.bytes += batch_bytes
+                        stats.pages += 1
+
+                        yield batch_logs, commit
+
+                        if checkpoint.done:
+                            return
+                except Exception as exc:
+                    if not is_transient_error(exc) or attempts >= self.resume_attempts:
+                        raise
+
+                    attempts += 1
+                    self.resumes += 1
+                    observer.span.add_event("loki.resume", attributes={
+                        "attempt": attempts,
+                        "error": f"{exc.__class__.__name__}: {exc}",
+                    })
+                    await asyncio.sleep(self.resume_delay * 2 ** (attempts - 1))
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            observer.span.set_attribute("loki.resumes", self.resumes)
+            observer.finish(error)
+
+    async def _iter_pending_ranges(
+            self,
+            observer: Optional[LokiQueryObserver],
+    ) -> AsyncIterator[tuple[int, Optional[list[dict] | LogBatch], RangeCheckpoint]]:
+        """
+        Читает незавершённые диапазоны, одновременно не более max_concurrency, и отдаёт
+        (номер диапазона, страница, позиция диапазона после неё) строго в порядке диапазонов.
+        Последним для диапазона отдаётся (номер, None, итоговая позиция).
+
+        Как в LokiClient._iter_ordered_ranges, страницы диапазонов впереди текущего ждут в
+        очереди не длиннее prefetch_pages, и их чтение приостанавливается, пока её не разберут.
+        """
+        checkpoint = self.checkpoint
+        pending = [index for index, range_checkpoint in enumerate(checkpoint.ranges) if not range_checkpoint.done]
+        queues = {index: asyncio.Queue(maxsize=self.prefetch_pages) for index in pending}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch_range(index: int) -> None:
+            async with semaphore:
+                working = checkpoint.ranges[index].copy()
+                limit = None
+                if checkpoint.limit is not None:
+                    # limit диапазона считается вместе с уже отданными из него строками
+                    limit = working.fetched + checkpoint.limit - checkpoint.delivered
+                try:
+                    async for batch_logs in self.loki._iter_range_batches(
+                            checkpoint.query,
+                            working.start_ns,
+                            working.end_ns,
+                            checkpoint.direction,
+                            self.decoder,
+                            limit,
+                            checkpoint.batch_size,
+                            self.label_table,
+                            observer,
+                            self.adaptive_paging,
+                            checkpoint=working,
+                    ):
+                        await queues[index].put((batch_logs, working.copy()))
+                    await queues[index].put((None, working.copy()))
+                except Exception as exc:
+                    await queues[index].put(exc)
+
+        tasks = [asyncio.create_task(fetch_range(index)) for index in pending]
+        try:
+            for index in pending:
+                while True:
+                    item = await queues[index].get()
+                    if isinstance(item, Exception):
+                        raise item
+
+                    batch_logs, snapshot = item
+                    yield index, batch_logs, snapshot
+                    if batch_logs is None:
+                        break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
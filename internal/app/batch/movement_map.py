@@ -0,0 +1,311 @@
+"""
+Пакетный расчёт карт перемещений без HTTP-сервиса - например, по всем аккаунтам за месяц.
+
+Источник - выгрузки Loki (JSON или NDJSON, в том числе .gz) или сам Loki. Разбор строк и
+сведение спанов (MovementMapBuilder, как в DashboardService) выполняются в пуле процессов
+по шардам: для выгрузок шард - файл или часть NDJSON-файла (--chunk-mb), для Loki - аккаунт
+или окно времени (--shard-by). Спаны, у которых начало и завершение попали в разные шарды,
+досводятся в основном процессе, поэтому результат не зависит от разбиения.
+
+Перемещения пишутся по мере готовности шардов в NDJSON или Parquet (нужен pyarrow); порядок
+строк в файле - по шардам. В конце в stderr выводятся пропускная способность и пиковая память.
+
+Запуск из корня репозитория:
+    python -m internal.app.batch.movement_map --input export/*.ndjson --output movements.ndjson
+    python -m internal.app.batch.movement_map --loki loki:3100 --accounts 1,2,3 \\
+        --from 2026-09-01 --to 2026-10-01 --shard-by account --output movements.parquet
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+import orjson
+
+from infrastructure.loki.batch import ns_to_datetime
+from infrastructure.loki.decoder import LogLineDecoder
+from infrastructure.loki.export import iter_export_values, split_export
+from infrastructure.loki.loki import LokiClient
+from infrastructure.loki.model import ExportPart
+from internal.service.dashboard.movement import (
+    END_OPERATION,
+    MOVEMENT_FIELDS,
+    MOVEMENT_LABELS,
+    MOVEMENT_LINE_REGEX,
+    MOVEMENT_SERVICE_NAME,
+    START_OPERATION,
+    MovementMapBuilder,
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+MOVEMENT_COLUMNS = ["account_id", "telegram_username", "start_time", "end_time", "duration", "service", "method"]
+
+
+@dataclass
+class MovementShard:
+    """Единица работы процесса пула: часть выгрузки или запрос к Loki по аккаунту и окну"""
+    name: str
+    export: Optional[ExportPart] = None
+    account_id: Optional[str] = None
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+
+
+@dataclass
+class ShardResult:
+    name: str
+    lines: int = 0
+    movements: list[dict] = field(default_factory=list)
+    # Половины спанов, вторая половина которых может быть в другом шарде
+    unpaired: dict[str, dict[str, dict]] = field(default_factory=dict)
+    seconds: float = 0.0
+
+
+def process_shard(
+        shard: MovementShard,
+        accounts: Optional[frozenset[str]],
+        loki_endpoint: Optional[tuple[str, int]],
+) -> ShardResult:
+    started_at = time.perf_counter()
+    builder = MovementMapBuilder()
+
+    if shard.export is not None:
+        lines = _read_export_shard(shard.export, accounts, builder)
+    else:
+        lines = asyncio.run(_read_loki_shard(shard, loki_endpoint, builder))
+
+    return ShardResult(
+        name=shard.name,
+        lines=lines,
+        movements=builder.movements(),
+        unpaired=builder.unpaired(),
+        seconds=time.perf_counter() - started_at,
+    )
+
+
+def _read_export_shard(
+        part: ExportPart,
+        accounts: Optional[frozenset[str]],
+        builder: MovementMapBuilder,
+) -> int:
+    decoder = LogLineDecoder(MOVEMENT_FIELDS)
+    lines = 0
+    for labels, timestamp_ns, log_line in iter_export_values(part):
+        lines += 1
+        # Тот же отбор, что line_regex в запросе к Loki, но без регулярного выражения
+        if START_OPERATION not in log_line and END_OPERATION not in log_line:
+            continue
+
+        log = {
+            "timestamp": ns_to_datetime(timestamp_ns),
+            "timestamp_ns": timestamp_ns,
+            "message": log_line,
+        }
+        log.update(labels)
+        parsed_fields = decoder.decode(log_line)
+        if parsed_fields:
+            log.update(parsed_fields)
+
+        if accounts is not None and str(log.get("account_id")) not in accounts:
+            continue
+        builder.add(log)
+
+    return lines
+
+
+async def _read_loki_shard(
+        shard: MovementShard,
+        loki_endpoint: tuple[str, int],
+        builder: MovementMapBuilder,
+) -> int:
+    loki = LokiClient(*loki_endpoint)
+    lines = 0
+    try:
+        async for log in loki.iter_logs(
+                filters={
+                    "service_name": MOVEMENT_SERVICE_NAME,
+                },
+                content_filters={
+                    "account_id": shard.account_id,
+                } if shard.account_id is not None else None,
+                line_regex=MOVEMENT_LINE_REGEX,
+                keep_labels=MOVEMENT_LABELS,
+                start_time=shard.start_time,
+                end_time=shard.end_time,
+                direction="forward",
+                fields=MOVEMENT_FIELDS,
+        ):
+            lines += 1
+            builder.add(log)
+    finally:
+        await loki.client.close()
+
+    return lines
+
+
+class NDJSONMovementWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "wb")
+
+    def write(self, movements: list[dict]) -> None:
+        for movement in movements:
+            self.file.write(orjson.dumps(movement) + b"\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetMovementWriter:
+    def __init__(self, path: str):
+        if pyarrow is None:
+            raise ValueError("Для записи в Parquet установите pyarrow")
+
+        self.schema = pyarrow.schema([(column, pyarrow.string()) for column in MOVEMENT_COLUMNS])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, movements: list[dict]) -> None:
+        if not movements:
+            return
+
+        # account_id в логах бывает и числом, и строкой - в файле он всегда строка
+        columns = {
+            column: [
+                str(movement[column]) if movement[column] is not None else None
+                for movement in movements
+            ]
+            for column in MOVEMENT_COLUMNS
+        }
+        self.writer.write_table(pyarrow.table(columns, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def build_shards(args: argparse.Namespace) -> list[MovementShard]:
+    if args.input:
+        return [
+            MovementShard(name=part.name, export=part)
+            for path in args.input
+            for part in split_export(path, args.chunk_mb * 1024 * 1024)
+        ]
+
+    end_time = args.end_time or datetime.now()
+    start_time = args.start_time or end_time - timedelta(hours=args.hours)
+    if start_time >= end_time:
+        raise ValueError("Начало периода должно быть раньше конца")
+
+    windows = [(start_time, end_time)]
+    if args.shard_by == "time":
+        windows = []
+        window_start = start_time
+        while window_start < end_time:
+            window_end = min(window_start + timedelta(hours=args.shard_hours), end_time)
+            windows.append((window_start, window_end))
+            window_start = window_end
+    elif not args.accounts:
+        raise ValueError("Для --shard-by account укажите --accounts")
+
+    return [
+        MovementShard(
+            name=f"account={account_id} {window_start.isoformat()}..{window_end.isoformat()}",
+            account_id=account_id,
+            start_time=window_start,
+            end_time=window_end,
+        )
+        for account_id in (args.accounts or [None])
+        for window_start, window_end in windows
+    ]
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Пакетный расчёт карт перемещений пользователей")
+
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", nargs="+", help="Файлы выгрузки Loki: .json, .ndjson, .jsonl, в т.ч. .gz")
+    source.add_argument("--loki", help="Адрес Loki host:port - читать логи из Loki")
+
+    parser.add_argument("--output", required=True, help="Файл результата: .ndjson или .parquet")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], help="Формат результата, по умолчанию - по расширению")
+    parser.add_argument("--accounts", type=lambda value: [item.strip() for item in value.split(",") if item.strip()],
+                        help="Аккаунты через запятую")
+    parser.add_argument("--from", dest="start_time", type=datetime.fromisoformat, help="Начало периода (ISO 8601)")
+    parser.add_argument("--to", dest="end_time", type=datetime.fromisoformat, help="Конец периода (ISO 8601)")
+    parser.add_argument("--hours", type=int, default=24, help="Длина периода, если не задан --from")
+    parser.add_argument("--shard-by", choices=["account", "time"], default="time", help="Разбиение запросов к Loki")
+    parser.add_argument("--shard-hours", type=int, default=24, help="Длина окна при --shard-by time")
+    parser.add_argument("--chunk-mb", type=int, default=64, help="Размер части NDJSON-выгрузки на один шард")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Число процессов")
+
+    args = parser.parse_args(argv)
+    if args.format is None:
+        args.format = "parquet" if args.output.endswith(".parquet") else "ndjson"
+    return args
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    args = parse_args(argv)
+
+    loki_endpoint = None
+    if args.loki:
+        host, _, port = args.loki.rpartition(":")
+        loki_endpoint = (host, int(port))
+
+    try:
+        shards = build_shards(args)
+        writer = ParquetMovementWriter(args.output) if args.format == "parquet" else NDJSONMovementWriter(args.output)
+    except ValueError as err:
+        sys.exit(str(err))
+    accounts = frozenset(args.accounts) if args.accounts and args.input else None
+
+    started_at = time.perf_counter()
+    lines = 0
+    movements = 0
+    reducer = MovementMapBuilder()
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(shards)))) as executor:
+            futures = [executor.submit(process_shard, shard, accounts, loki_endpoint) for shard in shards]
+            for done, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                writer.write(result.movements)
+                reducer.merge(result.unpaired)
+                lines += result.lines
+                movements += len(result.movements)
+                print(
+                    f"[{done}/{len(shards)}] {result.name}: строк {result.lines}, "
+                    f"перемещений {len(result.movements)}, {result.seconds:.2f} с",
+                    file=sys.stderr,
+                )
+
+        # Спаны, разрезанные границей шардов
+        cross_shard_movements = reducer.movements()
+        writer.write(cross_shard_movements)
+        movements += len(cross_shard_movements)
+    finally:
+        writer.close()
+
+    seconds = time.perf_counter() - started_at
+    # ru_maxrss в Linux - в килобайтах; для детей - максимум по завершившимся процессам пула
+    parent_peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    worker_peak_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(
+        f"шардов: {len(shards)}, строк: {lines}, перемещений: {movements} "
+        f"(из них между шардами: {len(cross_shard_movements)})\n"
+        f"время: {seconds:.2f} с, {lines / seconds:,.0f} строк/с, {movements / seconds:,.0f} перемещений/с\n"
+        f"пиковая память: основной процесс {parent_peak_mb:.1f} МБ, процесс пула {worker_peak_mb:.1f} МБ",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
 from internal import interface
@@ -6,12 +8,14 @@ from internal import interface
 def NewHTTP(
         dashboard_controller: interface.IDashboardController,
         http_middleware: interface.IHttpMiddleware,
-        prefix: str
+        prefix: str,
+        movement_deriver: interface.IMovementEventDeriver = None,
 ):
     app = FastAPI(
         openapi_url=prefix + "/openapi.json",
         docs_url=prefix + "/docs",
         redoc_url=prefix + "/redoc",
+        lifespan=background_tasks_lifespan(movement_deriver),
     )
     include_middleware(app, http_middleware)
     include_dashboard_handlers(app, dashboard_controller, prefix)
@@ -28,6 +32,22 @@ def include_middleware(
     http_middleware.trace_middleware01(app)
 
 
+def background_tasks_lifespan(
+        movement_deriver: interface.IMovementEventDeriver = None,
+):
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if movement_deriver is not None:
+            await movement_deriver.start()
+        try:
+            yield
+        finally:
+            if movement_deriver is not None:
+                await movement_deriver.stop()
+
+    return lifespan
+
+
 def include_dashboard_handlers(
         app: FastAPI,
         dashboard_controller: interface.IDashboardController,
@@ -39,6 +59,24 @@ def include_dashboard_handlers(
         methods=["GET"],
         tags=["Dashboard"],
     )
+    app.add_api_route(
+        prefix + "/user-movement-maps/{hours}",
+        dashboard_controller.get_users_movement_maps,
+        methods=["GET"],
+        tags=["Dashboard"],
+    )
+    app.add_api_route(
+        prefix + "/method-latency/{hours}",
+        dashboard_controller.get_method_latency_stats,
+        methods=["GET"],
+        tags=["Dashboard"],
+    )
+    app.add_api_route(
+        prefix + "/transitions",
+        dashboard_controller.get_handler_transitions,
+        methods=["GET"],
+        tags=["Dashboard"],
+    )
     app.add_api_route(prefix + "/health", heath_check_handler(), methods=["GET"])
 
 
@@ -0,0 +1,7 @@
+class ErrQueryTooLarge(Exception):
+    """Оценка объёма запроса логов превышает допустимую - нужно сузить диапазон или фильтры"""
+
+    def __init__(self, message: str, estimated_entries: int = None, estimated_bytes: int = None):
+        super().__init__(message)
+        self.estimated_entries = estimated_entries
+        self.estimated_bytes = estimated_bytes
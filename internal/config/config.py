@@ -35,3 +35,55 @@ class Config:
 
         self.loki_host = os.getenv("LOOM_LOKI_CONTAINER_NAME", "localhost")
         self.loki_port = int(os.getenv("LOOM_LOKI_HTTP_PORT", "3100"))
+        self.loki_cache_segment_minutes = int(os.getenv("LOOM_LOKI_CACHE_SEGMENT_MINUTES", "15"))
+        self.loki_cache_mutable_minutes = int(os.getenv("LOOM_LOKI_CACHE_MUTABLE_MINUTES", "5"))
+        self.loki_cache_max_mb = int(os.getenv("LOOM_LOKI_CACHE_MAX_MB", "256"))
+        self.loki_max_rows = int(os.getenv("LOOM_LOKI_MAX_ROWS", "1000000"))
+        self.loki_max_mb = int(os.getenv("LOOM_LOKI_MAX_MB", "512"))
+        self.loki_max_pages = int(os.getenv("LOOM_LOKI_MAX_PAGES", "400"))
+        self.loki_adaptive_paging = os.getenv("LOOM_LOKI_ADAPTIVE_PAGING", "true").lower() == "true"
+        self.loki_page_target_kb = int(os.getenv("LOOM_LOKI_PAGE_TARGET_KB", "2048"))
+        self.loki_page_target_ms = int(os.getenv("LOOM_LOKI_PAGE_TARGET_MS", "1000"))
+        self.loki_page_min_limit = int(os.getenv("LOOM_LOKI_PAGE_MIN_LIMIT", "100"))
+        self.loki_page_max_limit = int(os.getenv("LOOM_LOKI_PAGE_MAX_LIMIT", "5000"))
+        self.loki_labels_ttl_seconds = int(os.getenv("LOOM_LOKI_LABELS_TTL_SECONDS", "300"))
+        self.loki_plan_shard_entries = int(os.getenv("LOOM_LOKI_PLAN_SHARD_ENTRIES", "200000"))
+        self.loki_plan_entries_per_shard = int(os.getenv("LOOM_LOKI_PLAN_ENTRIES_PER_SHARD", "100000"))
+        self.loki_plan_max_shards = int(os.getenv("LOOM_LOKI_PLAN_MAX_SHARDS", "8"))
+        self.loki_plan_max_entries = int(os.getenv("LOOM_LOKI_PLAN_MAX_ENTRIES", "5000000"))
+        self.loki_plan_max_mb = int(os.getenv("LOOM_LOKI_PLAN_MAX_MB", "4096"))
+        # Дополнительные реплики Loki через запятую: "loki-read-1:3100,loki-read-2:3100"
+        self.loki_endpoints = [
+            (endpoint.strip().rsplit(":", 1)[0], int(endpoint.strip().rsplit(":", 1)[1]))
+            for endpoint in os.getenv("LOOM_LOKI_ENDPOINTS", "").split(",")
+            if endpoint.strip()
+        ]
+        self.loki_routing = os.getenv("LOOM_LOKI_ROUTING", "least_outstanding")
+
+        # Компактный стрим перемещений (MovementEventDeriver)
+        self.movement_deriver_enabled = os.getenv("LOOM_MOVEMENT_DERIVER_ENABLED", "false").lower() == "true"
+        self.movement_deriver_horizon_minutes = int(os.getenv("LOOM_MOVEMENT_DERIVER_HORIZON_MINUTES", "60"))
+        self.movement_read_derived = os.getenv("LOOM_MOVEMENT_READ_DERIVED", "false").lower() == "true"
+        self.movement_pairing_horizon_minutes = int(os.getenv("LOOM_MOVEMENT_PAIRING_HORIZON_MINUTES", "60"))
+
+        # Накопленные карты перемещений по аккаунтам (MovementStateCache)
+        self.movement_state_enabled = os.getenv("LOOM_MOVEMENT_STATE_ENABLED", "true").lower() == "true"
+        self.movement_state_ttl_minutes = int(os.getenv("LOOM_MOVEMENT_STATE_TTL_MINUTES", "15"))
+        self.movement_state_max_accounts = int(os.getenv("LOOM_MOVEMENT_STATE_MAX_ACCOUNTS", "1000"))
+        self.movement_state_max_mb = int(os.getenv("LOOM_MOVEMENT_STATE_MAX_MB", "64"))
+        self.movement_state_settle_seconds = int(os.getenv("LOOM_MOVEMENT_STATE_SETTLE_SECONDS", "30"))
+
+        # Карты по нескольким аккаунтам одним запросом
+        self.movement_batch_max_accounts = int(os.getenv("LOOM_MOVEMENT_BATCH_MAX_ACCOUNTS", "50"))
+        self.movement_batch_max_rows = int(os.getenv("LOOM_MOVEMENT_BATCH_MAX_ROWS", "2000000"))
+        self.movement_batch_max_concurrency = int(os.getenv("LOOM_MOVEMENT_BATCH_MAX_CONCURRENCY", "2"))
+
+        # Статистика задержек обработчиков по методам
+        self.method_stats_max_rows = int(os.getenv("LOOM_METHOD_STATS_MAX_ROWS", "10000000"))
+
+        # Индекс переходов между обработчиками; пополняется MovementEventDeriver
+        self.transition_index_enabled = os.getenv("LOOM_TRANSITION_INDEX_ENABLED", "false").lower() == "true"
+        self.transition_bucket_minutes = int(os.getenv("LOOM_TRANSITION_BUCKET_MINUTES", "60"))
+        self.transition_retention_hours = int(os.getenv("LOOM_TRANSITION_RETENTION_HOURS", "168"))
+        self.transition_session_gap_minutes = int(os.getenv("LOOM_TRANSITION_SESSION_GAP_MINUTES", "30"))
+        self.transition_top_k = int(os.getenv("LOOM_TRANSITION_TOP_K", "20"))
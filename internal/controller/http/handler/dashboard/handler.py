@@ -1,6 +1,8 @@
+from datetime import datetime
+
 from fastapi.responses import JSONResponse
 
-from internal import interface
+from internal import common, interface, model
 from pkg.log_wrapper import auto_log
 
 from pkg.trace_wrapper import traced_method
@@ -22,13 +24,157 @@ class DashboardController(interface.IDashboardController):
             self,
             account_id: int,
             hours: int = 24,
+            service: str = None,
+            method: str = None,
+            min_duration_ms: float = None,
+            start_time: datetime = None,
+            end_time: datetime = None,
+            limit: int = None,
+            after: str = None,
+    ) -> JSONResponse:
+        try:
+            user_movement_map = await self.dashboard_service.get_user_movement_map(
+                account_id=account_id,
+                hours=hours,
+                query=model.MovementQuery(
+                    service=service,
+                    method=method,
+                    min_duration_ms=min_duration_ms,
+                    start_time=start_time,
+                    end_time=end_time,
+                    limit=limit,
+                    after=after,
+                ),
+            )
+        except (ValueError, common.ErrQueryTooLarge) as err:
+            return JSONResponse(
+                status_code=400,
+                content={"error": str(err)}
+            )
+
+        # Тело ответа остаётся списком перемещений, признак неполной карты и курсор
+        # следующей страницы - в заголовках
+        headers = self._movement_map_headers(user_movement_map)
+        if user_movement_map.next_cursor is not None:
+            headers["X-Movement-Map-Next-Cursor"] = user_movement_map.next_cursor
+
+        return JSONResponse(
+            status_code=201,
+            content=user_movement_map.movements,
+            headers=headers,
+        )
+
+    @auto_log()
+    @traced_method()
+    async def get_users_movement_maps(
+            self,
+            hours: int,
+            account_ids: str,
+    ) -> JSONResponse:
+        """account_ids - аккаунты через запятую: ?account_ids=1,2,3"""
+        try:
+            parsed_account_ids = [
+                int(account_id)
+                for account_id in account_ids.split(",")
+                if account_id.strip()
+            ]
+        except ValueError:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Некорректный список аккаунтов: {account_ids}"}
+            )
+
+        try:
+            users_movement_maps = await self.dashboard_service.get_users_movement_maps(
+                account_ids=parsed_account_ids,
+                hours=hours,
+            )
+        except (ValueError, common.ErrQueryTooLarge) as err:
+            return JSONResponse(
+                status_code=400,
+                content={"error": str(err)}
+            )
+
+        return JSONResponse(
+            status_code=201,
+            content={
+                str(account_id): movements
+                for account_id, movements in users_movement_maps.maps.items()
+            },
+            headers=self._movement_map_headers(users_movement_maps),
+        )
+
+    @auto_log()
+    @traced_method()
+    async def get_method_latency_stats(
+            self,
+            hours: int,
+            account_id: int = None,
+            organization_id: int = None,
     ) -> JSONResponse:
-        user_movement_map = await self.dashboard_service.get_user_movement_map(
-            account_id=account_id,
-            hours=hours,
+        try:
+            method_latency_stats = await self.dashboard_service.get_method_latency_stats(
+                hours=hours,
+                account_id=account_id,
+                organization_id=organization_id,
+            )
+        except (ValueError, common.ErrQueryTooLarge) as err:
+            return JSONResponse(
+                status_code=400,
+                content={"error": str(err)}
+            )
+
+        return JSONResponse(
+            status_code=201,
+            content=method_latency_stats.methods,
+            headers=self._movement_map_headers(method_latency_stats),
         )
 
+    @auto_log()
+    @traced_method()
+    async def get_handler_transitions(
+            self,
+            service: str,
+            method: str,
+            limit: int = 10,
+    ) -> JSONResponse:
+        try:
+            handler_transitions = await self.dashboard_service.get_handler_transitions(
+                service=service,
+                method=method,
+                limit=limit,
+            )
+        except ValueError as err:
+            return JSONResponse(
+                status_code=400,
+                content={"error": str(err)}
+            )
+
         return JSONResponse(
             status_code=201,
-            content=user_movement_map
+            content={
+                "service": handler_transitions.service,
+                "method": handler_transitions.method,
+                "service_name": handler_transitions.service_name,
+                "method_name": handler_transitions.method_name,
+                "next": handler_transitions.next,
+                "previous": handler_transitions.previous,
+            },
         )
+
+    @staticmethod
+    def _movement_map_headers(
+            movement_map: model.MovementMap | model.MovementMaps | model.MethodLatencyStats,
+    ) -> dict[str, str]:
+        headers = {
+            "X-Movement-Map-Truncated": str(movement_map.truncated).lower(),
+            "X-Movement-Map-Evicted-Spans": str(movement_map.evicted_spans),
+        }
+        if movement_map.truncated:
+            for header, covered in (
+                    ("X-Movement-Map-Covered-From", movement_map.covered_start),
+                    ("X-Movement-Map-Covered-To", movement_map.covered_end),
+            ):
+                if covered is not None:
+                    headers[header] = covered.isoformat()
+        return headers
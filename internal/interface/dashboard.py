@@ -1,7 +1,10 @@
 from abc import abstractmethod
+from datetime import datetime
 from fastapi.responses import JSONResponse
 from typing import Protocol
 
+from internal import model
+
 
 class IDashboardController(Protocol):
     @abstractmethod
@@ -9,6 +12,36 @@ class IDashboardController(Protocol):
             self,
             account_id: int,
             hours: int = 24,
+            service: str = None,
+            method: str = None,
+            min_duration_ms: float = None,
+            start_time: datetime = None,
+            end_time: datetime = None,
+            limit: int = None,
+            after: str = None,
+    ) -> JSONResponse: pass
+
+    @abstractmethod
+    async def get_users_movement_maps(
+            self,
+            hours: int,
+            account_ids: str,
+    ) -> JSONResponse: pass
+
+    @abstractmethod
+    async def get_method_latency_stats(
+            self,
+            hours: int,
+            account_id: int = None,
+            organization_id: int = None,
+    ) -> JSONResponse: pass
+
+    @abstractmethod
+    async def get_handler_transitions(
+            self,
+            service: str,
+            method: str,
+            limit: int = 10,
     ) -> JSONResponse: pass
 
 
@@ -18,4 +51,36 @@ class IDashboardService(Protocol):
             self,
             account_id: int,
             hours: int = 24,
-    ) -> list[dict]: pass
+            query: model.MovementQuery = None,
+    ) -> model.MovementMap: pass
+
+    @abstractmethod
+    async def get_users_movement_maps(
+            self,
+            account_ids: list[int],
+            hours: int = 24,
+    ) -> model.MovementMaps: pass
+
+    @abstractmethod
+    async def get_method_latency_stats(
+            self,
+            hours: int = 24,
+            account_id: int = None,
+            organization_id: int = None,
+    ) -> model.MethodLatencyStats: pass
+
+    @abstractmethod
+    async def get_handler_transitions(
+            self,
+            service: str,
+            method: str,
+            limit: int = 10,
+    ) -> model.HandlerTransitions: pass
+
+
+class IMovementEventDeriver(Protocol):
+    @abstractmethod
+    async def start(self) -> None: pass
+
+    @abstractmethod
+    async def stop(self) -> None: pass
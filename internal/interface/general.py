@@ -1,6 +1,6 @@
 from abc import abstractmethod
 from datetime import datetime
-from typing import Protocol, Sequence, Any
+from typing import AsyncIterator, Protocol, Sequence, Any
 
 from fastapi import FastAPI
 
@@ -69,5 +69,67 @@ class ILokiClient(Protocol):
             start_time: datetime = None,
             end_time: datetime = None,
             direction: str = "backward",
-            parse_json: bool = True
-    ) -> list[dict]: pass
\ No newline at end of file
+            parse_json: bool = True,
+            limit: int = None,
+            batch_size: int = 5000,
+            **query_kwargs: Any
+    ) -> list[dict]: pass
+
+    @abstractmethod
+    def iter_logs(
+            self,
+            filters: dict = None,
+            content_filters: dict = None,
+            search_text: str | list[str] = None,
+            search_mode: str = "and",
+            start_time: datetime = None,
+            end_time: datetime = None,
+            direction: str = "backward",
+            parse_json: bool = True,
+            limit: int = None,
+            batch_size: int = 5000,
+            **query_kwargs: Any
+    ) -> AsyncIterator[dict]: pass
+
+    @abstractmethod
+    def iter_batches(
+            self,
+            filters: dict = None,
+            content_filters: dict = None,
+            search_text: str | list[str] = None,
+            search_mode: str = "and",
+            start_time: datetime = None,
+            end_time: datetime = None,
+            direction: str = "backward",
+            parse_json: bool = True,
+            limit: int = None,
+            batch_size: int = 5000,
+            **query_kwargs: Any
+    ) -> AsyncIterator[list[dict]]: pass
+
+    @abstractmethod
+    async def labels(
+            self,
+            start_time: datetime = None,
+            end_time: datetime = None,
+    ) -> list[str]: pass
+
+    @abstractmethod
+    async def label_values(
+            self,
+            name: str,
+            start_time: datetime = None,
+            end_time: datetime = None,
+            query: str = None,
+    ) -> list[str]: pass
+
+    @abstractmethod
+    async def series(
+            self,
+            match: str | list[str],
+            start_time: datetime = None,
+            end_time: datetime = None,
+    ) -> list[dict]: pass
+
+    @abstractmethod
+    async def push(self, streams: list[tuple[dict, list[tuple]]]) -> None: pass
@@ -1,2 +1,3 @@
 
-from internal.model.general import *
\ No newline at end of file
+from internal.model.general import *
+from internal.model.dashboard import *
\ No newline at end of file
@@ -0,0 +1,60 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class MovementMap(BaseModel):
+    movements: list[dict]
+    # True, если запрос к Loki остановлен бюджетом и карта построена не по всему окну
+    truncated: bool = False
+    covered_start: Optional[datetime] = None
+    covered_end: Optional[datetime] = None
+    # Спаны без пары дольше горизонта сведения (см. SpanPairingEngine)
+    evicted_spans: int = 0
+    # Курсор следующей страницы (MovementQuery.after); None - страница последняя
+    next_cursor: Optional[str] = None
+
+
+class MovementQuery(BaseModel):
+    """Фильтры и страница карты перемещений. Сервис и метод - исходные или русские имена"""
+    service: Optional[str] = None
+    method: Optional[str] = None
+    min_duration_ms: Optional[float] = None
+    # Поддиапазон окна по времени начала перемещения: [start_time, end_time)
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    limit: Optional[int] = None
+    after: Optional[str] = None
+
+
+class MovementMaps(BaseModel):
+    # Перемещения по аккаунтам; у аккаунта без перемещений - пустой список
+    maps: dict[int, list[dict]]
+    truncated: bool = False
+    covered_start: Optional[datetime] = None
+    covered_end: Optional[datetime] = None
+    evicted_spans: int = 0
+
+
+class MethodLatencyStats(BaseModel):
+    # По методам, от самых медленных по p99: service/method - русские имена,
+    # service_name/method_name - исходные, длительности в мс
+    methods: list[dict]
+    # account, organization или global
+    scope: str
+    truncated: bool = False
+    covered_start: Optional[datetime] = None
+    covered_end: Optional[datetime] = None
+    evicted_spans: int = 0
+
+
+class HandlerTransitions(BaseModel):
+    # Обработчик: русские имена и исходные (service_name/method_name)
+    service: str
+    method: str
+    service_name: str
+    method_name: str
+    # Самые частые следующие и предыдущие обработчики с числом переходов
+    next: list[dict]
+    previous: list[dict]
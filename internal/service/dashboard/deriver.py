@@ -0,0 +1,253 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+import orjson
+
+from infrastructure.loki.batch import ns_to_datetime
+from infrastructure.loki.loki import LokiClient
+from infrastructure.loki.model import LokiQueryStats
+from internal import interface
+from internal.service.dashboard.movement import (
+    MOVEMENT_EVENT_FIELDS,
+    MOVEMENT_EVENTS_SERVICE_NAME,
+    MOVEMENT_FIELDS,
+    MOVEMENT_LABELS,
+    MOVEMENT_LINE_REGEX,
+    MOVEMENT_SERVICE_NAME,
+    MovementMapBuilder,
+    SpanPairingEngine,
+)
+from internal.service.dashboard.transition import TransitionIndex
+
+
+class MovementEventDeriver(interface.IMovementEventDeriver):
+    """
+    Фоновая сборка компактного стрима перемещений.
+
+    Следит за логами tg-бота (LokiClient.tail), сводит "Начало"/"Завершение" одного span_id
+    и на каждое завершённое перемещение пишет одно событие в стрим
+    {service_name="loom-tg-bot-movements"}: JSON с account_id, username, сервисом, методом,
+    start_ns и duration_ms, timestamp записи - start_ns, account_id и organization_id
+    дублируются в structured metadata. Дашборд с read_derived читает этот стрим вместо сырых логов.
+
+    Спаны без пары дольше horizon (по времени логов) забываются. После перезапуска чтение
+    начинается на lookback раньше, чтобы не потерять спаны, начатые до остановки: Loki
+    отбрасывает записи, совпадающие с уже записанными по стриму, времени и строке, поэтому
+    повторная выдача тех же событий дублей не создаёт. Timestamp события - время начала,
+    поэтому в Loki должна быть разрешена запись не по порядку (по умолчанию с 2.4).
+
+    Сетевые сбои tail переживает сам; при любой другой ошибке чтение перезапускается через
+    restart_delay (с удвоением до max_restart_delay) с timestamp последней полученной строки:
+    на нём могли остаться не полученные строки других стримов. Уже полученные строки с этим
+    timestamp приходят повторно и дают те же события, которые Loki отбрасывает как дубли.
+    Незакрытые спаны при перезапуске сохраняются.
+
+    С transition_index сведённые перемещения попадают и в индекс переходов; при запуске
+    индекс заполняется событиями стрима за его retention.
+    """
+
+    def __init__(
+            self,
+            tel: interface.ITelemetry,
+            loki: LokiClient,
+            horizon: timedelta = timedelta(hours=1),
+            lookback: timedelta = timedelta(minutes=5),
+            flush_interval: float = 2.0,
+            max_batch: int = 1000,
+            max_buffer: int = 100_000,
+            transition_index: TransitionIndex = None,
+            restart_delay: float = 1.0,
+            max_restart_delay: float = 60.0,
+    ):
+        self.tracer = tel.tracer()
+        self.logger = tel.logger()
+        self.loki = loki
+        self.lookback = lookback
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_buffer = max_buffer
+        self.transition_index = transition_index
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+
+        self.builder = MovementMapBuilder()
+        self.engine = SpanPairingEngine(horizon=horizon, direction="forward")
+        self.buffer: list[dict] = []
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+        meter = tel.meter()
+        self.derived_counter = meter.create_counter(
+            "movement_deriver.derived", unit="{event}", description="Сведённых перемещений"
+        )
+        self.evicted_counter = meter.create_counter(
+            "movement_deriver.evicted", unit="{span}", description="Спанов без пары дольше horizon"
+        )
+        self.pushed_counter = meter.create_counter(
+            "movement_deriver.pushed", unit="{event}", description="Событий, записанных в Loki"
+        )
+        self.dropped_counter = meter.create_counter(
+            "movement_deriver.dropped", unit="{event}", description="Событий, отброшенных при переполнении буфера"
+        )
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        except Exception as err:
+            self.logger.error("Сборка перемещений завершилась с ошибкой", {
+                "error": f"{err.__class__.__name__}: {err}",
+            })
+        self._task = None
+        await self.flush()
+
+    async def run(self) -> None:
+        if self.transition_index is not None:
+            await self.backfill_transitions()
+
+        flusher = asyncio.create_task(self._flush_periodically())
+        start_time = datetime.now() - self.lookback
+        last_ns = None
+        current_delay = self.restart_delay
+        try:
+            while True:
+                try:
+                    async for log in self.loki.tail(
+                            filters={
+                                "service_name": MOVEMENT_SERVICE_NAME,
+                            },
+                            line_regex=MOVEMENT_LINE_REGEX,
+                            keep_labels=MOVEMENT_LABELS,
+                            start_time=start_time,
+                            fields=MOVEMENT_FIELDS,
+                    ):
+                        current_delay = self.restart_delay
+                        last_ns = max(last_ns or 0, log["timestamp_ns"])
+                        self.observe(log)
+                        if len(self.buffer) >= self.max_batch:
+                            await self.flush()
+                except Exception as err:
+                    self.logger.error("Чтение логов tg-бота прервалось, перезапуск", {
+                        "delay": current_delay,
+                        "error": f"{err.__class__.__name__}: {err}",
+                    })
+
+                await asyncio.sleep(current_delay)
+                current_delay = min(current_delay * 2, self.max_restart_delay)
+                if last_ns is not None:
+                    start_time = ns_to_datetime(last_ns)
+        finally:
+            flusher.cancel()
+
+    def observe(self, log: dict) -> Optional[dict]:
+        """Учитывает строку лога; возвращает событие, если она завершила перемещение"""
+        pair = self.engine.feed(log)
+        if pair is None:
+            return None
+
+        event = self.builder.build_event(*pair)
+        if event is not None:
+            self.buffer.append(event)
+            self.derived_counter.add(1)
+            if self.transition_index is not None:
+                self.transition_index.add(event)
+        return event
+
+    async def backfill_transitions(self) -> None:
+        """Заполняет индекс переходов уже записанными событиями за его retention"""
+        now = datetime.now()
+        events = 0
+        stats = LokiQueryStats()
+        try:
+            # Стрим событий читается один раз при запуске - кэш сегментов только вытеснил бы
+            # из памяти запросы дашборда
+            async for event in self.loki.iter_logs(
+                    filters={
+                        "service_name": MOVEMENT_EVENTS_SERVICE_NAME,
+                    },
+                    start_time=now - timedelta(microseconds=self.transition_index.retention_ns // 1000),
+                    end_time=now,
+                    direction="forward",
+                    fields=MOVEMENT_EVENT_FIELDS,
+                    use_cache=False,
+                    stats=stats,
+            ):
+                self.transition_index.add(event)
+                events += 1
+        except Exception as err:
+            # Индекс продолжит пополняться из tail, просто без истории
+            self.logger.warning("Не удалось заполнить индекс переходов из Loki", {
+                "events": events,
+                "error": f"{err.__class__.__name__}: {err}",
+            })
+
+        if stats.truncated:
+            # Чтение вперёд оборвалось бюджетом: в индексе нет переходов после covered_end
+            self.logger.warning("Индекс переходов заполнен не полностью", {
+                "events": events,
+                "reason": stats.truncated_reason,
+                "covered_end": stats.covered_end.isoformat() if stats.covered_end is not None else None,
+            })
+
+        self.transition_index.maintain()
+        self.logger.info("Индекс переходов заполнен", {
+            "events": events,
+            **self.transition_index.stats(),
+        })
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self.buffer:
+                return
+
+            events = self.buffer
+            self.buffer = []
+            try:
+                await self.loki.push([(
+                    {"service_name": MOVEMENT_EVENTS_SERVICE_NAME},
+                    [
+                        (event["start_ns"], orjson.dumps(event).decode(), {
+                            "account_id": event["account_id"],
+                            "organization_id": event["organization_id"],
+                        })
+                        for event in events
+                    ],
+                )])
+            except Exception as err:
+                # Событие вернётся в буфер и уйдёт со следующей попыткой; сверх max_buffer
+                # отбрасываются самые старые
+                self.buffer = events + self.buffer
+                dropped = len(self.buffer) - self.max_buffer
+                if dropped > 0:
+                    del self.buffer[:dropped]
+                    self.dropped_counter.add(dropped)
+                self.logger.warning("Не удалось записать перемещения в Loki", {
+                    "events": len(events),
+                    "buffered": len(self.buffer),
+                    "error": f"{err.__class__.__name__}: {err}",
+                })
+                return
+
+            self.pushed_counter.add(len(events))
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Tail отдаёт строки пачками, сгруппированными по стримам, поэтому вытеснение -
+            # между пачками, а не после каждой строки (см. SpanPairingEngine)
+            evicted = self.engine.evict()
+            if evicted:
+                self.evicted_counter.add(evicted)
+            if self.transition_index is not None:
+                self.transition_index.maintain()
+            await self.flush()
@@ -0,0 +1,86 @@
+from array import array
+
+import numpy as np
+
+from internal.service.dashboard.movement import MovementMapBuilder
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class MethodLatencyCollector:
+    """
+    Длительности сведённых перемещений по (сервис, метод) для статистики задержек.
+
+    Длительности копятся в плоских массивах вместе с номером метода, а count, mean,
+    перцентили и max считаются в stats() разом по всем методам: одна сортировка по
+    (метод, длительность) и векторные операции NumPy над границами групп, без цикла по строкам.
+    """
+
+    def __init__(self):
+        self.methods: dict[tuple[str, str], int] = {}
+        self.codes = array("I")
+        self.durations_ms = array("d")
+
+    def add(self, service_name: str, method_name: str, duration_ms: float) -> None:
+        key = (service_name, method_name)
+        code = self.methods.get(key)
+        if code is None:
+            code = self.methods[key] = len(self.methods)
+        self.codes.append(code)
+        self.durations_ms.append(duration_ms)
+
+    def __len__(self) -> int:
+        return len(self.durations_ms)
+
+    def stats(self) -> list[dict]:
+        """Статистика по методам, от самых медленных по p99"""
+        if not self.durations_ms:
+            return []
+
+        codes = np.frombuffer(self.codes, dtype=np.uint32)
+        durations = np.frombuffer(self.durations_ms, dtype=np.float64)
+
+        # Последний ключ lexsort - главный: группы методов подряд, внутри - по возрастанию длительности
+        order = np.lexsort((durations, codes))
+        durations = durations[order]
+        group_codes, starts, counts = np.unique(codes[order], return_index=True, return_counts=True)
+        ends = starts + counts - 1
+
+        means = np.add.reduceat(durations, starts) / counts
+        percentiles = {
+            percentile: self._percentile(durations, starts, counts, percentile)
+            for percentile in LATENCY_PERCENTILES
+        }
+
+        names = [None] * len(self.methods)
+        for key, code in self.methods.items():
+            names[code] = key
+
+        result = []
+        for i, code in enumerate(group_codes.tolist()):
+            service_name, method_name = names[code]
+            service_ru, method_ru = MovementMapBuilder.get_russian_names(service_name, method_name)
+            result.append({
+                "service": service_ru,
+                "method": method_ru,
+                "service_name": service_name,
+                "method_name": method_name,
+                "count": int(counts[i]),
+                "mean_ms": float(means[i]),
+                **{f"p{percentile}_ms": float(values[i]) for percentile, values in percentiles.items()},
+                "max_ms": float(durations[ends[i]]),
+            })
+
+        result.sort(key=lambda item: item["p99_ms"], reverse=True)
+        return result
+
+    @staticmethod
+    def _percentile(durations: np.ndarray, starts: np.ndarray, counts: np.ndarray, percentile: float) -> np.ndarray:
+        """
+        Перцентиль каждой группы отсортированного массива с линейной интерполяцией между
+        соседними значениями - как np.percentile по умолчанию, но сразу для всех групп
+        """
+        positions = starts + (counts - 1) * (percentile / 100)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.ceil(positions).astype(np.int64)
+        return durations[lower] + (durations[upper] - durations[lower]) * (positions - lower)
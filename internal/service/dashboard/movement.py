@@ -0,0 +1,483 @@
+import base64
+import binascii
+import re
+from datetime import datetime, timedelta
+from typing import Optional
+
+from infrastructure.loki.batch import datetime_to_ns, ns_to_datetime
+from infrastructure.loki.logql import escape_re2
+from internal import model
+from internal.common.methods_map import methods_map
+
+START_OPERATION = "Начало"
+END_OPERATION = "Завершение"
+
+# Запрос логов tg-бота, по которым строится карта перемещений
+MOVEMENT_SERVICE_NAME = "loom-tg-bot"
+MOVEMENT_LINE_REGEX = r"(Начало|Завершение)\s+\w+Service\.\w+"
+MOVEMENT_LABELS = ["span_id", "account_id", "organization_id", "telegram_user_username"]
+MOVEMENT_FIELDS = ["span_id", "account_id", "organization_id", "telegram_user_username", "message"]
+
+# Стрим готовых перемещений, который пишет MovementEventDeriver
+MOVEMENT_EVENTS_SERVICE_NAME = "loom-tg-bot-movements"
+MOVEMENT_EVENT_FIELDS = [
+    "span_id", "account_id", "organization_id", "telegram_username", "service", "method", "start_ns", "duration_ms",
+]
+
+MESSAGE_PATTERN = re.compile(r"(Начало|Завершение)\s+(\w+)\.(\w+)")
+
+
+class MovementMapBuilder:
+    """
+    Сборка карты перемещений из логов tg-бота: строки "Начало X.y" и "Завершение X.y"
+    одного span_id складываются в одно перемещение.
+
+    От строки хранится только то, что попадёт в перемещение, поэтому незакрытые половины
+    можно передать в другой процесс (unpaired) и досвести там (merge) - так параллельная
+    обработка частей окна даёт тот же результат, что и обработка окна целиком.
+    """
+
+    def __init__(self):
+        self.spans: dict[str, dict[str, dict]] = {}
+
+    def add(self, log: dict) -> bool:
+        """Добавляет строку лога; False, если это не начало/завершение обработчика"""
+        parsed = self.half_from_log(log)
+        if parsed is None:
+            return False
+
+        span_id, operation_type, half = parsed
+        self.spans.setdefault(span_id, {})[operation_type] = half
+        return True
+
+    def merge(self, spans: dict[str, dict[str, dict]]) -> None:
+        for span_id, operations in spans.items():
+            self.spans.setdefault(span_id, {}).update(operations)
+
+    def unpaired(self) -> dict[str, dict[str, dict]]:
+        """Спаны, для которых есть только начало или только завершение"""
+        return {
+            span_id: operations
+            for span_id, operations in self.spans.items()
+            if START_OPERATION not in operations or END_OPERATION not in operations
+        }
+
+    def movements(self) -> list[dict]:
+        """Перемещения по спанам, у которых есть и начало, и завершение, по возрастанию start_time"""
+        movement_map = []
+        for span_id, operations in self.spans.items():
+            movement = self.build_movement(operations)
+            if movement is not None:
+                movement_map.append(movement)
+
+        movement_map.sort(key=lambda x: x["start_time"])
+        return movement_map
+
+    def build_movement(self, operations: dict[str, dict]) -> Optional[dict]:
+        if START_OPERATION not in operations or END_OPERATION not in operations:
+            return None
+
+        start_data = operations[START_OPERATION]
+        end_data = operations[END_OPERATION]
+
+        start_time: Optional[datetime] = start_data["timestamp"]
+        end_time: Optional[datetime] = end_data["timestamp"]
+
+        if not start_time or not end_time:
+            return None
+
+        return self._movement(
+            start_data["account_id"],
+            start_data["telegram_user_username"],
+            start_time,
+            end_time,
+            start_data["service"],
+            start_data["method"],
+        )
+
+    def build_event(self, span_id: str, operations: dict[str, dict]) -> Optional[dict]:
+        """
+        Компактное событие для стрима MOVEMENT_EVENTS_SERVICE_NAME. Имена сервиса и метода
+        остаются исходными - перевод по methods_map делается при чтении.
+        """
+        start_data = operations[START_OPERATION]
+        end_data = operations[END_OPERATION]
+        start_ns = start_data["timestamp_ns"]
+        end_ns = end_data["timestamp_ns"]
+        if start_ns is None or end_ns is None:
+            return None
+
+        return {
+            "span_id": span_id,
+            "account_id": start_data["account_id"],
+            "organization_id": start_data.get("organization_id"),
+            "telegram_username": start_data["telegram_user_username"],
+            "service": start_data["service"],
+            "method": start_data["method"],
+            "start_ns": start_ns,
+            # 6 знаков - наносекундная точность, end_ns восстанавливается без потерь
+            "duration_ms": round((end_ns - start_ns) / 1_000_000, 6),
+        }
+
+    def movement_from_event(self, event: dict) -> Optional[dict]:
+        start_ns = event.get("start_ns")
+        duration_ms = event.get("duration_ms")
+        if start_ns is None or duration_ms is None:
+            return None
+
+        start_ns = int(start_ns)
+        return self._movement(
+            event.get("account_id"),
+            event.get("telegram_username"),
+            ns_to_datetime(start_ns),
+            ns_to_datetime(start_ns + round(float(duration_ms) * 1_000_000)),
+            event.get("service"),
+            event.get("method"),
+        )
+
+    def _movement(
+            self,
+            account_id,
+            telegram_username: Optional[str],
+            start_time: datetime,
+            end_time: datetime,
+            service_name: str,
+            method_name: str,
+    ) -> dict:
+        duration_seconds = (end_time - start_time).total_seconds()
+
+        service_ru, method_ru = self.get_russian_names(service_name, method_name)
+
+        return {
+            "account_id": account_id,
+            "telegram_username": telegram_username,
+            "start_time": start_time.isoformat(),
+            "end_time": end_time.isoformat(),
+            "duration": self.format_duration(duration_seconds),
+            "service": service_ru,
+            "method": method_ru,
+        }
+
+    @classmethod
+    def half_from_log(cls, log: dict) -> Optional[tuple[str, str, dict]]:
+        """(span_id, "Начало" или "Завершение", половина спана) или None для прочих строк"""
+        span_id = log.get("span_id")
+        if not span_id:
+            return None
+
+        parsed = cls.parse_log_message(log.get("message", ""))
+        if not parsed:
+            return None
+
+        operation_type, service_name, method_name = parsed
+        return span_id, operation_type, {
+            "timestamp": log.get("timestamp"),
+            "timestamp_ns": log.get("timestamp_ns"),
+            "account_id": log.get("account_id"),
+            "organization_id": log.get("organization_id"),
+            "telegram_user_username": log.get("telegram_user_username"),
+            "service": service_name,
+            "method": method_name,
+        }
+
+    @staticmethod
+    def parse_log_message(message: str) -> Optional[tuple[str, str, str]]:
+        """
+        Парсит сообщение лога и извлекает тип операции (Начало/Завершение), сервис и метод.
+
+        Пример: "loom-tg-bot | Начало MainMenuService.handle_go_to_personal_profile"
+        Возвращает: ("Начало", "MainMenuService", "handle_go_to_personal_profile")
+        """
+        match = MESSAGE_PATTERN.search(message)
+        if match:
+            return match.group(1), match.group(2), match.group(3)
+        return None
+
+    @staticmethod
+    def format_duration(seconds: float) -> str:
+        """
+        Форматирует длительность в человеческий формат.
+
+        Примеры:
+        - 1.648 -> "1.65 сек"
+        - 65.2 -> "1 мин 5 сек"
+        - 3665 -> "1 ч 1 мин"
+        """
+        if seconds < 1:
+            return f"{seconds * 1000:.0f} мс"
+        elif seconds < 60:
+            return f"{seconds:.2f} сек"
+        elif seconds < 3600:
+            minutes = int(seconds // 60)
+            remaining_seconds = int(seconds % 60)
+            if remaining_seconds > 0:
+                return f"{minutes} мин {remaining_seconds} сек"
+            return f"{minutes} мин"
+        else:
+            hours = int(seconds // 3600)
+            minutes = int((seconds % 3600) // 60)
+            if minutes > 0:
+                return f"{hours} ч {minutes} мин"
+            return f"{hours} ч"
+
+    @staticmethod
+    def get_russian_names(service_name: str, method_name: str) -> tuple[str, str]:
+        """
+        Получает русские названия сервиса и метода из methods_map.
+
+        Если название не найдено, возвращает оригинальное.
+        """
+        service_ru = service_name
+        method_ru = method_name
+
+        if service_name in methods_map:
+            service_ru = methods_map[service_name].get("ru_name", service_name)
+            methods = methods_map[service_name].get("methods", {})
+            method_ru = methods.get(method_name, method_name)
+
+        return service_ru, method_ru
+
+
+class SpanPairingEngine:
+    """
+    Потоковое сведение спанов: пара (span_id, половины) отдаётся из feed, как только
+    получены и начало, и завершение, после чего спан забывается.
+
+    В памяти только незакрытые спаны. evict() вытесняет спаны, оставшиеся без пары дольше
+    horizon по времени логов, и учитывает их в evicted. Время отсчитывается от watermark -
+    самого позднего (direction="forward") или самого раннего ("backward") timestamp среди
+    полученных строк.
+
+    Внутри страницы Loki строки сгруппированы по стримам и идут не по времени, зато страница
+    покрывает непрерывный диапазон целиком. Поэтому evict() вызывается после страницы:
+    недостающая половина незакрытого спана тогда гарантированно лежит за watermark.
+    """
+
+    def __init__(self, horizon: Optional[timedelta] = timedelta(hours=1), direction: str = "forward"):
+        self.horizon_ns = int(horizon.total_seconds() * 1_000_000_000) if horizon is not None else None
+        self.direction = direction
+
+        # Незакрытые спаны в порядке первого появления
+        self.pending: dict[str, dict[str, dict]] = {}
+        self.watermark_ns: Optional[int] = None
+        self.paired = 0
+        self.evicted = 0
+        self.peak_pending = 0
+
+    def feed(self, log: dict) -> Optional[tuple[str, dict[str, dict]]]:
+        parsed = MovementMapBuilder.half_from_log(log)
+        if parsed is None:
+            return None
+
+        span_id, operation_type, half = parsed
+        self._advance_watermark(half["timestamp_ns"])
+
+        operations = self.pending.setdefault(span_id, {})
+        operations[operation_type] = half
+        if START_OPERATION in operations and END_OPERATION in operations:
+            del self.pending[span_id]
+            self.paired += 1
+            return span_id, operations
+
+        self.peak_pending = max(self.peak_pending, len(self.pending))
+        return None
+
+    def copy(self) -> "SpanPairingEngine":
+        """Независимая копия: feed копии не меняет незакрытые спаны исходного движка"""
+        engine = SpanPairingEngine(horizon=None, direction=self.direction)
+        engine.horizon_ns = self.horizon_ns
+        engine.pending = {span_id: dict(operations) for span_id, operations in self.pending.items()}
+        engine.watermark_ns = self.watermark_ns
+        engine.paired = self.paired
+        engine.evicted = self.evicted
+        engine.peak_pending = self.peak_pending
+        return engine
+
+    def evict(self) -> int:
+        """Вытесняет спаны без пары дольше horizon; возвращает их число"""
+        if self.horizon_ns is None or self.watermark_ns is None:
+            return 0
+
+        evicted = 0
+        while self.pending:
+            span_id, operations = next(iter(self.pending.items()))
+            first_seen_ns = next(iter(operations.values()))["timestamp_ns"]
+            if first_seen_ns is not None and self._age(first_seen_ns) <= self.horizon_ns:
+                break
+            del self.pending[span_id]
+            evicted += 1
+
+        self.evicted += evicted
+        return evicted
+
+    def _age(self, timestamp_ns: int) -> int:
+        if self.direction == "backward":
+            return timestamp_ns - self.watermark_ns
+        return self.watermark_ns - timestamp_ns
+
+    def _advance_watermark(self, timestamp_ns: Optional[int]) -> None:
+        if timestamp_ns is None:
+            return
+        if self.watermark_ns is None:
+            self.watermark_ns = timestamp_ns
+        elif self.direction == "backward":
+            self.watermark_ns = min(self.watermark_ns, timestamp_ns)
+        else:
+            self.watermark_ns = max(self.watermark_ns, timestamp_ns)
+
+
+class MovementFilter:
+    """
+    Фильтры и страница карты перемещений (model.MovementQuery) для окна с началом window_start_ns.
+
+    Сервис и метод можно задать исходным именем или русским из methods_map; в запрос к Loki
+    они уходят исходными именами в line_regex. Поддиапазон времени и курсор сужают диапазон
+    запроса, минимальная длительность проверяется после сведения спанов.
+
+    Курсор - непрозрачная строка с start_ns последнего отданного перемещения и числом
+    отданных перемещений с тем же start_ns.
+    """
+
+    def __init__(self, query: Optional[model.MovementQuery], window_start_ns: int):
+        query = query or model.MovementQuery()
+        if query.limit is not None and query.limit <= 0:
+            raise ValueError("limit должен быть больше нуля")
+
+        self.limit = query.limit
+        self.min_duration_ms = query.min_duration_ms
+        self.start_ns = window_start_ns
+        if query.start_time is not None:
+            self.start_ns = max(self.start_ns, datetime_to_ns(query.start_time))
+        self.end_ns = datetime_to_ns(query.end_time) if query.end_time is not None else None
+
+        self.after_ns: Optional[int] = None
+        self.after_skip = 0
+        if query.after:
+            self.after_ns, self.after_skip = self.decode_cursor(query.after)
+
+        self.services, self.methods = self.resolve_names(query.service, query.method)
+        # В перемещении имена уже переведены, поэтому сравниваются и исходные, и русские
+        self.service_names = None
+        if self.services is not None:
+            self.service_names = set(self.services) | {
+                MovementMapBuilder.get_russian_names(service, "")[0] for service in self.services
+            }
+        self.method_names = None
+        if self.methods is not None:
+            self.method_names = set(self.methods) | {
+                MovementMapBuilder.get_russian_names(service, method)[1]
+                for service in (self.services or methods_map)
+                for method in self.methods
+            }
+
+    @property
+    def read_start_ns(self) -> int:
+        """Начало диапазона логов: перемещения, начавшиеся раньше, не нужны"""
+        if self.after_ns is not None:
+            return max(self.start_ns, self.after_ns)
+        return self.start_ns
+
+    def line_regex(self) -> str:
+        """Регулярное выражение строк "Начало"/"Завершение" с учётом фильтра по сервису и методу"""
+        if self.services is None and self.methods is None:
+            return MOVEMENT_LINE_REGEX
+
+        service_pattern = self._alternatives(self.services) if self.services is not None else r"\w+Service"
+        method_pattern = self._alternatives(self.methods) + r"\b" if self.methods is not None else r"\w+"
+        return rf"(Начало|Завершение)\s+{service_pattern}\.{method_pattern}"
+
+    def event_line_regex(self) -> Optional[list[str]]:
+        """Фильтр строк стрима MOVEMENT_EVENTS_SERVICE_NAME: событие - JSON без пробелов (orjson)"""
+        patterns = []
+        if self.services is not None:
+            patterns.append(f'"service":"{self._alternatives(self.services)}"')
+        if self.methods is not None:
+            patterns.append(f'"method":"{self._alternatives(self.methods)}"')
+        return patterns or None
+
+    def matches(self, start_ns: int, movement: dict) -> bool:
+        if start_ns < self.read_start_ns:
+            return False
+        if self.end_ns is not None and start_ns >= self.end_ns:
+            return False
+        if self.service_names is not None and movement["service"] not in self.service_names:
+            return False
+        if self.method_names is not None and movement["method"] not in self.method_names:
+            return False
+        if self.min_duration_ms is not None:
+            duration = datetime.fromisoformat(movement["end_time"]) - datetime.fromisoformat(movement["start_time"])
+            if duration.total_seconds() * 1000 < self.min_duration_ms:
+                return False
+        return True
+
+    def page(self, movements: list[tuple[int, dict]]) -> tuple[list[dict], Optional[str]]:
+        """
+        Страница из (start_ns, перемещение) по возрастанию start_ns и курсор следующей
+        страницы, если после неё остались перемещения
+        """
+        selected = [item for item in movements if self.matches(*item)]
+        if self.after_ns is not None and self.after_skip:
+            skipped = 0
+            while skipped < len(selected) and skipped < self.after_skip and selected[skipped][0] == self.after_ns:
+                skipped += 1
+            selected = selected[skipped:]
+
+        if self.limit is None or len(selected) <= self.limit:
+            return [movement for _, movement in selected], None
+
+        selected = selected[:self.limit]
+        last_ns = selected[-1][0]
+        same_start = sum(1 for start_ns, _ in selected if start_ns == last_ns)
+        if last_ns == self.after_ns:
+            same_start += self.after_skip
+        return [movement for _, movement in selected], self.encode_cursor(last_ns, same_start)
+
+    @property
+    def enough(self) -> Optional[int]:
+        """Сколько подходящих перемещений достаточно прочитать для страницы и признака следующей"""
+        if self.limit is None:
+            return None
+        return self.limit + self.after_skip + 1
+
+    @staticmethod
+    def encode_cursor(start_ns: int, skip: int) -> str:
+        return base64.urlsafe_b64encode(f"{start_ns}:{skip}".encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple[int, int]:
+        try:
+            start_ns, skip = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+            return int(start_ns), int(skip)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ValueError(f"Некорректный курсор: {cursor}")
+
+    @staticmethod
+    def resolve_names(
+            service: Optional[str],
+            method: Optional[str],
+    ) -> tuple[Optional[list[str]], Optional[list[str]]]:
+        """
+        Исходные имена сервисов и методов для фильтра; None - фильтра нет.
+        Русское имя может соответствовать нескольким исходным, имя не из methods_map остаётся как есть.
+        """
+        services = None
+        if service:
+            services = [
+                name for name, info in methods_map.items()
+                if service in (name, info.get("ru_name"))
+            ] or [service]
+
+        methods = None
+        if method:
+            methods = sorted({
+                name
+                for service_name in (services or methods_map)
+                for name, ru_name in methods_map.get(service_name, {}).get("methods", {}).items()
+                if method in (name, ru_name)
+            }) or [method]
+
+        return services, methods
+
+    @staticmethod
+    def _alternatives(names: list[str]) -> str:
+        return "(" + "|".join(escape_re2(name) for name in names) + ")"
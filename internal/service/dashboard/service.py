@@ -1,10 +1,29 @@
-import re
+import asyncio
+import heapq
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 
+from infrastructure.loki.batch import datetime_to_ns, ns_to_datetime
 from infrastructure.loki.loki import LokiClient
-from internal import interface
-from internal.common.methods_map import methods_map
+from infrastructure.loki.model import LokiQueryStats, QueryBudget
+from internal import interface, model
+from internal.service.dashboard.movement import (
+    END_OPERATION,
+    MOVEMENT_EVENT_FIELDS,
+    MOVEMENT_EVENTS_SERVICE_NAME,
+    MOVEMENT_FIELDS,
+    MOVEMENT_LABELS,
+    MOVEMENT_LINE_REGEX,
+    MOVEMENT_SERVICE_NAME,
+    START_OPERATION,
+    MovementFilter,
+    MovementMapBuilder,
+    SpanPairingEngine,
+)
+from internal.service.dashboard.latency import MethodLatencyCollector
+from internal.service.dashboard.state import MovementMapState, MovementStateCache
+from internal.service.dashboard.transition import TransitionIndex
 from pkg.log_wrapper import auto_log
 from pkg.trace_wrapper import traced_method
 
@@ -14,10 +33,38 @@ class DashboardService(interface.IDashboardService):
             self,
             tel: interface.ITelemetry,
             loki: LokiClient,
+            shard_hours: int = 6,
+            max_shards: int = 8,
+            read_derived: bool = False,
+            pairing_horizon: timedelta = timedelta(hours=1),
+            state_cache: MovementStateCache = None,
+            batch_max_accounts: int = 50,
+            batch_max_rows: int = 2_000_000,
+            batch_max_concurrency: int = 2,
+            stats_max_rows: int = 10_000_000,
+            transition_index: TransitionIndex = None,
     ):
         self.tracer = tel.tracer()
         self.logger = tel.logger()
         self.loki = loki
+        self.shard_hours = shard_hours
+        self.max_shards = max_shards
+        # Читать готовые перемещения из стрима MovementEventDeriver вместо сырых логов
+        self.read_derived = read_derived
+        # Спан без пары дольше этого времени считается потерянным и вытесняется
+        self.pairing_horizon = pairing_horizon
+        # Накопленные карты по аккаунтам; без него каждый запрос читает всё окно
+        self.state_cache = state_cache
+        # Ограничения карт по нескольким аккаунтам: один такой запрос читает логи всех
+        # аккаунтов сразу, поэтому их число, строки и одновременные запросы ограничены
+        self.batch_max_accounts = batch_max_accounts
+        self.batch_max_rows = batch_max_rows
+        self.batch_semaphore = asyncio.Semaphore(batch_max_concurrency)
+        # Статистика задержек по организации или по всем аккаунтам читает больше всего логов
+        # и делит с картами по нескольким аккаунтам batch_semaphore
+        self.stats_max_rows = stats_max_rows
+        # Пополняется MovementEventDeriver; без него переходы недоступны
+        self.transition_index = transition_index
 
     @traced_method()
     @auto_log()
@@ -25,131 +72,470 @@ class DashboardService(interface.IDashboardService):
             self,
             account_id: int,
             hours: int = 24,
-    ) -> list[dict]:
-        logs = await self.loki.query_logs(
-            filters={
-                "service_name": "loom-tg-bot",
-            },
-            content_filters={
-                "account_id": account_id,
-            },
-            search_text=["Service"],
-            start_time=datetime.now() - timedelta(hours=hours),
-        )
-        self.logger.info('loki', {"logs": logs})
+            query: model.MovementQuery = None,
+    ) -> model.MovementMap:
+        window_start = datetime.now() - timedelta(hours=hours)
+        select = MovementFilter(query, datetime_to_ns(window_start))
+        if self.state_cache is not None:
+            return await self._refresh_movement_map(account_id, hours, select)
 
-        spans_map = {}
-        for log in logs:
-            span_id = log.get("span_id")
-            if not span_id:
-                continue
+        # Конец поддиапазона сдвигается на горизонт сведения: "Завершение" перемещения,
+        # начавшегося до конца, может быть позже
+        end_time = None
+        if select.end_ns is not None and self.pairing_horizon is not None:
+            end_time = ns_to_datetime(select.end_ns) + self.pairing_horizon
+            if end_time >= datetime.now():
+                end_time = None
 
-            message = log.get("message", "")
-            parsed = self.parse_log_message(message)
-            if not parsed:
-                continue
-
-            operation_type, service_name, method_name = parsed
+        stats = LokiQueryStats()
+        if select.limit is None:
+            # Страницы идут от новых к старым (direction="backward" в iter_batches)
+            direction = "backward"
+            shards = self._shards_for(hours)
+        else:
+            # Страница - самые ранние перемещения после курсора: читаем от начала, пока она
+            # не соберётся (см. _read_movements); параллельные шарды читали бы впрок
+            direction = "forward"
+            shards = 1
+        engine = SpanPairingEngine(horizon=self.pairing_horizon, direction=direction)
+        movements = await self._read_movements(
+            account_id,
+            ns_to_datetime(select.read_start_ns),
+            end_time,
+            direction,
+            shards,
+            engine,
+            stats,
+            select=select,
+        )
+        movements.sort(key=lambda item: item[0])
+        page, next_cursor = select.page(movements)
+        self._log_movement_query(stats, engine, len(page))
 
-            if span_id not in spans_map:
-                spans_map[span_id] = {}
+        # При срабатывании бюджета карта построена только по covered-диапазону:
+        # спаны, начавшиеся до его начала, потеряли "Начало" и в карту не попали
+        return model.MovementMap(
+            movements=page,
+            truncated=stats.truncated,
+            evicted_spans=engine.evicted,
+            covered_start=stats.covered_start,
+            covered_end=stats.covered_end,
+            next_cursor=next_cursor,
+        )
 
-            spans_map[span_id][operation_type] = {
-                "log": log,
-                "service": service_name,
-                "method": method_name,
-            }
+    @traced_method()
+    @auto_log()
+    async def get_users_movement_maps(
+            self,
+            account_ids: list[int],
+            hours: int = 24,
+    ) -> model.MovementMaps:
+        """
+        Карты нескольких аккаунтов одним запросом к Loki (account_id=~"1|2|3"): строки всех
+        аккаунтов сводятся за один проход и раскладываются по аккаунтам. Накопленное
+        состояние (state_cache) здесь не используется.
+        """
+        account_ids = list(dict.fromkeys(account_ids))
+        if not account_ids:
+            raise ValueError("Не указаны аккаунты")
+        if len(account_ids) > self.batch_max_accounts:
+            raise ValueError(f"Слишком много аккаунтов в запросе: {len(account_ids)}, максимум {self.batch_max_accounts}")
 
-        movement_map = []
-        for span_id, operations in spans_map.items():
-            if "Начало" not in operations or "Завершение" not in operations:
-                continue
+        # account_id в логах бывает и числом, и строкой
+        requested = {str(account_id): account_id for account_id in account_ids}
+        engine = SpanPairingEngine(horizon=self.pairing_horizon, direction="backward")
+        stats = LokiQueryStats()
+        async with self.batch_semaphore:
+            movements = await self._read_movements(
+                account_ids,
+                datetime.now() - timedelta(hours=hours),
+                None,
+                "backward",
+                self._shards_for(hours),
+                engine,
+                stats,
+                budget=QueryBudget(max_rows=self.batch_max_rows),
+            )
+        movements.sort(key=lambda item: item[0])
 
-            start_data = operations["Начало"]
-            end_data = operations["Завершение"]
+        maps = {account_id: [] for account_id in account_ids}
+        for _, movement in movements:
+            account_id = requested.get(str(movement["account_id"]))
+            if account_id is not None:
+                maps[account_id].append(movement)
 
-            start_log = start_data["log"]
-            end_log = end_data["log"]
+        self._log_movement_query(stats, engine, len(movements), {
+            "accounts": len(account_ids),
+        })
 
-            # Извлекаем данные
-            start_time = start_log.get("timestamp")
-            end_time = end_log.get("timestamp")
+        return model.MovementMaps(
+            maps=maps,
+            truncated=stats.truncated,
+            evicted_spans=engine.evicted,
+            covered_start=stats.covered_start,
+            covered_end=stats.covered_end,
+        )
 
-            if not start_time or not end_time:
-                continue
+    @traced_method()
+    @auto_log()
+    async def get_method_latency_stats(
+            self,
+            hours: int = 24,
+            account_id: int = None,
+            organization_id: int = None,
+    ) -> model.MethodLatencyStats:
+        """
+        Задержки обработчиков tg-бота по сервисам и методам: count, mean, p50/p90/p99 и max
+        длительности перемещений за окно - по аккаунту, организации или по всем.
+        """
+        if account_id is not None and organization_id is not None:
+            raise ValueError("Укажите либо аккаунт, либо организацию")
 
-            duration_seconds = (end_time - start_time).total_seconds()
+        content_filters = None
+        scope = "global"
+        if account_id is not None:
+            content_filters = {"account_id": account_id}
+            scope = "account"
+        elif organization_id is not None:
+            content_filters = {"organization_id": organization_id}
+            scope = "organization"
 
-            service_ru, method_ru = self.get_russian_names(
-                start_data["service"],
-                start_data["method"]
+        engine = SpanPairingEngine(horizon=self.pairing_horizon, direction="backward")
+        stats = LokiQueryStats()
+        collector = MethodLatencyCollector()
+        async with self.batch_semaphore:
+            batches = self._movement_batches(
+                content_filters,
+                datetime.now() - timedelta(hours=hours),
+                None,
+                "backward",
+                self._shards_for(hours),
+                stats,
+                budget=QueryBudget(max_rows=self.stats_max_rows),
             )
+            async for batch_logs in batches:
+                for log in batch_logs:
+                    if self.read_derived:
+                        if log.get("duration_ms") is not None:
+                            collector.add(log.get("service"), log.get("method"), float(log["duration_ms"]))
+                        continue
 
-            movement_map.append({
-                "account_id": start_log.get("account_id"),
-                "telegram_username": start_log.get("telegram_user_username"),
-                "start_time": start_time.isoformat(),
-                "end_time": end_time.isoformat(),
-                "duration": self.format_duration(duration_seconds),
-                "service": service_ru,
-                "method": method_ru,
-            })
+                    pair = engine.feed(log)
+                    if pair is None:
+                        continue
+                    start_ns = pair[1][START_OPERATION]["timestamp_ns"]
+                    end_ns = pair[1][END_OPERATION]["timestamp_ns"]
+                    if start_ns is not None and end_ns is not None:
+                        half = pair[1][START_OPERATION]
+                        collector.add(half["service"], half["method"], (end_ns - start_ns) / 1_000_000)
+                engine.evict()
 
-        movement_map.sort(key=lambda x: x["start_time"])
+        methods = collector.stats()
+        self._log_movement_query(stats, engine, len(collector), {
+            "scope": scope,
+            "methods": len(methods),
+        })
 
-        return movement_map
+        return model.MethodLatencyStats(
+            methods=methods,
+            scope=scope,
+            truncated=stats.truncated,
+            evicted_spans=engine.evicted,
+            covered_start=stats.covered_start,
+            covered_end=stats.covered_end,
+        )
 
-    def parse_log_message(self, message: str) -> Optional[tuple[str, str, str]]:
+    @traced_method()
+    @auto_log()
+    async def get_handler_transitions(
+            self,
+            service: str,
+            method: str,
+            limit: int = 10,
+    ) -> model.HandlerTransitions:
+        """
+        Самые частые следующие и предыдущие обработчики по индексу переходов. Сервис и метод -
+        исходные или русские имена; ответ берётся из готовых top_k индекса без чтения логов.
         """
-        Парсит сообщение лога и извлекает тип операции (Начало/Завершение), сервис и метод.
+        if self.transition_index is None:
+            raise ValueError("Индекс переходов выключен")
+        if not service or not method:
+            raise ValueError("Укажите сервис и метод")
+        if limit <= 0 or limit > self.transition_index.top_k:
+            raise ValueError(f"limit должен быть от 1 до {self.transition_index.top_k}")
 
-        Пример: "loom-tg-bot | Начало MainMenuService.handle_go_to_personal_profile"
-        Возвращает: ("Начало", "MainMenuService", "handle_go_to_personal_profile")
+        services, methods = MovementFilter.resolve_names(service, method)
+        service_name, method_name = services[0], methods[0]
+        node = None
+        for candidate_service in services:
+            for candidate_method in methods:
+                node = self.transition_index.node(candidate_service, candidate_method)
+                if node is not None:
+                    service_name, method_name = candidate_service, candidate_method
+                    break
+            if node is not None:
+                break
+
+        next_handlers = self.transition_index.next(node, limit) if node is not None else []
+        previous_handlers = self.transition_index.previous(node, limit) if node is not None else []
+        service_ru, method_ru = MovementMapBuilder.get_russian_names(service_name, method_name)
+
+        return model.HandlerTransitions(
+            service=service_ru,
+            method=method_ru,
+            service_name=service_name,
+            method_name=method_name,
+            next=[self._transition(names, count) for names, count in next_handlers],
+            previous=[self._transition(names, count) for names, count in previous_handlers],
+        )
+
+    async def _refresh_movement_map(
+            self,
+            account_id: int,
+            hours: int,
+            select: MovementFilter,
+    ) -> model.MovementMap:
         """
-        pattern = r"(Начало|Завершение)\s+(\w+)\.(\w+)"
-        match = re.search(pattern, message)
-        if match:
-            return match.group(1), match.group(2), match.group(3)
-        return None
+        Карта по накопленному состоянию аккаунта: из Loki читаются только логи новее
+        курсора состояния. Уже устоявшиеся (старше settle) добавляются в состояние,
+        более свежие сводятся на копии незакрытых спанов и в состояние не попадают.
 
-    def format_duration(self, seconds: float) -> str:
+        Состояние хранит все перемещения аккаунта, поэтому фильтры и страница применяются
+        к нему в памяти, а не в запросе к Loki.
         """
-        Форматирует длительность в человеческий формат.
+        now_ns = time.time_ns() // 1000 * 1000
+        window_ns = hours * 3600 * 1_000_000_000
+        window_start_ns = now_ns - window_ns
+        settled_end_ns = now_ns - self.state_cache.settle_ns
+
+        state = self.state_cache.get(account_id)
+        state_status = "hit"
+        if state is None or state.start_ns > window_start_ns:
+            # Окно шире накопленного - состояние строится заново: догрузить начало окна
+            # нельзя, спаны на его границе уже вытеснены или посчитаны незакрытыми
+            state_status = "miss" if state is None else "rebuild"
+            state = MovementMapState(account_id, window_start_ns, self.pairing_horizon)
+
+        stats = LokiQueryStats()
+        fresh_stats = LokiQueryStats()
+        async with state.lock:
+            state.window_ns = max(state.window_ns, window_ns)
+            delta_ns = settled_end_ns - state.cursor_ns
+            if delta_ns > 0:
+                settled = await self._read_movements(
+                    account_id,
+                    ns_to_datetime(state.cursor_ns),
+                    ns_to_datetime(settled_end_ns),
+                    "forward",
+                    self._shards_for(delta_ns // (3600 * 1_000_000_000)),
+                    state.engine,
+                    stats,
+                )
+                for start_ns, movement in settled:
+                    state.add(start_ns, movement)
+                state.cursor_ns = settled_end_ns
+
+            if stats.truncated:
+                # Состояние покрывает окно не целиком, продолжать его нельзя
+                self.state_cache.discard(account_id)
+                fresh = []
+                engine = state.engine
+            else:
+                engine = state.engine.copy()
+                fresh = await self._read_movements(
+                    account_id,
+                    ns_to_datetime(state.cursor_ns),
+                    None,
+                    "forward",
+                    1,
+                    engine,
+                    fresh_stats,
+                )
+                state.trim(now_ns - state.window_ns)
+                self.state_cache.put(state)
+
+            fresh.sort(key=lambda item: item[0])
+            movements, next_cursor = select.page(state.movements_since(select.read_start_ns) + fresh)
+
+        self._log_movement_query(stats, engine, len(movements), {
+            "state": state_status,
+            "fresh_logs_count": fresh_stats.rows,
+            "state_cache": self.state_cache.stats(),
+        })
 
-        Примеры:
-        - 1.648 -> "1.65 сек"
-        - 65.2 -> "1 мин 5 сек"
-        - 3665 -> "1 ч 1 мин"
+        # Перемещения до курсора уже в состоянии: покрытие идёт от начала окна до места,
+        # где оборвалось чтение - устоявшихся логов или свежих
+        truncated_stats = stats if stats.truncated else fresh_stats
+        return model.MovementMap(
+            movements=movements,
+            truncated=truncated_stats.truncated,
+            evicted_spans=engine.evicted,
+            covered_start=ns_to_datetime(window_start_ns) if truncated_stats.truncated else None,
+            covered_end=truncated_stats.covered_end if truncated_stats.truncated else None,
+            next_cursor=next_cursor,
+        )
+
+    async def _read_movements(
+            self,
+            account_id: int | list[int],
+            start_time: datetime,
+            end_time: Optional[datetime],
+            direction: str,
+            shards: int,
+            engine: SpanPairingEngine,
+            stats: LokiQueryStats,
+            budget: QueryBudget = None,
+            select: MovementFilter = None,
+    ) -> list[tuple[int, dict]]:
         """
-        if seconds < 1:
-            return f"{seconds * 1000:.0f} мс"
-        elif seconds < 60:
-            return f"{seconds:.2f} сек"
-        elif seconds < 3600:
-            minutes = int(seconds // 60)
-            remaining_seconds = int(seconds % 60)
-            if remaining_seconds > 0:
-                return f"{minutes} мин {remaining_seconds} сек"
-            return f"{minutes} мин"
-        else:
-            hours = int(seconds // 3600)
-            minutes = int((seconds % 3600) // 60)
-            if minutes > 0:
-                return f"{hours} ч {minutes} мин"
-            return f"{hours} ч"
+        Перемещения аккаунта (или списка аккаунтов) за [start_time, end_time)
+        в виде (start_ns, перемещение).
 
-    def get_russian_names(self, service_name: str, method_name: str) -> tuple[str, str]:
+        С select в запрос уходит его фильтр строк, а в результат - только подходящие
+        перемещения; при чтении вперёд с select.limit чтение прекращается, как только
+        страница собрана и более ранние перемещения появиться уже не могут.
         """
-        Получает русские названия сервиса и метода из methods_map.
+        builder = MovementMapBuilder()
+        batches = self._movement_batches(
+            {"account_id": account_id},
+            start_time,
+            end_time,
+            direction,
+            shards,
+            stats,
+            budget=budget,
+            select=select,
+        )
+
+        enough = select.enough if select is not None and direction == "forward" else None
+        movements = []
+        try:
+            async for batch_logs in batches:
+                for log in batch_logs:
+                    if self.read_derived:
+                        movement = builder.movement_from_event(log)
+                        start_ns = log.get("start_ns")
+                    else:
+                        pair = engine.feed(log)
+                        if pair is None:
+                            continue
+                        movement = builder.build_movement(pair[1])
+                        start_ns = pair[1][START_OPERATION]["timestamp_ns"]
+                    if movement is not None and (select is None or select.matches(int(start_ns), movement)):
+                        movements.append((int(start_ns), movement))
+                engine.evict()
+
+                if enough is not None and len(movements) >= enough:
+                    # Событие стрима пишется со временем начала, поэтому для него прочитанное
+                    # до конца страницы уже не пополнится; для сырых логов ещё могут закрыться
+                    # незакрытые спаны
+                    if self.read_derived:
+                        settled_ns = max((log["timestamp_ns"] for log in batch_logs), default=None)
+                    else:
+                        settled_ns = self._settled_ns(engine)
+                    last_needed_ns = heapq.nsmallest(enough, (start_ns for start_ns, _ in movements))[-1]
+                    if settled_ns is not None and last_needed_ns < settled_ns:
+                        break
+        finally:
+            await batches.aclose()
 
-        Если название не найдено, возвращает оригинальное.
+        return movements
+
+    def _movement_batches(
+            self,
+            content_filters: dict,
+            start_time: datetime,
+            end_time: Optional[datetime],
+            direction: str,
+            shards: int,
+            stats: LokiQueryStats,
+            budget: QueryBudget = None,
+            select: MovementFilter = None,
+    ):
+        """Страницы строк "Начало"/"Завершение" или, с read_derived, событий MovementEventDeriver"""
+        if self.read_derived:
+            return self.loki.iter_batches(
+                filters={
+                    "service_name": MOVEMENT_EVENTS_SERVICE_NAME,
+                },
+                content_filters=content_filters,
+                start_time=start_time,
+                end_time=end_time,
+                line_regex=select.event_line_regex() if select is not None else None,
+                direction=direction,
+                fields=MOVEMENT_EVENT_FIELDS,
+                shards=shards,
+                budget=budget,
+                stats=stats,
+            )
+
+        return self.loki.iter_batches(
+            filters={
+                "service_name": MOVEMENT_SERVICE_NAME,
+            },
+            content_filters=content_filters,
+            line_regex=select.line_regex() if select is not None else MOVEMENT_LINE_REGEX,
+            keep_labels=MOVEMENT_LABELS,
+            start_time=start_time,
+            end_time=end_time,
+            direction=direction,
+            fields=MOVEMENT_FIELDS,
+            shards=shards,
+            budget=budget,
+            stats=stats,
+        )
+
+    @staticmethod
+    def _transition(names: tuple[str, str], count: int) -> dict:
+        service_ru, method_ru = MovementMapBuilder.get_russian_names(*names)
+        return {
+            "service": service_ru,
+            "method": method_ru,
+            "service_name": names[0],
+            "method_name": names[1],
+            "count": count,
+        }
+
+    @staticmethod
+    def _settled_ns(engine: SpanPairingEngine) -> Optional[int]:
+        """
+        При чтении вперёд: перемещения, начавшиеся раньше этого времени, уже сведены - строки
+        до watermark прочитаны, а незакрытые спаны с "Началом" начались не раньше
         """
-        service_ru = service_name
-        method_ru = method_name
+        pending_starts = [
+            operations[START_OPERATION]["timestamp_ns"]
+            for operations in engine.pending.values()
+            if START_OPERATION in operations and operations[START_OPERATION]["timestamp_ns"] is not None
+        ]
+        if engine.watermark_ns is None:
+            return None
+        return min([engine.watermark_ns, *pending_starts])
 
-        if service_name in methods_map:
-            service_ru = methods_map[service_name].get("ru_name", service_name)
-            methods = methods_map[service_name].get("methods", {})
-            method_ru = methods.get(method_name, method_name)
+    def _log_movement_query(
+            self,
+            stats: LokiQueryStats,
+            engine: SpanPairingEngine,
+            movements_count: int,
+            extra: dict = None,
+    ) -> None:
+        self.logger.info('loki', {
+            "logs_count": stats.rows,
+            "loki_pages": stats.pages,
+            "loki_bytes": stats.bytes,
+            "truncated": stats.truncated,
+            "truncated_reason": stats.truncated_reason,
+            "plan": stats.plan.strategy if stats.plan is not None else None,
+            "derived": self.read_derived,
+            "movements": movements_count,
+            "unpaired_spans": len(engine.pending),
+            "evicted_spans": engine.evicted,
+            "peak_pending_spans": engine.peak_pending,
+            **(extra or {}),
+        })
 
-        return service_ru, method_ru
+    def _shards_for(self, hours: int) -> int:
+        """
+        Количество параллельных шардов для окна: по одному на каждые shard_hours часов,
+        но не больше max_shards.
+        """
+        return max(1, min(self.max_shards, hours // self.shard_hours))
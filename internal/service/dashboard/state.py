@@ -0,0 +1,127 @@
+import asyncio
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional
+
+from internal.service.dashboard.movement import SpanPairingEngine
+
+# Оценки размера в памяти: перемещение - dict из 7 строк, половина спана - dict с datetime
+MOVEMENT_OVERHEAD_BYTES = 700
+PENDING_SPAN_OVERHEAD_BYTES = 600
+
+
+class MovementMapState:
+    """
+    Накопленная карта перемещений аккаунта: готовые перемещения с start_ns >= start_ns,
+    незакрытые спаны (engine) и cursor_ns - конец уже прочитанного диапазона логов.
+
+    Логи читаются только до now - settle (см. MovementStateCache): более свежие ещё могут
+    доезжать в Loki, поэтому в состояние они не попадают и перечитываются при каждом запросе.
+    """
+
+    def __init__(self, account_id: int, start_ns: int, horizon: Optional[timedelta]):
+        self.account_id = account_id
+        self.start_ns = start_ns
+        self.cursor_ns = start_ns
+        # Самое длинное запрошенное окно: перемещения старше now - window_ns не хранятся
+        self.window_ns = 0
+        self.engine = SpanPairingEngine(horizon=horizon, direction="forward")
+        # (start_ns, перемещение) по возрастанию start_ns
+        self.movements: list[tuple[int, dict]] = []
+        self.lock = asyncio.Lock()
+
+    def add(self, start_ns: int, movement: dict) -> None:
+        insort(self.movements, (start_ns, movement), key=lambda item: item[0])
+
+    def movements_since(self, start_ns: int) -> list[tuple[int, dict]]:
+        return self.movements[bisect_left(self.movements, start_ns, key=lambda item: item[0]):]
+
+    def trim(self, start_ns: int) -> None:
+        """Забывает перемещения, начавшиеся раньше start_ns"""
+        if start_ns <= self.start_ns:
+            return
+        del self.movements[:bisect_left(self.movements, start_ns, key=lambda item: item[0])]
+        self.start_ns = start_ns
+
+    def estimate_bytes(self) -> int:
+        return (
+                len(self.movements) * MOVEMENT_OVERHEAD_BYTES
+                + len(self.engine.pending) * PENDING_SPAN_OVERHEAD_BYTES
+        )
+
+
+class MovementStateCache:
+    """
+    LRU-кэш состояний карт перемещений по аккаунтам
+
+    Состояние, к которому не обращались дольше ttl, удаляется. Суммарный объём ограничен
+    max_bytes по оценке MovementMapState.estimate_bytes, число аккаунтов - max_entries;
+    при переполнении вытесняются давно не использованные аккаунты.
+    """
+
+    def __init__(
+            self,
+            ttl: timedelta = timedelta(minutes=15),
+            max_entries: int = 1000,
+            max_bytes: int = 64 * 1024 * 1024,
+            settle: timedelta = timedelta(seconds=30),
+    ):
+        self.ttl_seconds = ttl.total_seconds()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.settle_ns = int(settle.total_seconds() * 1_000_000_000)
+
+        self._states: OrderedDict[int, tuple[float, MovementMapState, int]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, account_id: int) -> Optional[MovementMapState]:
+        entry = self._states.get(account_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.discard(account_id)
+            self.misses += 1
+            return None
+
+        self._states.move_to_end(account_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, state: MovementMapState) -> None:
+        """Сохраняет состояние после обновления и пересчитывает занятый объём"""
+        self.discard(state.account_id)
+
+        size = state.estimate_bytes()
+        if size > self.max_bytes:
+            return
+
+        self._states[state.account_id] = (time.monotonic() + self.ttl_seconds, state, size)
+        self.bytes += size
+
+        while self.bytes > self.max_bytes or len(self._states) > self.max_entries:
+            _, (_, _, evicted_size) = self._states.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def discard(self, account_id: int) -> None:
+        entry = self._states.pop(account_id, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def stats(self) -> dict:
+        return {
+            "accounts": len(self._states),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self) -> None:
+        self._states.clear()
+        self.bytes = 0
@@ -0,0 +1,179 @@
+import heapq
+from collections import Counter
+from dataclasses import dataclass
+from datetime import timedelta
+from operator import itemgetter
+from typing import Iterator, Optional
+
+import numpy as np
+
+from infrastructure.loki.batch import ns_to_datetime
+
+
+@dataclass
+class SparseCounts:
+    """Разреженная матрица переходов в формате CSR: строка - откуда, столбец - куда"""
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+
+    @classmethod
+    def from_counts(cls, counts: Counter, nodes: int) -> "SparseCounts":
+        edges = sorted(counts.items())
+        rows = np.fromiter((edge[0][0] for edge in edges), dtype=np.int32, count=len(edges))
+        indices = np.fromiter((edge[0][1] for edge in edges), dtype=np.int32, count=len(edges))
+        data = np.fromiter((edge[1] for edge in edges), dtype=np.int32, count=len(edges))
+        indptr = np.searchsorted(rows, np.arange(nodes + 1), side="left").astype(np.int32)
+        return cls(indptr, indices, data)
+
+    def items(self) -> Iterator[tuple[tuple[int, int], int]]:
+        rows = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int32), np.diff(self.indptr))
+        return zip(zip(rows.tolist(), self.indices.tolist()), self.data.tolist())
+
+    def to_counts(self) -> Counter:
+        return Counter(dict(self.items()))
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+
+
+class TransitionIndex:
+    """
+    Индекс переходов между обработчиками tg-бота: сколько раз за обработчиком A у того же
+    аккаунта следующим шёл обработчик B, по корзинам времени bucket.
+
+    Перемещения поступают по одному (add) - из MovementEventDeriver по мере сведения спанов.
+    Переход засчитывается, если следующее перемещение аккаунта началось не позже session_gap
+    после завершения предыдущего; перемещение, начавшееся не позже предыдущего, пропускается -
+    так повторная выдача тех же событий после перезапуска не удваивает счётчики.
+
+    Текущие корзины копятся в Counter, устоявшиеся (старше watermark - session_gap)
+    сжимаются в SparseCounts, корзины старше retention вычитаются из итогов и удаляются.
+    Итоги по всему retention и top_k следующих/предыдущих обработчиков по каждому узлу
+    пересчитываются в maintain(), поэтому next()/previous() - поиск в словаре.
+    """
+
+    def __init__(
+            self,
+            bucket: timedelta = timedelta(hours=1),
+            retention: timedelta = timedelta(days=7),
+            session_gap: timedelta = timedelta(minutes=30),
+            top_k: int = 20,
+    ):
+        self.bucket_ns = int(bucket.total_seconds() * 1_000_000_000)
+        self.retention_ns = int(retention.total_seconds() * 1_000_000_000)
+        self.session_gap_ns = int(session_gap.total_seconds() * 1_000_000_000)
+        self.top_k = top_k
+
+        # Узел - (сервис, метод) с исходными именами
+        self.nodes: dict[tuple[str, str], int] = {}
+        self.names: list[tuple[str, str]] = []
+        # Последнее перемещение аккаунта: (start_ns, end_ns, узел)
+        self.last: dict[str, tuple[int, int, int]] = {}
+
+        self.open_buckets: dict[int, Counter] = {}
+        self.sealed_buckets: dict[int, SparseCounts] = {}
+        self.next_totals: dict[int, Counter] = {}
+        self.previous_totals: dict[int, Counter] = {}
+        self.top_next: dict[int, list[tuple[int, int]]] = {}
+        self.top_previous: dict[int, list[tuple[int, int]]] = {}
+        self._dirty: set[int] = set()
+
+        self.watermark_ns: Optional[int] = None
+        self.transitions = 0
+
+    def add(self, event: dict) -> bool:
+        """Учитывает перемещение (событие MovementEventDeriver); True, если добавился переход"""
+        start_ns = event.get("start_ns")
+        duration_ms = event.get("duration_ms")
+        if start_ns is None or duration_ms is None or event.get("account_id") is None:
+            return False
+
+        start_ns = int(start_ns)
+        if self.watermark_ns is not None and start_ns < self.watermark_ns - self.retention_ns:
+            return False
+        self.watermark_ns = max(self.watermark_ns or start_ns, start_ns)
+
+        account_id = str(event["account_id"])
+        node = self._node(event.get("service"), event.get("method"))
+        end_ns = start_ns + round(float(duration_ms) * 1_000_000)
+
+        last = self.last.get(account_id)
+        if last is not None and start_ns <= last[0]:
+            return False
+        self.last[account_id] = (start_ns, end_ns, node)
+        if last is None or start_ns - last[1] > self.session_gap_ns:
+            return False
+
+        bucket_ns = start_ns - start_ns % self.bucket_ns
+        self.open_buckets.setdefault(bucket_ns, Counter())[(last[2], node)] += 1
+        self._count(last[2], node, 1)
+        self.transitions += 1
+        return True
+
+    def maintain(self) -> None:
+        """Сжимает устоявшиеся корзины, удаляет устаревшие и пересчитывает top_k изменившихся узлов"""
+        if self.watermark_ns is not None:
+            settled_ns = self.watermark_ns - self.session_gap_ns
+            for bucket_ns in [bucket_ns for bucket_ns in self.open_buckets if bucket_ns + self.bucket_ns <= settled_ns]:
+                counts = self.open_buckets.pop(bucket_ns)
+                sealed = self.sealed_buckets.get(bucket_ns)
+                if sealed is not None:
+                    # Опоздавшие перемещения в уже сжатую корзину
+                    counts.update(sealed.to_counts())
+                self.sealed_buckets[bucket_ns] = SparseCounts.from_counts(counts, len(self.names))
+
+            expired_ns = self.watermark_ns - self.retention_ns
+            for bucket_ns in [bucket_ns for bucket_ns in self.sealed_buckets if bucket_ns + self.bucket_ns <= expired_ns]:
+                for (source, target), count in self.sealed_buckets.pop(bucket_ns).items():
+                    self._count(source, target, -count)
+
+            self.last = {
+                account_id: last
+                for account_id, last in self.last.items()
+                if last[1] >= self.watermark_ns - self.session_gap_ns
+            }
+
+        for node in self._dirty:
+            self.top_next[node] = heapq.nlargest(self.top_k, self.next_totals.get(node, {}).items(), key=itemgetter(1))
+            self.top_previous[node] = heapq.nlargest(self.top_k, self.previous_totals.get(node, {}).items(), key=itemgetter(1))
+        self._dirty.clear()
+
+    def node(self, service_name: str, method_name: str) -> Optional[int]:
+        return self.nodes.get((service_name, method_name))
+
+    def next(self, node: int, limit: int) -> list[tuple[tuple[str, str], int]]:
+        """Самые частые следующие обработчики: ((сервис, метод), число переходов)"""
+        return [(self.names[target], count) for target, count in self.top_next.get(node, [])[:limit]]
+
+    def previous(self, node: int, limit: int) -> list[tuple[tuple[str, str], int]]:
+        return [(self.names[source], count) for source, count in self.top_previous.get(node, [])[:limit]]
+
+    def stats(self) -> dict:
+        return {
+            "nodes": len(self.names),
+            "edges": sum(len(targets) for targets in self.next_totals.values()),
+            "transitions": self.transitions,
+            "open_buckets": len(self.open_buckets),
+            "sealed_buckets": len(self.sealed_buckets),
+            "sealed_bytes": sum(sealed.nbytes for sealed in self.sealed_buckets.values()),
+            "watermark": ns_to_datetime(self.watermark_ns).isoformat() if self.watermark_ns is not None else None,
+        }
+
+    def _node(self, service_name: str, method_name: str) -> int:
+        key = (service_name, method_name)
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = len(self.names)
+            self.names.append(key)
+        return node
+
+    def _count(self, source: int, target: int, delta: int) -> None:
+        for totals, row, column in ((self.next_totals, source, target), (self.previous_totals, target, source)):
+            counts = totals.setdefault(row, Counter())
+            counts[column] += delta
+            if counts[column] <= 0:
+                del counts[column]
+        self._dirty.add(source)
+        self._dirty.add(target)
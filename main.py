@@ -1,15 +1,23 @@
 from contextvars import ContextVar
+from datetime import timedelta
 
 import uvicorn
 
 from infrastructure.loki.loki import LokiClient
+from infrastructure.loki.cache import LokiSegmentCache
+from infrastructure.loki.discovery import LokiLabelCache
+from infrastructure.loki.model import AdaptivePageSize, QueryBudget
+from infrastructure.loki.planner import QueryPlanner
 from infrastructure.telemetry.telemetry import Telemetry, AlertManager
 
 from pkg.client.internal.loom_authorization.client import LoomAuthorizationClient
 from internal.controller.http.middlerware.middleware import HttpMiddleware
 from internal.controller.http.handler.dashboard.handler import DashboardController
 
+from internal.service.dashboard.deriver import MovementEventDeriver
 from internal.service.dashboard.service import DashboardService
+from internal.service.dashboard.state import MovementStateCache
+from internal.service.dashboard.transition import TransitionIndex
 
 from internal.app.http.app import NewHTTP
 from internal.config.config import Config
@@ -50,17 +58,82 @@ loom_authorization_client = LoomAuthorizationClient(
     log_context=log_context
 )
 
+loki_cache = LokiSegmentCache(
+    segment=timedelta(minutes=cfg.loki_cache_segment_minutes),
+    max_bytes=cfg.loki_cache_max_mb * 1024 * 1024,
+    mutable_window=timedelta(minutes=cfg.loki_cache_mutable_minutes),
+)
+
+loki_label_cache = LokiLabelCache(
+    ttl=timedelta(seconds=cfg.loki_labels_ttl_seconds),
+)
+
+loki_planner = QueryPlanner(
+    shard_entries=cfg.loki_plan_shard_entries,
+    entries_per_shard=cfg.loki_plan_entries_per_shard,
+    max_shards=cfg.loki_plan_max_shards,
+    max_entries=cfg.loki_plan_max_entries,
+    max_bytes=cfg.loki_plan_max_mb * 1024 * 1024,
+)
+
 loki = LokiClient(
     cfg.loki_host,
     cfg.loki_port,
+    cache=loki_cache,
+    label_cache=loki_label_cache,
+    planner=loki_planner,
+    endpoints=cfg.loki_endpoints,
+    routing=cfg.loki_routing,
+    tel=tel,
+    budget=QueryBudget(
+        max_rows=cfg.loki_max_rows,
+        max_bytes=cfg.loki_max_mb * 1024 * 1024,
+        max_pages=cfg.loki_max_pages,
+    ),
+    adaptive_paging=AdaptivePageSize(
+        target_bytes=cfg.loki_page_target_kb * 1024,
+        target_seconds=cfg.loki_page_target_ms / 1000,
+        min_limit=cfg.loki_page_min_limit,
+        max_limit=cfg.loki_page_max_limit,
+    ) if cfg.loki_adaptive_paging else None,
 )
 
+movement_state_cache = MovementStateCache(
+    ttl=timedelta(minutes=cfg.movement_state_ttl_minutes),
+    max_entries=cfg.movement_state_max_accounts,
+    max_bytes=cfg.movement_state_max_mb * 1024 * 1024,
+    settle=timedelta(seconds=cfg.movement_state_settle_seconds),
+) if cfg.movement_state_enabled else None
+
+# Индекс переходов пополняется из MovementEventDeriver, поэтому без него не создаётся
+transition_index = TransitionIndex(
+    bucket=timedelta(minutes=cfg.transition_bucket_minutes),
+    retention=timedelta(hours=cfg.transition_retention_hours),
+    session_gap=timedelta(minutes=cfg.transition_session_gap_minutes),
+    top_k=cfg.transition_top_k,
+) if cfg.transition_index_enabled and cfg.movement_deriver_enabled else None
+
 # Инициализация сервисов
 dashboard_service = DashboardService(
     tel=tel,
-    loki=loki
+    loki=loki,
+    read_derived=cfg.movement_read_derived,
+    pairing_horizon=timedelta(minutes=cfg.movement_pairing_horizon_minutes),
+    state_cache=movement_state_cache,
+    batch_max_accounts=cfg.movement_batch_max_accounts,
+    batch_max_rows=cfg.movement_batch_max_rows,
+    batch_max_concurrency=cfg.movement_batch_max_concurrency,
+    stats_max_rows=cfg.method_stats_max_rows,
+    transition_index=transition_index,
 )
 
+movement_deriver = MovementEventDeriver(
+    tel=tel,
+    loki=loki,
+    horizon=timedelta(minutes=cfg.movement_deriver_horizon_minutes),
+    transition_index=transition_index,
+) if cfg.movement_deriver_enabled else None
+
 # Инициализация контроллеров
 dashboard_controller = DashboardController(tel, dashboard_service)
 
@@ -71,6 +144,7 @@ app = NewHTTP(
     dashboard_controller=dashboard_controller,
     http_middleware=http_middleware,
     prefix=cfg.prefix,
+    movement_deriver=movement_deriver,
 )
 
 if __name__ == "__main__":
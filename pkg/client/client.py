@@ -1,6 +1,7 @@
+from contextlib import asynccontextmanager
 from contextvars import ContextVar
 from datetime import datetime, timedelta
-from typing import Optional, Callable
+from typing import AsyncIterator, Optional, Callable
 
 import httpx
 from tenacity import (
@@ -229,19 +230,8 @@ class AsyncHTTPClient:
         if self.retry_attempts <= 1:
             return await self._execute_request(method, url, **kwargs)
 
-        retry_strategy = AsyncRetrying(
-            stop=stop_after_attempt(self.retry_attempts),
-            wait=wait_exponential(
-                multiplier=1,
-                min=self.retry_min_wait,
-                max=self.retry_max_wait,
-            ),
-            retry=should_retry,
-            reraise=True,
-        )
-
         attempt_num = 0
-        async for attempt in retry_strategy:
+        async for attempt in self.retrying():
             with attempt:
                 attempt_num = attempt.retry_state.attempt_number
                 try:
@@ -264,6 +254,37 @@ class AsyncHTTPClient:
                     raise
         return None
 
+    def retrying(self) -> AsyncRetrying:
+        """
+        Стратегия повторов клиента для операций, которые нельзя выразить одним запросом
+        (например, чтение потокового ответа целиком).
+        """
+        return AsyncRetrying(
+            stop=stop_after_attempt(max(self.retry_attempts, 1)),
+            wait=wait_exponential(
+                multiplier=1,
+                min=self.retry_min_wait,
+                max=self.retry_max_wait,
+            ),
+            retry=should_retry,
+            reraise=True,
+        )
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Запрос с потоковым чтением тела ответа. Повторы не выполняются: тело уже могло
+        быть частично прочитано, повторять нужно всю операцию целиком (см. retrying()).
+        """
+        headers = self._prepare_headers(kwargs.pop("headers", None))
+        cookies = {**self.default_cookies, **kwargs.pop("cookies", {})}
+
+        async with self.session.stream(
+                method, url, headers=headers, cookies=cookies, **kwargs
+        ) as response:
+            response.raise_for_status()
+            yield response
+
     async def get(self, url: str, **kwargs) -> httpx.Response:
         return await self._request_with_retry("GET", url, **kwargs)
 
@@ -0,0 +1,326 @@
+import asyncio
+import json
+import re
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import httpx
+import pytest
+from opentelemetry import metrics, trace
+
+from infrastructure.loki.loki import LokiClient
+from internal.service.dashboard.service import DashboardService
+
+BASE_NS = int(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp()) * 1_000_000_000
+SECOND_NS = 1_000_000_000
+
+_QUOTED = r'`[^`]*`|"(?:[^"\\]|\\.)*"'
+_MATCHER = re.compile(rf'(\w+)\s*(=~|!~|!=|=)\s*({_QUOTED})')
+_STAGES = [
+    ("contains", re.compile(rf'\s*\|=\s*({_QUOTED})')),
+    ("regex", re.compile(rf'\s*\|~\s*({_QUOTED})')),
+    ("parser", re.compile(r'\s*\|\s*(json|logfmt)\b')),
+    ("keep", re.compile(r'\s*\|\s*keep\s+([\w, ]+?)(?=\s*\||\s*$)')),
+    ("drop", re.compile(r'\s*\|\s*drop\s+([\w, ]+?)(?=\s*\||\s*$)')),
+    ("line_format", re.compile(rf'\s*\|\s*line_format\s+({_QUOTED})')),
+    ("label", re.compile(rf'\s*\|\s*(\w+)\s*(=~|!~|!=|=)\s*({_QUOTED})')),
+]
+
+
+def ns(seconds: float) -> int:
+    """Время в нс: BASE_NS + seconds"""
+    return BASE_NS + round(seconds * SECOND_NS)
+
+
+def at(seconds: float) -> datetime:
+    """Наивное локальное время, как datetime.now() в коде клиента"""
+    return datetime.fromtimestamp(ns(seconds) / SECOND_NS)
+
+
+def ago_ns(seconds: float) -> int:
+    """Время в нс за seconds до текущего: окна DashboardService отсчитываются от datetime.now()"""
+    return time.time_ns() - round(seconds * SECOND_NS)
+
+
+def movement_entries(
+        span_id: str,
+        account_id: int,
+        start_ns: int,
+        end_ns: Optional[int],
+        service: str = "MenuService",
+        method: str = "open",
+        **metadata,
+) -> list[tuple]:
+    """Строки "Начало"/"Завершение" tg-бота; end_ns=None - спан без завершения"""
+    metadata = {
+        "span_id": span_id,
+        "account_id": str(account_id),
+        "telegram_user_username": f"user{account_id}",
+        **metadata,
+    }
+    halves = [("Начало", start_ns)] + ([("Завершение", end_ns)] if end_ns is not None else [])
+    return [
+        (
+            {"service_name": "loom-tg-bot"},
+            timestamp_ns,
+            json.dumps({"message": f"loom-tg-bot | {operation} {service}.{method}"}, ensure_ascii=False),
+            metadata,
+        )
+        for operation, timestamp_ns in halves
+    ]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def collect(async_iterator) -> list:
+    return [item async for item in async_iterator]
+
+
+def _unquote(value: str) -> str:
+    if value.startswith("`"):
+        return value[1:-1]
+    return json.loads(value)
+
+
+def _match(op: str, actual: Optional[str], expected: str) -> bool:
+    if op == "=":
+        return actual == expected
+    if op == "!=":
+        return actual != expected
+    matched = re.fullmatch(expected, actual or "") is not None
+    return matched if op == "=~" else not matched
+
+
+class FakeLoki:
+    """
+    Loki в памяти за httpx.MockTransport: query_range, labels, series, label values,
+    index/stats и push. Понимает подмножество LogQL, которое строит LokiClient.
+
+    entries - (labels, timestamp_ns, line) или (labels, timestamp_ns, line, structured_metadata).
+    """
+
+    def __init__(self, entries: list[tuple] = (), latency: float = 0.0):
+        self.entries: list[tuple] = []
+        self.add(entries)
+        self.latency = latency
+        self.calls: list[tuple[str, dict]] = []
+        self.pushed: list[dict] = []
+        # Одновременно выполняющиеся запросы: сейчас и максимум
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # Перехват запроса: вернуть Response, чтобы ответить вместо Loki
+        self.intercept: Optional[Callable[[httpx.Request], Optional[httpx.Response]]] = None
+
+    def add(self, entries: list[tuple]) -> None:
+        self.entries.extend(entry if len(entry) == 4 else (*entry, {}) for entry in entries)
+
+    @property
+    def range_calls(self) -> list[dict]:
+        return [params for path, params in self.calls if path.endswith("/query_range")]
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await self._handle(request)
+        finally:
+            self.in_flight -= 1
+
+    async def _handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        params = dict(request.url.params)
+        params_multi = request.url.params.get_list("match[]")
+        self.calls.append((path, params))
+        if self.intercept is not None:
+            response = self.intercept(request)
+            if response is not None:
+                return response
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if path.endswith("/query_range"):
+            return self._query_range(params)
+        if path.endswith("/labels"):
+            rows = self._select(params.get("query"), params)
+            return self._data(sorted({key for labels, *_ in rows for key in labels}))
+        if path.endswith("/series"):
+            rows = [row for selector in params_multi for row in self._select(selector, params)]
+            unique = {json.dumps(labels, sort_keys=True) for labels, *_ in rows}
+            return self._data([json.loads(labels) for labels in sorted(unique)])
+        if "/label/" in path and path.endswith("/values"):
+            name = path.split("/label/")[1].rsplit("/values")[0]
+            rows = self._select(params.get("query"), params)
+            return self._data(sorted({labels[name] for labels, *_ in rows if name in labels}))
+        if path.endswith("/index/stats"):
+            rows = self._select(params["query"], params)
+            return httpx.Response(200, json={
+                "streams": len({json.dumps(labels, sort_keys=True) for labels, *_ in rows}),
+                "chunks": 1,
+                "entries": len(rows),
+                "bytes": sum(len(line) for _, _, line, _ in rows),
+            })
+        if path.endswith("/push"):
+            self.pushed.append(json.loads(request.content))
+            return httpx.Response(204)
+        return httpx.Response(404)
+
+    def _data(self, data) -> httpx.Response:
+        return httpx.Response(200, json={"status": "success", "data": data})
+
+    def _select(self, selector: Optional[str], params: dict) -> list[tuple]:
+        start = int(params.get("start", 0))
+        end = int(params.get("end", 2 ** 63))
+        matchers = [(key, op, _unquote(value)) for key, op, value in _MATCHER.findall(selector or "{}")]
+        return [
+            entry for entry in self.entries
+            if start <= entry[1] < end and all(_match(op, entry[0].get(key), value) for key, op, value in matchers)
+        ]
+
+    def _query_range(self, params: dict) -> httpx.Response:
+        query = params["query"]
+        selector_end = query.index("}") + 1
+        stages = self._parse_stages(query[selector_end:])
+
+        rows = []
+        for labels, timestamp_ns, line, metadata in self._select(query[:selector_end], params):
+            row_labels = self._apply(stages, dict(labels), line, metadata)
+            if row_labels is not None:
+                rows.append((row_labels, timestamp_ns, line))
+
+        rows.sort(key=lambda row: row[1], reverse=params.get("direction") == "backward")
+        rows = rows[:int(params.get("limit", 100))]
+
+        streams: dict[str, list] = {}
+        for labels, timestamp_ns, line in rows:
+            streams.setdefault(json.dumps(labels, sort_keys=True), []).append([str(timestamp_ns), line])
+        result = [{"stream": json.loads(key), "values": values} for key, values in streams.items()]
+        return httpx.Response(200, json={
+            "status": "success",
+            "data": {
+                "resultType": "streams",
+                "result": result,
+                "stats": {"summary": {
+                    "totalBytesProcessed": sum(len(line) for _, _, line in rows),
+                    "totalLinesProcessed": len(rows),
+                    "execTime": 0.001,
+                }},
+            },
+        })
+
+    @staticmethod
+    def _parse_stages(pipeline: str) -> list[tuple]:
+        stages = []
+        position = 0
+        while pipeline[position:].strip():
+            for kind, pattern in _STAGES:
+                matched = pattern.match(pipeline, position)
+                if matched:
+                    stages.append((kind, *matched.groups()))
+                    position = matched.end()
+                    break
+            else:
+                raise ValueError(f"FakeLoki: не разобран LogQL: {pipeline[position:]!r}")
+        return stages
+
+    @staticmethod
+    def _apply(stages: list[tuple], labels: dict, line: str, metadata: dict) -> Optional[dict]:
+        # Structured metadata Loki отдаёт вместе с labels стрима
+        labels = {**labels, **metadata}
+        fields = dict(labels)
+        for kind, *args in stages:
+            if kind == "contains" and _unquote(args[0]) not in line:
+                return None
+            if kind == "regex" and re.search(_unquote(args[0]), line) is None:
+                return None
+            if kind == "parser":
+                if args[0] == "json":
+                    try:
+                        parsed = json.loads(line)
+                    except ValueError:
+                        parsed = {}
+                else:
+                    parsed = dict(re.findall(r'(\w+)=("[^"]*"|\S+)', line))
+                fields.update({key: str(value).strip('"') for key, value in parsed.items()})
+            if kind == "label":
+                key, op, value = args
+                actual = fields.get(key)
+                if not _match(op, None if actual is None else str(actual), _unquote(value)):
+                    return None
+            if kind == "keep":
+                names = {name.strip() for name in args[0].split(",")}
+                labels = {key: value for key, value in labels.items() if key in names}
+            if kind == "drop":
+                names = {name.strip() for name in args[0].split(",")}
+                labels = {key: value for key, value in labels.items() if key not in names}
+        return labels
+
+
+class FakeLogger:
+    def __init__(self):
+        self.records: list[tuple[str, str, dict]] = []
+
+    def _record(self, level: str, message: str, fields: dict = None) -> None:
+        self.records.append((level, message, fields or {}))
+
+    def debug(self, message: str, fields: dict = None) -> None:
+        self._record("debug", message, fields)
+
+    def info(self, message: str, fields: dict = None) -> None:
+        self._record("info", message, fields)
+
+    def warning(self, message: str, fields: dict = None) -> None:
+        self._record("warning", message, fields)
+
+    def error(self, message: str, fields: dict = None) -> None:
+        self._record("error", message, fields)
+
+
+class FakeTelemetry:
+    """ITelemetry на глобальных провайдерах OpenTelemetry и логгере, запоминающем записи"""
+
+    def __init__(self):
+        self._logger = FakeLogger()
+
+    def tracer(self):
+        return trace.get_tracer(__name__)
+
+    def meter(self):
+        return metrics.get_meter(__name__)
+
+    def logger(self) -> FakeLogger:
+        return self._logger
+
+
+def attach(client: LokiClient, fake: FakeLoki) -> LokiClient:
+    """Направляет HTTP клиента (или каждой реплики пула) в fake"""
+    http_clients = [endpoint.client for endpoint in client.client.endpoints] if hasattr(
+        client.client, "endpoints"
+    ) else [client.client]
+    for http_client in http_clients:
+        http_client.session = httpx.AsyncClient(base_url=http_client.base_url, transport=fake.transport())
+    return client
+
+
+@pytest.fixture
+def make_client():
+    def factory(entries: list[tuple] = (), **client_kwargs) -> tuple[LokiClient, FakeLoki]:
+        fake = FakeLoki(entries)
+        client = LokiClient("loki", 3100, **client_kwargs)
+        return attach(client, fake), fake
+
+    return factory
+
+
+@pytest.fixture
+def make_service(make_client):
+    def factory(entries: list[tuple] = (), **service_kwargs) -> tuple[DashboardService, FakeLoki]:
+        client, fake = make_client(entries)
+        return DashboardService(FakeTelemetry(), client, **service_kwargs), fake
+
+    return factory
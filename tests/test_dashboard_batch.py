@@ -0,0 +1,46 @@
+import pytest
+
+from tests.conftest import ago_ns, movement_entries, run
+
+
+def _entries() -> list[tuple]:
+    return [
+        *movement_entries("a1", 7, ago_ns(600), ago_ns(599)),
+        *movement_entries("a2", 7, ago_ns(300), ago_ns(299)),
+        *movement_entries("b1", 8, ago_ns(400), ago_ns(399)),
+        *movement_entries("c1", 9, ago_ns(200), ago_ns(199)),
+    ]
+
+
+def test_maps_are_split_by_account_from_one_query(make_service):
+    service, fake = make_service(_entries())
+
+    result = run(service.get_users_movement_maps([7, 8, 7, 10], hours=1))
+
+    assert list(result.maps) == [7, 8, 10]
+    assert [movement["account_id"] for movement in result.maps[7]] == ["7", "7"]
+    assert len(result.maps[8]) == 1
+    assert result.maps[10] == []
+    assert not result.truncated
+    assert {params["query"].count("account_id=~") for params in fake.range_calls} == {1}
+
+
+def test_empty_or_too_many_accounts_are_rejected(make_service):
+    service, fake = make_service(_entries(), batch_max_accounts=2)
+
+    with pytest.raises(ValueError):
+        run(service.get_users_movement_maps([]))
+    with pytest.raises(ValueError):
+        run(service.get_users_movement_maps([7, 8, 9]))
+    assert fake.range_calls == []
+
+
+def test_row_budget_truncates_the_batch(make_service):
+    service, _ = make_service(_entries(), batch_max_rows=3)
+
+    result = run(service.get_users_movement_maps([7, 8, 9], hours=1))
+
+    assert result.truncated
+    assert result.covered_start is not None
+    # Чтение идёт от новых к старым: в бюджет попадает только самый поздний спан
+    assert {account_id: len(movements) for account_id, movements in result.maps.items()} == {7: 0, 8: 0, 9: 1}
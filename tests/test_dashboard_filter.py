@@ -0,0 +1,91 @@
+import pytest
+
+from infrastructure.loki.batch import ns_to_datetime
+from internal import model
+from internal.service.dashboard.movement import MovementFilter
+
+from tests.conftest import ago_ns, movement_entries, run
+
+ALERTS = ("AlertsService", "handle_go_to_main_menu")
+
+
+def _entries() -> list[tuple]:
+    tie_ns = ago_ns(500)
+    return [
+        *movement_entries("a", 7, ago_ns(600), ago_ns(599)),
+        # Два перемещения с одним start_ns: курсор должен различать их
+        *movement_entries("b", 7, tie_ns, tie_ns + 1_000_000),
+        *movement_entries("c", 7, tie_ns, tie_ns + 3_000_000_000, *ALERTS),
+        *movement_entries("d", 7, ago_ns(400), ago_ns(399)),
+        *movement_entries("e", 7, ago_ns(300), ago_ns(298), *ALERTS),
+    ]
+
+
+def _key(movement: dict) -> tuple:
+    return movement["start_time"], movement["end_time"], movement["service"]
+
+
+def _all_pages(service, **query) -> list[list[dict]]:
+    pages = []
+    after = None
+    while True:
+        result = run(service.get_user_movement_map(7, hours=1, query=model.MovementQuery(after=after, **query)))
+        pages.append(result.movements)
+        after = result.next_cursor
+        if after is None:
+            return pages
+
+
+def test_cursor_pages_cover_every_movement_once(make_service):
+    service, _ = make_service(_entries())
+
+    full = run(service.get_user_movement_map(7, hours=1)).movements
+    pages = _all_pages(service, limit=2)
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    # Порядок перемещений с одним start_ns не задан, важно только, что каждое отдано один раз
+    assert sorted(map(_key, (movement for page in pages for movement in page))) == sorted(map(_key, full))
+
+
+def test_filters_use_original_or_russian_names(make_service):
+    service, fake = make_service(_entries())
+
+    by_name = run(service.get_user_movement_map(7, hours=1, query=model.MovementQuery(service="AlertsService")))
+    by_russian = run(service.get_user_movement_map(7, hours=1, query=model.MovementQuery(
+        service="Сервис уведомлений",
+        method="Перейти в главное меню",
+    )))
+
+    assert len(by_name.movements) == len(by_russian.movements) == 2
+    assert all(movement["service"] == "Сервис уведомлений" for movement in by_russian.movements)
+    assert "AlertsService" in fake.range_calls[-1]["query"]
+
+
+def test_min_duration_and_subrange(make_service):
+    service, _ = make_service(_entries())
+
+    slow = run(service.get_user_movement_map(7, hours=1, query=model.MovementQuery(min_duration_ms=1500)))
+    paged_slow = _all_pages(service, min_duration_ms=1500, limit=1)
+    subrange = run(service.get_user_movement_map(7, hours=1, query=model.MovementQuery(
+        start_time=ns_to_datetime(ago_ns(550)),
+        end_time=ns_to_datetime(ago_ns(350)),
+    )))
+
+    assert len(slow.movements) == 2
+    assert [movement for page in paged_slow for movement in page] == slow.movements
+    assert len(subrange.movements) == 3
+
+
+def test_invalid_limit_and_cursor_are_rejected():
+    with pytest.raises(ValueError):
+        MovementFilter(model.MovementQuery(limit=0), 0)
+    with pytest.raises(ValueError):
+        MovementFilter(model.MovementQuery(after="not a cursor"), 0)
+
+
+def test_cursor_round_trip():
+    start_ns = ago_ns(10)
+    cursor = MovementFilter.encode_cursor(start_ns, 2)
+
+    assert MovementFilter.decode_cursor(cursor) == (start_ns, 2)
+    assert MovementFilter(model.MovementQuery(after=cursor), 0).read_start_ns == start_ns
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from internal.service.dashboard.latency import LATENCY_PERCENTILES, MethodLatencyCollector
+
+from tests.conftest import ago_ns, movement_entries, run
+
+
+def test_stats_match_numpy_per_method():
+    rng = np.random.default_rng(1)
+    samples = {
+        ("MenuService", "open"): rng.exponential(50, 1001),
+        ("AlertsService", "handle_go_to_main_menu"): rng.exponential(200, 37),
+        ("ProfileService", "show"): np.array([5.0]),
+    }
+    collector = MethodLatencyCollector()
+    # Вперемешку, как строки приходят из Loki
+    for i in range(1001):
+        for key, durations in samples.items():
+            if i < len(durations):
+                collector.add(*key, float(durations[i]))
+
+    stats = collector.stats()
+    by_method = {(item["service_name"], item["method_name"]): item for item in stats}
+
+    assert len(collector) == 1001 + 37 + 1
+    assert [item["p99_ms"] for item in stats] == sorted((item["p99_ms"] for item in stats), reverse=True)
+    for key, durations in samples.items():
+        item = by_method[key]
+        assert item["count"] == len(durations)
+        assert item["mean_ms"] == pytest.approx(durations.mean())
+        assert item["max_ms"] == durations.max()
+        for percentile in LATENCY_PERCENTILES:
+            assert item[f"p{percentile}_ms"] == pytest.approx(np.percentile(durations, percentile))
+
+
+def test_empty_collector_has_no_stats():
+    assert MethodLatencyCollector().stats() == []
+
+
+def test_service_stats_by_account_and_scope(make_service):
+    service, fake = make_service([
+        *movement_entries("a", 7, ago_ns(600), ago_ns(599)),
+        *movement_entries("b", 7, ago_ns(500), ago_ns(497)),
+        *movement_entries("c", 8, ago_ns(400), ago_ns(390)),
+    ])
+
+    by_account = run(service.get_method_latency_stats(hours=1, account_id=7))
+    overall = run(service.get_method_latency_stats(hours=1))
+
+    assert by_account.scope == "account"
+    assert [(item["count"], item["max_ms"]) for item in by_account.methods] == [(2, pytest.approx(3000, abs=1))]
+    assert by_account.methods[0]["p50_ms"] == pytest.approx(2000, abs=1)
+    assert overall.scope == "global"
+    assert overall.methods[0]["count"] == 3
+    with pytest.raises(ValueError):
+        run(service.get_method_latency_stats(account_id=7, organization_id=1))
@@ -0,0 +1,116 @@
+from datetime import timedelta
+
+from internal.service.dashboard.state import MOVEMENT_OVERHEAD_BYTES, MovementMapState, MovementStateCache
+
+from tests.conftest import ago_ns, movement_entries, run
+
+
+def _state(account_id: int, movements: int = 0) -> MovementMapState:
+    state = MovementMapState(account_id, 0, None)
+    for i in range(movements):
+        state.add(i, {"i": i})
+    return state
+
+
+def test_second_request_reads_only_logs_after_the_cursor(make_service):
+    service, fake = make_service(
+        [
+            *movement_entries("a", 7, ago_ns(600), ago_ns(599)),
+            *movement_entries("b", 7, ago_ns(5), ago_ns(4)),
+        ],
+        state_cache=MovementStateCache(),
+    )
+
+    first = run(service.get_user_movement_map(7, hours=1))
+    state = service.state_cache.get(7)
+    cursor_ns = state.cursor_ns
+    calls = len(fake.range_calls)
+    fake.add(movement_entries("c", 7, ago_ns(2), ago_ns(1)))
+    second = run(service.get_user_movement_map(7, hours=1))
+
+    assert len(first.movements) == 2
+    # В состоянии только устоявшиеся перемещения, свежее перечитывается каждый раз
+    assert len(state.movements) == 1
+    assert len(second.movements) == 3
+    assert all(int(params["start"]) >= cursor_ns for params in fake.range_calls[calls:])
+
+
+def test_span_closed_after_settle_stays_open_in_state(make_service):
+    service, _ = make_service(
+        movement_entries("a", 7, ago_ns(40), ago_ns(10)),
+        state_cache=MovementStateCache(settle=timedelta(seconds=30)),
+    )
+
+    first = run(service.get_user_movement_map(7, hours=1))
+    second = run(service.get_user_movement_map(7, hours=1))
+    state = service.state_cache.get(7)
+
+    assert len(first.movements) == len(second.movements) == 1
+    assert state.movements == []
+    assert list(state.engine.pending) == ["a"]
+
+
+def test_wider_window_rebuilds_state(make_service):
+    service, fake = make_service(
+        [
+            *movement_entries("old", 7, ago_ns(5400), ago_ns(5399)),
+            *movement_entries("new", 7, ago_ns(600), ago_ns(599)),
+        ],
+        state_cache=MovementStateCache(),
+    )
+
+    narrow = run(service.get_user_movement_map(7, hours=1))
+    calls = len(fake.range_calls)
+    wide = run(service.get_user_movement_map(7, hours=2))
+    narrow_again = run(service.get_user_movement_map(7, hours=1))
+
+    assert len(narrow.movements) == 1
+    assert int(fake.range_calls[calls]["start"]) <= ago_ns(7200)
+    assert len(wide.movements) == 2
+    # Окно уже состояния отдаётся из него же, без перемещений до начала окна
+    assert len(narrow_again.movements) == 1
+    assert service.state_cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_account_is_evicted():
+    cache = MovementStateCache(max_entries=2)
+    cache.put(_state(1))
+    cache.put(_state(2))
+    cache.get(1)
+    cache.put(_state(3))
+
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert cache.get(3) is not None
+    assert cache.evictions == 1
+
+
+def test_memory_cap_evicts_oldest_and_skips_oversized_state():
+    cache = MovementStateCache(max_bytes=3 * MOVEMENT_OVERHEAD_BYTES)
+    cache.put(_state(1, movements=2))
+    cache.put(_state(2, movements=1))
+    cache.put(_state(3, movements=1))
+    cache.put(_state(4, movements=4))
+
+    assert cache.get(1) is None
+    assert cache.get(4) is None
+    assert cache.bytes == 2 * MOVEMENT_OVERHEAD_BYTES
+    assert cache.stats()["accounts"] == 2
+
+
+def test_expired_state_is_dropped():
+    cache = MovementStateCache(ttl=timedelta(seconds=-1))
+    cache.put(_state(1, movements=1))
+
+    assert cache.get(1) is None
+    assert cache.bytes == 0
+    assert cache.misses == 1
+
+
+def test_trim_forgets_movements_before_window():
+    state = _state(1, movements=5)
+    state.trim(3)
+
+    assert [start_ns for start_ns, _ in state.movements] == [3, 4]
+    assert state.start_ns == 3
+    assert [start_ns for start_ns, _ in state.movements_since(4)] == [4]
@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+import pytest
+
+from internal.service.dashboard.transition import SparseCounts, TransitionIndex
+
+from tests.conftest import ns, run
+
+MENU = ("MenuService", "open")
+ALERTS = ("AlertsService", "handle_go_to_main_menu")
+PROFILE = ("ProfileService", "show")
+
+
+def _event(account_id: int, seconds: float, handler: tuple[str, str], duration_ms: float = 100) -> dict:
+    return {
+        "account_id": account_id,
+        "start_ns": ns(seconds),
+        "duration_ms": duration_ms,
+        "service": handler[0],
+        "method": handler[1],
+    }
+
+
+def _session(index: TransitionIndex, account_id: int, start: float, handlers: list) -> None:
+    for i, handler in enumerate(handlers):
+        index.add(_event(account_id, start + i, handler))
+
+
+def _next(index: TransitionIndex, handler: tuple[str, str]) -> list:
+    return index.next(index.node(*handler), index.top_k)
+
+
+def test_transitions_are_counted_per_account():
+    index = TransitionIndex()
+    _session(index, 1, 0, [MENU, ALERTS, MENU, PROFILE])
+    _session(index, 2, 0.5, [MENU, ALERTS])
+    index.maintain()
+
+    assert _next(index, MENU) == [(ALERTS, 2), (PROFILE, 1)]
+    assert index.previous(index.node(*MENU), 10) == [(ALERTS, 1)]
+    assert index.transitions == 4
+
+
+def test_replayed_events_are_not_counted_twice():
+    index = TransitionIndex()
+    _session(index, 1, 0, [MENU, ALERTS, PROFILE])
+    # После перезапуска deriver повторно отдаёт уже учтённые события
+    _session(index, 1, 0, [MENU, ALERTS, PROFILE])
+    index.maintain()
+
+    assert index.transitions == 2
+    assert _next(index, MENU) == [(ALERTS, 1)]
+
+
+def test_gap_longer_than_session_breaks_the_chain():
+    index = TransitionIndex(session_gap=timedelta(minutes=30))
+    index.add(_event(1, 0, MENU))
+    index.add(_event(1, 31 * 60, ALERTS))
+    index.maintain()
+
+    assert index.transitions == 0
+    assert _next(index, MENU) == []
+
+
+def test_settled_buckets_are_sealed_and_late_events_merged():
+    index = TransitionIndex(bucket=timedelta(minutes=10), session_gap=timedelta(minutes=1))
+    _session(index, 1, 0, [MENU, ALERTS])
+    _session(index, 2, 3600, [MENU, PROFILE])
+    index.maintain()
+    # Опоздавший переход в уже сжатую корзину
+    _session(index, 3, 10, [MENU, ALERTS])
+    index.add(_event(2, 3602, MENU))
+    index.maintain()
+
+    assert index.stats()["sealed_buckets"] == 1
+    assert index.sealed_buckets[ns(0) - ns(0) % index.bucket_ns].to_counts() == {
+        (index.node(*MENU), index.node(*ALERTS)): 2,
+    }
+    assert _next(index, MENU) == [(ALERTS, 2), (PROFILE, 1)]
+
+
+def test_buckets_older_than_retention_are_subtracted():
+    index = TransitionIndex(bucket=timedelta(hours=1), retention=timedelta(days=1), session_gap=timedelta(minutes=1))
+    _session(index, 1, 0, [MENU, ALERTS])
+    _session(index, 1, 3 * 3600, [MENU, PROFILE])
+    index.maintain()
+    _session(index, 2, 26 * 3600, [MENU, PROFILE])
+    index.maintain()
+
+    assert _next(index, MENU) == [(PROFILE, 2)]
+    assert index.previous(index.node(*ALERTS), 10) == []
+    # Событие старше retention от watermark не учитывается
+    assert not index.add(_event(3, 60, MENU))
+
+
+def test_sparse_counts_round_trip():
+    counts = {(0, 1): 3, (0, 2): 1, (2, 0): 5}
+    sparse = SparseCounts.from_counts(counts, 3)
+
+    assert sparse.to_counts() == counts
+    assert sparse.indptr.tolist() == [0, 2, 2, 3]
+
+
+def test_service_answers_from_the_index_by_russian_names(make_service):
+    index = TransitionIndex(top_k=5)
+    _session(index, 1, 0, [MENU, ALERTS, MENU])
+    index.maintain()
+    service, fake = make_service(transition_index=index)
+
+    result = run(service.get_handler_transitions("Сервис уведомлений", "Перейти в главное меню", limit=1))
+
+    assert (result.service_name, result.method_name) == ALERTS
+    assert [item["service_name"] for item in result.next] == [MENU[0]]
+    assert result.previous[0]["count"] == 1
+    assert fake.calls == []
+    with pytest.raises(ValueError):
+        run(service.get_handler_transitions(*ALERTS, limit=6))
+
+
+def test_service_without_index_rejects_transitions(make_service):
+    service, _ = make_service()
+
+    with pytest.raises(ValueError):
+        run(service.get_handler_transitions(*MENU))
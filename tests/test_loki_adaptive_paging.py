@@ -0,0 +1,87 @@
+import json
+
+from infrastructure.loki.model import AdaptivePageSize, QueryRangePage
+from infrastructure.loki.paging import PageSizer
+
+from tests.conftest import at, collect, ns, run
+
+SERVICE = {"service_name": "loom-tg-bot"}
+
+
+def _page(lines: int, line_bytes: int, seconds: float) -> QueryRangePage:
+    return QueryRangePage(logs=[], lines=lines, response_bytes=lines * line_bytes, latency_seconds=seconds)
+
+
+def test_fixed_limit_without_config():
+    sizer = PageSizer(5000)
+    sizer.observe(_page(5000, 10, 0.01))
+
+    assert sizer.next_limit(0) == 5000
+
+
+def test_limit_grows_by_at_most_max_step_for_small_fast_lines():
+    sizer = PageSizer(100, AdaptivePageSize(max_step=4.0, max_limit=5000))
+
+    limits = []
+    for _ in range(4):
+        limit = sizer.next_limit(0)
+        limits.append(limit)
+        sizer.observe(_page(limit, 50, 0.001))
+
+    assert limits == [100, 400, 1600, 5000]
+
+
+def test_limit_shrinks_to_target_bytes_for_fat_lines():
+    config = AdaptivePageSize(target_bytes=1_000_000, min_limit=10, max_step=100.0, smoothing=1.0)
+    sizer = PageSizer(5000, config)
+
+    sizer.observe(_page(5000, 10_000, 0.1))
+
+    assert sizer.next_limit(0) == 100
+
+
+def test_limit_shrinks_to_target_seconds_for_slow_pages():
+    config = AdaptivePageSize(target_seconds=1.0, min_limit=10, max_step=100.0, smoothing=1.0)
+    sizer = PageSizer(2000, config)
+
+    sizer.observe(_page(2000, 10, 4.0))
+
+    assert sizer.next_limit(0) == 500
+
+
+def test_limit_stays_within_bounds():
+    config = AdaptivePageSize(min_limit=200, max_limit=1000, max_step=100.0, smoothing=1.0)
+
+    assert PageSizer(50, config).next_limit(0) == 200
+    sizer = PageSizer(500, config)
+    sizer.observe(_page(500, 1_000_000, 10.0))
+    assert sizer.next_limit(0) == 200
+
+
+def test_limit_covers_lines_already_read_on_the_boundary():
+    config = AdaptivePageSize(min_limit=10, max_limit=5000, max_step=100.0, smoothing=1.0, target_bytes=1000)
+    sizer = PageSizer(100, config)
+    sizer.observe(_page(100, 1000, 0.01))
+
+    assert sizer.next_limit(0) == 10
+    # 30 строк граничного timestamp уже получены - страница должна вместить хотя бы ещё одну
+    assert sizer.next_limit(30) == 31
+
+
+def test_sparse_stream_needs_fewer_requests(make_client):
+    entries = [(SERVICE, ns(i * 0.01), json.dumps({"i": i})) for i in range(3000)]
+
+    def read(**kwargs) -> tuple[int, list[int]]:
+        client, fake = make_client(entries, **kwargs)
+        logs = run(collect(client.iter_logs(
+            filters=SERVICE, start_time=at(0), end_time=at(30), direction="forward", batch_size=100, plan=False,
+        )))
+        assert [log["i"] for log in logs] == list(range(3000))
+        return len(fake.range_calls), [int(params["limit"]) for params in fake.range_calls]
+
+    fixed_requests, _ = read()
+    adaptive_requests, limits = read(adaptive_paging=AdaptivePageSize(min_limit=100))
+
+    assert fixed_requests > 30
+    assert adaptive_requests < 8
+    assert limits[:3] == [100, 400, 1600]
@@ -0,0 +1,107 @@
+import json
+
+from infrastructure.loki.model import LokiQueryStats, QueryBudget
+
+from tests.conftest import at, collect, ns, run
+
+SERVICE = {"service_name": "loom-tg-bot"}
+
+
+def _entries(count: int) -> list[tuple]:
+    return [(SERVICE, ns(i), json.dumps({"i": i})) for i in range(count)]
+
+
+def _read(client, count: int, budget: QueryBudget, **kwargs) -> tuple[list[int], LokiQueryStats]:
+    stats = LokiQueryStats()
+    logs = run(collect(client.iter_logs(
+        filters=SERVICE,
+        start_time=at(0),
+        end_time=at(count),
+        budget=budget,
+        stats=stats,
+        plan=False,
+        **kwargs,
+    )))
+    return [log["i"] for log in logs], stats
+
+
+def test_row_budget_below_page_size_is_filled_before_truncation(make_client):
+    client, fake = make_client(_entries(50))
+
+    logs, stats = _read(client, 50, QueryBudget(max_rows=20), direction="forward", batch_size=5000)
+
+    assert logs == list(range(20))
+    assert (stats.truncated, stats.truncated_reason) == (True, "max_rows")
+    # Одна страница: limit зажат по бюджету, а не по batch_size
+    assert [int(params["limit"]) for params in fake.range_calls] == [21]
+
+
+def test_row_budget_equal_to_result_is_not_truncated(make_client):
+    client, _ = make_client(_entries(20))
+
+    logs, stats = _read(client, 20, QueryBudget(max_rows=20), direction="forward", batch_size=8)
+
+    assert logs == list(range(20))
+    assert not stats.truncated
+    assert (stats.covered_start_ns, stats.covered_end_ns) == (ns(0), ns(20))
+
+
+def test_forward_truncation_covers_up_to_last_timestamp(make_client):
+    client, _ = make_client(_entries(50))
+
+    logs, stats = _read(client, 50, QueryBudget(max_rows=25), direction="forward", batch_size=10)
+
+    assert logs == list(range(25))
+    # Граничный timestamp в покрытый диапазон не входит
+    assert (stats.covered_start_ns, stats.covered_end_ns) == (ns(0), ns(24))
+
+
+def test_backward_truncation_covers_from_last_timestamp(make_client):
+    client, _ = make_client(_entries(50))
+
+    logs, stats = _read(client, 50, QueryBudget(max_rows=15), direction="backward", batch_size=10)
+
+    assert logs == list(range(49, 34, -1))
+    assert (stats.covered_start_ns, stats.covered_end_ns) == (ns(35) + 1, ns(50))
+
+
+def test_truncated_page_of_several_streams_keeps_the_earliest_rows(make_client):
+    # Строки страницы сгруппированы по стримам: самая поздняя не обязательно последняя
+    entries = [({**SERVICE, "pod": str(i % 2)}, ns(i), json.dumps({"i": i})) for i in range(50)]
+    client, _ = make_client(entries)
+
+    logs, stats = _read(client, 50, QueryBudget(max_rows=20), direction="forward", batch_size=5000)
+
+    assert sorted(logs) == list(range(20))
+    assert stats.covered_end_ns == ns(19)
+
+
+def test_byte_and_page_budgets_drop_the_whole_page(make_client):
+    client, _ = make_client(_entries(50))
+    page_bytes = sum(len(json.dumps({"i": i})) for i in range(10))
+
+    logs, stats = _read(client, 50, QueryBudget(max_bytes=page_bytes + 1), direction="forward", batch_size=10)
+    assert logs == list(range(10))
+    assert stats.truncated_reason == "max_bytes"
+
+    logs, stats = _read(client, 50, QueryBudget(max_pages=2), direction="forward", batch_size=10)
+    assert logs == list(range(len(logs)))
+    assert (stats.pages, stats.truncated_reason) == (2, "max_pages")
+
+
+def test_client_budget_merges_with_query_budget(make_client):
+    client, _ = make_client(_entries(50), budget=QueryBudget(max_rows=30))
+
+    logs, stats = _read(client, 50, QueryBudget(max_rows=40), direction="forward", batch_size=10)
+
+    assert len(logs) == 30
+    assert stats.truncated
+
+
+def test_sharded_read_respects_row_budget(make_client):
+    client, _ = make_client(_entries(60))
+
+    logs, stats = _read(client, 60, QueryBudget(max_rows=35), direction="forward", batch_size=10, shards=3)
+
+    assert logs == list(range(35))
+    assert stats.truncated_reason == "max_rows"
@@ -0,0 +1,140 @@
+import json
+from datetime import timedelta
+
+import pytest
+
+from infrastructure.loki.cache import LokiSegmentCache
+from infrastructure.loki.model import LokiQueryStats, QueryBudget
+
+from tests.conftest import at, collect, ns, run
+
+SERVICE = {"service_name": "loom-tg-bot"}
+SEGMENT = 900
+
+
+def _entries(count: int, step: float) -> list[tuple]:
+    return [(SERVICE, ns(i * step), json.dumps({"i": i})) for i in range(count)]
+
+
+def _read(client, start: float, end: float, **kwargs) -> list[int]:
+    logs = run(collect(client.iter_logs(filters=SERVICE, start_time=at(start), end_time=at(end), plan=False, **kwargs)))
+    return [log["i"] for log in logs]
+
+
+def test_prefetched_segments_do_not_spend_the_budget(make_client):
+    # 4 сегмента по 300 строк
+    cache = LokiSegmentCache(segment=timedelta(seconds=SEGMENT))
+    client, fake = make_client(_entries(1200, 3), cache=cache)
+    stats = LokiQueryStats()
+
+    logs = _read(
+        client, 0, 4 * SEGMENT,
+        direction="forward", batch_size=100, max_concurrency=4, budget=QueryBudget(max_rows=500), stats=stats,
+    )
+
+    assert logs == list(range(500))
+    assert (stats.truncated, stats.truncated_reason) == (True, "max_rows")
+    assert stats.covered_end_ns == ns(499 * 3)
+
+    # Дочитанные заранее сегменты закэшированы, хотя до их отдачи дело не дошло
+    calls = len(fake.range_calls)
+    assert _read(client, 0, 4 * SEGMENT, direction="forward", batch_size=100) == list(range(1200))
+    assert len(fake.range_calls) == calls
+    assert cache.hits == 4
+
+
+def test_segment_over_budget_is_not_cached(make_client):
+    cache = LokiSegmentCache(segment=timedelta(seconds=SEGMENT))
+    client, fake = make_client(_entries(600, 3), cache=cache)
+    stats = LokiQueryStats()
+
+    logs = _read(
+        client, 0, 2 * SEGMENT,
+        direction="backward", batch_size=100, max_concurrency=1, budget=QueryBudget(max_rows=150), stats=stats,
+    )
+
+    assert logs == list(range(599, 449, -1))
+    assert stats.truncated
+    assert cache.bytes == 0
+
+
+@pytest.mark.parametrize("direction", ["forward", "backward"])
+def test_repeated_query_is_served_from_cache(make_client, direction):
+    cache = LokiSegmentCache(segment=timedelta(seconds=SEGMENT))
+    client, fake = make_client(_entries(600, 3), cache=cache)
+
+    first = _read(client, 100, 1700, direction=direction, batch_size=50)
+    calls = len(fake.range_calls)
+    second = _read(client, 100, 1700, direction=direction, batch_size=50)
+
+    expected = [i for i in range(600) if 100 <= i * 3 < 1700]
+    assert first == second == (expected if direction == "forward" else expected[::-1])
+    assert len(fake.range_calls) == calls
+    assert (cache.misses, cache.hits) == (2, 2)
+
+
+def test_overlapping_window_reuses_segments(make_client):
+    cache = LokiSegmentCache(segment=timedelta(seconds=SEGMENT))
+    client, fake = make_client(_entries(900, 3), cache=cache)
+
+    _read(client, 0, 2 * SEGMENT, direction="forward")
+    calls = len(fake.range_calls)
+    logs = _read(client, SEGMENT + 30, 3 * SEGMENT, direction="forward")
+
+    assert logs == [i for i in range(900) if SEGMENT + 30 <= i * 3]
+    # Загружен только третий сегмент
+    assert {int(params["start"]) for params in fake.range_calls[calls:]} == {ns(2 * SEGMENT)}
+
+
+def test_segments_near_now_are_not_cached(make_client):
+    cache = LokiSegmentCache(segment=timedelta(seconds=SEGMENT), mutable_window=timedelta(days=36500))
+    client, fake = make_client(_entries(300, 3), cache=cache)
+
+    _read(client, 0, SEGMENT, direction="forward")
+    calls = len(fake.range_calls)
+    assert _read(client, 0, SEGMENT, direction="forward") == list(range(300))
+
+    assert len(fake.range_calls) == 2 * calls
+    assert cache.bypasses == 2 and cache.bytes == 0
+
+
+def test_least_recently_used_segment_is_evicted(make_client):
+    client, _ = make_client(_entries(900, 3))
+    segment_bytes = LokiSegmentCache.estimate_bytes(
+        [{"message": json.dumps({"i": i})} for i in range(300, 600)]
+    )
+    cache = LokiSegmentCache(segment=timedelta(seconds=SEGMENT), max_bytes=2 * segment_bytes)
+    client.cache = cache
+
+    _read(client, 0, 2 * SEGMENT, direction="forward")
+    _read(client, 0, SEGMENT, direction="forward")
+    _read(client, 2 * SEGMENT, 3 * SEGMENT, direction="forward")
+
+    assert cache.evictions == 1
+    # Вытеснен второй сегмент: первый только что читали
+    hits = cache.hits
+    _read(client, 0, SEGMENT, direction="forward")
+    assert cache.hits == hits + 1
+
+
+def test_different_queries_do_not_share_segments(make_client):
+    cache = LokiSegmentCache(segment=timedelta(seconds=SEGMENT))
+    client, _ = make_client(_entries(300, 3), cache=cache)
+
+    _read(client, 0, SEGMENT, direction="forward")
+    logs = _read(client, 0, SEGMENT, direction="forward", search_text="7}")
+
+    assert logs == [i for i in range(300) if i % 10 == 7]
+    assert cache.hits == 0
+
+
+def test_limit_and_columnar_reads_bypass_the_cache(make_client):
+    cache = LokiSegmentCache(segment=timedelta(seconds=SEGMENT))
+    client, _ = make_client(_entries(300, 3), cache=cache)
+
+    _read(client, 0, SEGMENT, direction="forward", limit=10)
+    run(collect(client.iter_batches(
+        filters=SERVICE, start_time=at(0), end_time=at(SEGMENT), columnar=True, plan=False,
+    )))
+
+    assert cache.stats()["segments"] == 0 and cache.misses == 0
@@ -0,0 +1,72 @@
+import json
+import random
+
+import pytest
+
+from benchmarks.loki_decoder import DASHBOARD_FIELDS, SAMPLES, legacy_parse_log_line
+from infrastructure.loki.decoder import LogLineDecoder
+
+EDGE_CASES = [
+    "",
+    "   ",
+    "plain text without fields",
+    "[1, 2, 3]",
+    '"just a string"',
+    "123",
+    "  {\"padded\": true}",
+    '{"big": 123456789012345678901234567890}',
+    '{"nan": NaN}',
+    "{not json at all",
+    "{broken=1 but logfmt",
+    "a=1 b=2.5 c=true d=False e=text",
+    'msg="quoted \\"inner\\" value" n=1_000',
+    "x=1=2 y==3",
+    "num=1e5 neg=-3 plus=+4 dot=.5 trail=5.",
+    "nan=nan inf=inf",
+    "ключ=значение число=٣",
+    "sp= x=",
+    "k=\"unterminated",
+]
+
+_TOKENS = ["a", "b1", "_k", "ключ", "=", " ", '"', "\\", "1", "2.5", "-", "true", "False", "x y", "{", "}", "."]
+
+
+def _random_lines(count: int) -> list[str]:
+    rng = random.Random(20260101)
+    return ["".join(rng.choice(_TOKENS) for _ in range(rng.randint(1, 12))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("log_line", [*SAMPLES.values(), *EDGE_CASES])
+def test_decoder_matches_legacy_parser(log_line):
+    assert LogLineDecoder().decode(log_line) == legacy_parse_log_line(log_line)
+
+
+def test_decoder_matches_legacy_parser_on_random_lines():
+    decoder = LogLineDecoder()
+    mismatches = [line for line in _random_lines(5000) if decoder.decode(line) != legacy_parse_log_line(line)]
+
+    assert mismatches == []
+
+
+def test_integers_beyond_int64_stay_exact():
+    decoded = LogLineDecoder().decode('{"id": 18446744073709551616, "nested": {"neg": -9223372036854775809}}')
+
+    assert decoded == {"id": 2 ** 64, "nested": {"neg": -2 ** 63 - 1}}
+
+
+@pytest.mark.parametrize("log_line", [SAMPLES["logfmt"], *EDGE_CASES])
+def test_fields_project_logfmt_only(log_line):
+    legacy = legacy_parse_log_line(log_line)
+    decoded = LogLineDecoder(DASHBOARD_FIELDS).decode(log_line)
+
+    if log_line.lstrip().startswith("{") and isinstance(legacy, dict) and "=" not in log_line:
+        assert decoded == legacy
+    elif legacy is not None:
+        projected = {key: value for key, value in legacy.items() if key in DASHBOARD_FIELDS}
+        assert decoded == (projected or None)
+
+
+def test_json_line_is_returned_whole_even_with_fields():
+    decoded = LogLineDecoder(["span_id"]).decode(SAMPLES["json"])
+
+    assert decoded == json.loads(SAMPLES["json"])
@@ -0,0 +1,65 @@
+import json
+
+from infrastructure.loki.discovery import LokiLabelCache
+
+from tests.conftest import at, collect, ns, run
+
+TG_BOT = {"service_name": "loom-tg-bot"}
+
+
+def _line(i: int) -> str:
+    return json.dumps({"message": f"bot | line {i}", "account_id": 7})
+
+
+def _query(fake) -> str:
+    return fake.range_calls[0]["query"]
+
+
+def test_label_indexed_only_on_other_stream_stays_content_filter(make_client):
+    # account_id - label стрима другого сервиса, а у tg-бота - structured metadata
+    entries = [
+        *[(TG_BOT, ns(i), _line(i), {"account_id": "7"}) for i in range(5)],
+        *[({"service_name": "billing", "account_id": "7"}, ns(i), "billing line") for i in range(5)],
+    ]
+    client, fake = make_client(entries, label_cache=LokiLabelCache(), stream_decoding=False)
+
+    logs = run(collect(client.iter_logs(
+        filters=TG_BOT,
+        content_filters={"account_id": "7"},
+        start_time=at(0),
+        end_time=at(10),
+    )))
+
+    assert len(logs) == 5
+    assert _query(fake).startswith('{service_name="loom-tg-bot"} | account_id=`7`')
+
+
+def test_label_on_every_selected_stream_moves_to_selector(make_client):
+    entries = [
+        *[({**TG_BOT, "account_id": "7"}, ns(i), _line(i)) for i in range(3)],
+        *[({**TG_BOT, "account_id": "8"}, ns(i), _line(i)) for i in range(3)],
+    ]
+    client, fake = make_client(entries, label_cache=LokiLabelCache(), stream_decoding=False)
+
+    logs = run(collect(client.iter_logs(
+        filters=TG_BOT,
+        content_filters={"account_id": "7"},
+        start_time=at(0),
+        end_time=at(10),
+    )))
+
+    assert len(logs) == 3
+    assert _query(fake) == '{service_name="loom-tg-bot", account_id="7"}'
+
+
+def test_label_on_some_selected_streams_stays_content_filter(make_client):
+    entries = [
+        ({**TG_BOT, "account_id": "7"}, ns(1), _line(1)),
+        (TG_BOT, ns(2), _line(2), {"account_id": "7"}),
+    ]
+    client, _ = make_client(entries, label_cache=LokiLabelCache())
+
+    filters, content_filters = run(client.narrow_filters(TG_BOT, {"account_id": "7"}, at(0), at(10)))
+
+    assert filters == TG_BOT
+    assert content_filters == {"account_id": "7"}
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from tests.conftest import at, collect, ns, run
+
+SERVICE = {"service_name": "loom-tg-bot"}
+
+
+def _read(client, start: float, end: float, **kwargs) -> list[dict]:
+    return run(collect(client.iter_logs(filters=SERVICE, start_time=at(start), end_time=at(end), plan=False, **kwargs)))
+
+
+@pytest.mark.parametrize("stream_decoding", [True, False])
+@pytest.mark.parametrize("direction", ["forward", "backward"])
+def test_nanosecond_spacing_is_read_exactly_once(make_client, direction, stream_decoding):
+    # Соседние строки в 1 нс друг от друга - float-секунды их не различают
+    entries = [(SERVICE, ns(1) + i, json.dumps({"i": i})) for i in range(57)]
+    client, _ = make_client(entries, stream_decoding=stream_decoding)
+
+    logs = _read(client, 0, 2, direction=direction, batch_size=10)
+
+    assert sorted(log["i"] for log in logs) == list(range(57))
+    assert [log["timestamp_ns"] for log in logs] == sorted(
+        (log["timestamp_ns"] for log in logs), reverse=direction == "backward"
+    )
+
+
+def test_cursor_stays_in_integer_nanoseconds(make_client):
+    entries = [(SERVICE, ns(1) + 7 * i + 3, json.dumps({"i": i})) for i in range(30)]
+    client, fake = make_client(entries)
+
+    _read(client, 0, 2, direction="forward", batch_size=10)
+
+    # Следующая страница начинается ровно с граничного timestamp предыдущей
+    starts = [int(params["start"]) for params in fake.range_calls[1:]]
+    assert starts == [ns(1) + 7 * last + 3 for last in (9, 18, 27)]
+
+
+@pytest.mark.parametrize("direction", ["forward", "backward"])
+def test_boundary_timestamp_split_across_pages(make_client, direction):
+    # 6 строк на одном timestamp попадают на границу страниц по 10
+    entries = [(SERVICE, ns(i if i < 7 else 7), json.dumps({"i": i})) for i in range(13)]
+    entries += [(SERVICE, ns(8 + i), json.dumps({"i": 13 + i})) for i in range(10)]
+    client, _ = make_client(entries)
+
+    logs = _read(client, 0, 20, direction=direction, batch_size=10)
+
+    assert sorted(log["i"] for log in logs) == list(range(23))
+
+
+def test_timestamp_with_more_lines_than_a_page_is_stepped_over(make_client):
+    entries = [
+        *[(SERVICE, ns(1), json.dumps({"i": i})) for i in range(25)],
+        *[(SERVICE, ns(2), json.dumps({"i": i})) for i in range(25, 30)],
+    ]
+    client, _ = make_client(entries)
+
+    logs = _read(client, 0, 3, direction="forward", batch_size=10)
+
+    # Loki не листает внутри одного timestamp: непоместившиеся строки на нём теряются,
+    # но пагинация не зацикливается и дальше идёт без дублей
+    indices = [log["i"] for log in logs]
+    assert len(indices) == len(set(indices))
+    assert set(range(25, 30)) <= set(indices)
+
+
+def test_same_line_in_two_streams_is_not_deduplicated(make_client):
+    line = json.dumps({"event": "tick"})
+    entries = [
+        *[({**SERVICE, "pod": "a"}, ns(i), line) for i in range(20)],
+        *[({**SERVICE, "pod": "b"}, ns(i), line) for i in range(20)],
+    ]
+    client, _ = make_client(entries)
+
+    logs = _read(client, 0, 20, direction="forward", batch_size=7)
+
+    assert len(logs) == 40
+    assert {log["pod"] for log in logs} == {"a", "b"}
+
+
+def test_request_count_matches_the_result_size(make_client):
+    entries = [(SERVICE, ns(i), json.dumps({"i": i})) for i in range(100)]
+    client, fake = make_client(entries)
+
+    logs = _read(client, 0, 100, direction="backward", batch_size=25)
+
+    assert len(logs) == 100
+    # Страницы перекрываются только граничным timestamp: 25 + 3 * 24 + последняя неполная
+    assert len(fake.range_calls) == 5
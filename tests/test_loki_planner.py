@@ -0,0 +1,115 @@
+import json
+
+import httpx
+import pytest
+
+from infrastructure.loki.model import LokiQueryStats, VolumeEstimate
+from infrastructure.loki.planner import QueryPlanner
+from internal.common.error import ErrQueryTooLarge
+
+from tests.conftest import at, collect, ns, run
+
+SERVICE = {"service_name": "loom-tg-bot"}
+
+
+@pytest.mark.parametrize("entries, strategy, shards", [
+    (100, "single_page", 1),
+    (150_000, "serial", 1),
+    (450_000, "sharded", 5),
+    (2_000_000, "sharded", 8),
+])
+def test_strategy_follows_estimated_entries(entries, strategy, shards):
+    plan = QueryPlanner().plan(VolumeEstimate(bytes=entries * 100, entries=entries), 5000, None, 1)
+
+    assert (plan.strategy, plan.shards) == (strategy, shards)
+
+
+def test_too_large_filtered_estimate_is_refused():
+    planner = QueryPlanner(max_entries=1000, max_bytes=10_000)
+
+    assert planner.plan(VolumeEstimate(bytes=100, entries=1001), 5000, None, 1).reason == "max_entries"
+    assert planner.plan(VolumeEstimate(bytes=10_001, entries=10), 5000, None, 1).reason == "max_bytes"
+
+
+def test_unfiltered_estimate_is_only_an_upper_bound():
+    planner = QueryPlanner(max_entries=1000)
+
+    plan = planner.plan(VolumeEstimate(bytes=100, entries=500_000, filtered=False), 5000, None, 1)
+
+    assert plan.strategy == "sharded"
+
+
+def test_limit_caps_the_estimate_and_is_never_refused():
+    planner = QueryPlanner(max_entries=1000)
+
+    assert planner.plan(VolumeEstimate(bytes=100, entries=10_000_000), 5000, 100, 1).strategy == "single_page"
+    assert planner.plan(VolumeEstimate(bytes=100, entries=10_000_000), 5000, 500_000, 1).strategy == "serial"
+
+
+def test_volume_only_estimate_uses_bytes_per_entry():
+    plan = QueryPlanner(bytes_per_entry=100).plan(VolumeEstimate(bytes=30_000_000, source="index_volume"), 5000, None, 1)
+
+    assert (plan.strategy, plan.shards) == ("sharded", 3)
+
+
+def test_without_estimate_requested_shards_are_kept():
+    assert QueryPlanner().plan(None, 5000, None, 4).strategy == "sharded"
+    assert QueryPlanner().plan(None, 5000, None, 1).strategy == "serial"
+
+
+def _entries(count: int) -> list[tuple]:
+    return [(SERVICE, ns(i), json.dumps({"i": i})) for i in range(count)]
+
+
+def test_client_shards_by_index_stats(make_client):
+    planner = QueryPlanner(shard_entries=20, entries_per_shard=20)
+    client, fake = make_client(_entries(60), planner=planner)
+    stats = LokiQueryStats()
+
+    logs = run(collect(client.iter_logs(
+        filters=SERVICE, start_time=at(0), end_time=at(60), direction="forward", batch_size=10, stats=stats,
+    )))
+
+    assert [log["i"] for log in logs] == list(range(60))
+    assert (stats.plan.strategy, stats.plan.shards) == ("sharded", 3)
+    assert any(path.endswith("/index/stats") for path, _ in fake.calls)
+
+
+def test_client_refuses_too_large_query_before_reading(make_client):
+    client, fake = make_client(_entries(60), planner=QueryPlanner(max_entries=50))
+
+    with pytest.raises(ErrQueryTooLarge) as error:
+        run(collect(client.iter_logs(filters=SERVICE, start_time=at(0), end_time=at(60))))
+
+    assert error.value.estimated_entries == 60
+    assert fake.range_calls == []
+
+
+def test_content_filters_make_the_estimate_an_upper_bound(make_client):
+    client, _ = make_client(_entries(60), planner=QueryPlanner(max_entries=50))
+    stats = LokiQueryStats()
+
+    logs = run(collect(client.iter_logs(
+        filters=SERVICE, search_text=": 5", start_time=at(0), end_time=at(60), stats=stats,
+    )))
+
+    assert len(logs) == 11
+    assert stats.plan.estimate.filtered is False
+
+
+def test_falls_back_to_index_volume(make_client):
+    client, fake = make_client(_entries(10), planner=QueryPlanner())
+
+    def no_stats(request: httpx.Request):
+        if request.url.path.endswith("/index/stats"):
+            return httpx.Response(404)
+        if request.url.path.endswith("/index/volume"):
+            return httpx.Response(200, json={"status": "success", "data": {"result": [
+                {"metric": SERVICE, "value": [0, "4000"]},
+            ]}})
+        return None
+
+    fake.intercept = no_stats
+    estimate = run(client.estimate_volume(SERVICE, at(0), at(10)))
+
+    assert (estimate.source, estimate.bytes, estimate.entries) == ("index_volume", 4000, None)
@@ -0,0 +1,158 @@
+import asyncio
+
+import httpx
+import pytest
+
+from tests.conftest import run
+
+REPLICAS = [("loki-b", 3100), ("loki-c", 3100)]
+
+
+def _pool_client(make_client, **pool_kwargs):
+    client, fake = make_client(endpoints=REPLICAS)
+    pool = client.client
+    pool.retry_min_wait = 0
+    pool.retry_max_wait = 0
+    for key, value in pool_kwargs.items():
+        setattr(pool, key, value)
+    hosts = []
+
+    def route(request: httpx.Request):
+        hosts.append(request.url.host)
+        return None
+
+    fake.intercept = route
+    return client, fake, pool, hosts
+
+
+def _failing(hosts: list, failing: set, status: int = 503):
+    def route(request: httpx.Request):
+        hosts.append(request.url.host)
+        if request.url.host in failing:
+            return httpx.Response(status)
+        return None
+
+    return route
+
+
+def test_server_errors_fail_over_to_other_replicas(make_client):
+    client, fake, pool, hosts = _pool_client(make_client)
+    fake.intercept = _failing(hosts, {"loki-b"})
+
+    async def scenario() -> int:
+        failures = 0
+        for _ in range(30):
+            try:
+                await client.labels()
+            except httpx.HTTPError:
+                failures += 1
+        return failures
+
+    assert run(scenario()) == 0
+    # После ошибки реплика идёт последней, пока не пройдёт eject_seconds
+    assert hosts.count("loki-b") == 1
+
+
+def test_ejected_replica_gets_no_requests(make_client):
+    client, fake, pool, hosts = _pool_client(make_client, failure_threshold=2)
+    fake.intercept = _failing(hosts, {"loki-b"})
+
+    async def scenario() -> None:
+        for _ in range(5):
+            await client.labels()
+            # Ошибка моложе eject_seconds только понижает приоритет реплики - состариваем её
+            pool.endpoints[1].failed_at = 0.0
+        fake.latency = 0.01
+        await asyncio.gather(*[client.labels() for _ in range(6)])
+
+    run(scenario())
+    stats = {endpoint["endpoint"]: endpoint for endpoint in pool.stats()}
+    assert not stats["loki-b:3100"]["available"]
+    assert stats["loki-b:3100"]["ejections"] == 1
+    assert hosts.count("loki-b") == 2
+
+
+def test_client_errors_are_not_retried(make_client):
+    client, fake, pool, hosts = _pool_client(make_client)
+    fake.intercept = _failing(hosts, {"loki", "loki-b", "loki-c"}, status=400)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        run(client.labels())
+    assert len(hosts) == 1
+    assert all(endpoint["consecutive_failures"] == 0 for endpoint in pool.stats())
+
+
+def test_error_is_raised_when_every_attempt_fails(make_client):
+    client, fake, pool, hosts = _pool_client(make_client)
+    fake.intercept = _failing(hosts, {"loki", "loki-b", "loki-c"})
+
+    with pytest.raises(httpx.HTTPStatusError):
+        run(client.labels())
+    # Каждая попытка - на новую реплику
+    assert sorted(hosts) == ["loki", "loki-b", "loki-c"]
+
+
+def test_concurrent_requests_spread_across_replicas(make_client):
+    client, fake, pool, hosts = _pool_client(make_client)
+    fake.latency = 0.02
+
+    async def scenario() -> None:
+        await asyncio.gather(*[client.labels() for _ in range(9)])
+
+    run(scenario())
+    assert sorted(hosts.count(host) for host in ("loki", "loki-b", "loki-c")) == [3, 3, 3]
+
+
+def test_ewma_routing_prefers_the_faster_replica(make_client):
+    client, fake, pool, hosts = _pool_client(make_client, routing="ewma")
+
+    async def slow_on_b(request: httpx.Request) -> httpx.Response:
+        hosts.append(request.url.host)
+        if request.url.host == "loki-b":
+            await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"status": "success", "data": []})
+
+    for endpoint in pool.endpoints:
+        endpoint.client.session = httpx.AsyncClient(
+            base_url=endpoint.client.base_url, transport=httpx.MockTransport(slow_on_b)
+        )
+
+    async def scenario() -> None:
+        for _ in range(20):
+            await client.labels()
+
+    run(scenario())
+    # После первого замера медленная реплика больше не выбирается при последовательных запросах
+    assert hosts.count("loki-b") == 1
+
+
+def test_ejected_replica_returns_after_successful_probe(make_client):
+    client, fake, pool, hosts = _pool_client(make_client, eject_seconds=0.01, failure_threshold=1)
+    failing = {"loki-b"}
+
+    def route(request: httpx.Request):
+        if request.url.path == "/ready":
+            return httpx.Response(200 if request.url.host not in failing else 503)
+        hosts.append(request.url.host)
+        if request.url.host in failing:
+            return httpx.Response(503)
+        return None
+
+    fake.intercept = route
+
+    async def scenario() -> None:
+        for _ in range(3):
+            await client.labels()
+        failing.clear()
+        await asyncio.sleep(0.02)
+        # Запрос запускает пробу /ready, следующий уже может уйти на вернувшуюся реплику
+        await client.labels()
+        await asyncio.sleep(0)
+        await asyncio.gather(*pool._probes)
+        hosts.clear()
+        fake.latency = 0.01
+        await asyncio.gather(*[client.labels() for _ in range(3)])
+
+    run(scenario())
+    assert all(endpoint["available"] for endpoint in pool.stats())
+    assert sorted(hosts) == ["loki", "loki-b", "loki-c"]
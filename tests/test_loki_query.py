@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from infrastructure.loki.logql import escape_re2
+from infrastructure.loki.model import LogQuery
+
+from tests.conftest import at, collect, ns, run
+
+SERVICE = {"service_name": "loom-tg-bot"}
+
+
+def _entries(count: int) -> list[tuple]:
+    return [(SERVICE, ns(i), json.dumps({"i": i})) for i in range(count)]
+
+
+def test_baseline_positional_call_keeps_its_meaning(make_client):
+    client, fake = make_client(_entries(20))
+
+    # Исходный порядок query_logs: filters, content_filters, search_text, search_mode,
+    # start_time, end_time, direction, parse_json, limit, batch_size
+    logs = run(client.query_logs(SERVICE, None, None, "and", at(5), at(15), "forward", True, 4, 2))
+
+    assert [log["i"] for log in logs] == [5, 6, 7, 8]
+    assert int(fake.range_calls[0]["limit"]) == 2
+
+
+def test_added_parameters_are_keyword_only():
+    with pytest.raises(TypeError):
+        LogQuery(SERVICE, None, None, "and", None, None, "backward", True, None, 5000, "error")
+
+    query = LogQuery(SERVICE, line_regex="error", shards=2)
+    assert (query.line_regex, query.shards) == ("error", 2)
+
+
+def test_iter_batches_accepts_positional_filters_with_options(make_client):
+    client, _ = make_client(_entries(6))
+
+    batches = run(collect(client.iter_batches(SERVICE, start_time=at(0), end_time=at(6), batch_size=4, plan=False)))
+
+    assert [len(batch_logs) for batch_logs in batches] == [4, 2]
+
+
+def test_or_search_matches_special_characters_literally(make_client):
+    entries = [
+        (SERVICE, ns(0), "price 1.5 (net)"),
+        (SERVICE, ns(1), "price 1x5"),
+        (SERVICE, ns(2), "total [all]"),
+    ]
+    client, _ = make_client(entries)
+
+    logs = run(client.query_logs(
+        SERVICE, search_text=["1.5 (net)", "[all]"], search_mode="or",
+        start_time=at(0), end_time=at(3), direction="forward", parse_json=False, plan=False,
+    ))
+
+    assert [log["message"] for log in logs] == ["price 1.5 (net)", "total [all]"]
+
+
+def test_escape_re2_keeps_spaces():
+    assert escape_re2("a.b c(d)") == r"a\.b c\(d\)"
@@ -0,0 +1,142 @@
+import asyncio
+import json
+
+import httpx
+
+from infrastructure.loki.model import QueryCheckpoint
+
+from tests.conftest import at, ns, run
+
+SERVICE = {"service_name": "loom-tg-bot"}
+
+
+def _entries(count: int, step: float = 1.0) -> list[tuple]:
+    return [(SERVICE, ns(i * step), json.dumps({"i": i})) for i in range(count)]
+
+
+def _open(client, count: int, **kwargs):
+    return client.open_query(
+        filters=SERVICE,
+        start_time=at(0),
+        end_time=at(count),
+        direction="forward",
+        plan=False,
+        **kwargs,
+    )
+
+
+def test_prefetch_of_later_shards_is_bounded(make_client):
+    client, fake = make_client(_entries(400), stream_decoding=False)
+
+    async def scenario() -> int:
+        handle = await _open(client, 400, batch_size=10, shards=4, max_concurrency=4, prefetch_pages=2)
+        batches = handle.iter_batches()
+        await batches.__anext__()
+        # Дать остальным шардам дочитать столько, сколько им позволено
+        await asyncio.sleep(0.05)
+        calls = len(fake.range_calls)
+        await batches.aclose()
+        return calls
+
+    # Каждый шард: prefetch_pages в очереди и одна страница, ожидающая места в ней
+    assert run(scenario()) <= 4 * (2 + 1) + 1
+
+
+def test_checkpoint_round_trips_through_json(make_client):
+    client, _ = make_client(_entries(50), stream_decoding=False)
+
+    async def scenario() -> QueryCheckpoint:
+        handle = await _open(client, 50, batch_size=10, shards=2)
+        batches = handle.iter_batches()
+        await batches.__anext__()
+        await batches.aclose()
+        return handle.checkpoint
+
+    checkpoint = run(scenario())
+    restored = QueryCheckpoint.from_dict(json.loads(json.dumps(checkpoint.to_dict())))
+
+    assert restored == checkpoint
+    assert restored.delivered == 10
+
+
+def test_resume_from_serialized_checkpoint_delivers_the_rest_once(make_client):
+    # Пары строк на одном timestamp проверяют дедупликацию на границе страниц
+    entries = [(SERVICE, ns(i // 2), json.dumps({"i": i})) for i in range(120)]
+    client, _ = make_client(entries, stream_decoding=False)
+
+    async def first_part() -> tuple[list[int], dict]:
+        handle = await _open(client, 60, batch_size=7, shards=3)
+        seen = []
+        async for batch_logs in handle.iter_batches():
+            seen.extend(log["i"] for log in batch_logs)
+            if len(seen) >= 40:
+                break
+        return seen, handle.checkpoint.to_dict()
+
+    async def second_part(checkpoint: dict) -> list[int]:
+        handle = client.resume_query(json.loads(json.dumps(checkpoint)))
+        return [log["i"] for batch_logs in [b async for b in handle.iter_batches()] for log in batch_logs]
+
+    seen, checkpoint = run(first_part())
+    rest = run(second_part(checkpoint))
+
+    assert sorted(seen + rest) == list(range(120))
+
+
+def test_partly_delivered_page_is_redelivered_not_lost(make_client):
+    client, _ = make_client(_entries(30), stream_decoding=False)
+
+    async def first_part() -> tuple[list[int], dict]:
+        handle = await _open(client, 30, batch_size=10)
+        seen = []
+        async for log in handle.iter_logs():
+            seen.append(log["i"])
+            if len(seen) == 15:
+                break
+        return seen, handle.checkpoint.to_dict()
+
+    async def second_part(checkpoint: dict) -> list[int]:
+        return [log["i"] async for log in client.resume_query(checkpoint).iter_logs()]
+
+    seen, checkpoint = run(first_part())
+    rest = run(second_part(checkpoint))
+
+    assert checkpoint["delivered"] == 10
+    assert rest == list(range(10, 30))
+    assert set(seen) | set(rest) == set(range(30))
+
+
+def test_transient_error_resumes_from_checkpoint(make_client):
+    client, fake = make_client(_entries(30), stream_decoding=False)
+    failures = []
+
+    def fail_second_page(request: httpx.Request):
+        if request.url.path.endswith("/query_range") and len(fake.range_calls) == 2 and not failures:
+            failures.append(request)
+            return httpx.Response(503)
+        return None
+
+    fake.intercept = fail_second_page
+
+    async def scenario():
+        handle = await _open(client, 30, batch_size=10, resume_delay=0)
+        logs = [log["i"] async for log in handle.iter_logs()]
+        return logs, handle.resumes
+
+    logs, resumes = run(scenario())
+
+    assert logs == list(range(30))
+    assert resumes == 1
+
+
+def test_limit_keeps_the_newest_rows_of_several_streams(make_client):
+    entries = [({**SERVICE, "pod": str(i % 2)}, ns(i), json.dumps({"i": i})) for i in range(60)]
+    client, _ = make_client(entries, stream_decoding=False)
+
+    async def scenario() -> list[int]:
+        handle = await client.open_query(
+            filters=SERVICE, start_time=at(0), end_time=at(60), limit=35, batch_size=10, shards=2, plan=False,
+        )
+        return [log["i"] async for log in handle.iter_logs()]
+
+    assert sorted(run(scenario())) == list(range(25, 60))
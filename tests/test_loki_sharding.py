@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from tests.conftest import at, collect, ns, run
+
+SERVICE = {"service_name": "loom-tg-bot"}
+
+
+def _entries(count: int) -> list[tuple]:
+    # Два стрима вперемешку: шардам есть что сливать
+    return [({**SERVICE, "pod": str(i % 2)}, ns(i), json.dumps({"i": i})) for i in range(count)]
+
+
+def _read(client, count: int, batch_size: int = 7, **kwargs) -> list[int]:
+    logs = run(collect(client.iter_logs(
+        filters=SERVICE, start_time=at(0), end_time=at(count), batch_size=batch_size, plan=False, **kwargs,
+    )))
+    return [log["i"] for log in logs]
+
+
+@pytest.mark.parametrize("direction", ["forward", "backward"])
+def test_sharded_pages_come_in_direction_order(make_client, direction):
+    client, _ = make_client(_entries(100))
+
+    batches = run(collect(client.iter_batches(
+        filters=SERVICE, start_time=at(0), end_time=at(100), batch_size=7, shards=4, direction=direction, plan=False,
+    )))
+    pages = [[log["i"] for log in batch_logs] for batch_logs in batches]
+
+    # Внутри страницы строки сгруппированы по стримам, но страницы друг с другом не перекрываются
+    for page, next_page in zip(pages, pages[1:]):
+        if direction == "forward":
+            assert max(page) < min(next_page)
+        else:
+            assert min(page) > max(next_page)
+    assert sorted(i for page in pages for i in page) == list(range(100))
+
+
+@pytest.mark.parametrize("direction, expected", [
+    ("forward", set(range(30))),
+    ("backward", set(range(70, 100))),
+])
+def test_limit_keeps_the_first_rows_in_direction_order(make_client, direction, expected):
+    client, _ = make_client(_entries(100))
+
+    assert set(_read(client, 100, direction=direction, shards=4, limit=30)) == expected
+
+
+def test_concurrency_is_bounded(make_client):
+    client, fake = make_client(_entries(100))
+    fake.latency = 0.01
+
+    _read(client, 100, direction="forward", shards=8, max_concurrency=3)
+
+    assert fake.peak_in_flight == 3
+
+
+def test_shards_split_the_window_evenly(make_client):
+    client, fake = make_client(_entries(100))
+
+    _read(client, 100, direction="forward", shards=4, batch_size=5000)
+
+    windows = sorted((int(params["start"]), int(params["end"])) for params in fake.range_calls)
+    assert windows == [(ns(i * 25), ns((i + 1) * 25)) for i in range(4)]
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import httpx
+
+from infrastructure.loki.loki import _TailCursor
+
+from tests.conftest import at, ns, run
+
+SERVICE = {"service_name": "loom-tg-bot"}
+
+
+def _entry(i: int, timestamp_ns: int = None) -> tuple:
+    return SERVICE, timestamp_ns if timestamp_ns is not None else ns(i), json.dumps({"i": i})
+
+
+async def _take(tail, count: int) -> list[int]:
+    taken = []
+    async for log in tail:
+        taken.append(log["i"])
+        if len(taken) == count:
+            break
+    await tail.aclose()
+    return taken
+
+
+def _tail(client, **kwargs):
+    return client.tail(
+        filters=SERVICE, start_time=at(0), use_websocket=False, poll_interval=0.01, reconnect_delay=0.01, **kwargs
+    )
+
+
+def test_polling_tail_delivers_new_lines_once(make_client):
+    client, fake = make_client([_entry(i) for i in range(10)])
+
+    async def scenario() -> list[int]:
+        tail = _tail(client, batch_size=4)
+        taken = []
+        async for log in tail:
+            taken.append(log["i"])
+            if len(taken) == 10:
+                # Новые строки, в том числе на timestamp последней полученной
+                fake.add([_entry(10, ns(9)), *[_entry(i) for i in range(11, 15)]])
+            if len(taken) == 15:
+                break
+        await tail.aclose()
+        return taken
+
+    assert run(scenario()) == list(range(15))
+
+
+def test_polling_tail_resumes_after_transport_error(make_client):
+    client, fake = make_client([_entry(i) for i in range(20)])
+    failures = []
+
+    def fail_once(request: httpx.Request):
+        if len(fake.range_calls) == 2 and not failures:
+            failures.append(request)
+            raise httpx.ConnectError("обрыв")
+        return None
+
+    fake.intercept = fail_once
+
+    assert run(_take(_tail(client, batch_size=5), 20)) == list(range(20))
+    assert failures
+
+
+def test_buffer_bounds_reading_ahead(make_client):
+    client, fake = make_client([_entry(i) for i in range(1000)])
+
+    async def scenario() -> int:
+        tail = _tail(client, batch_size=100, buffer_size=5)
+        await tail.__anext__()
+        await asyncio.sleep(0.05)
+        calls = len(fake.range_calls)
+        await tail.aclose()
+        return calls
+
+    # Первая страница целиком в буфер не помещается - вторая не запрашивается
+    assert run(scenario()) == 1
+
+
+def test_tail_cursor_drops_only_repeated_boundary_lines():
+    cursor = _TailCursor(ns(0))
+
+    assert cursor.accept(ns(1), "a")
+    assert cursor.accept(ns(1), "b")
+    assert not cursor.accept(ns(1), "a")
+    # Запоздавшая строка другого стрима проходит, курсор не двигается
+    assert cursor.accept(ns(0.5), "late")
+    assert cursor.timestamp_ns == ns(1)
+    assert cursor.accept(ns(2), "a")
+    assert cursor.keys == {hash("a")}
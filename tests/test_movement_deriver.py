@@ -0,0 +1,50 @@
+import asyncio
+
+from infrastructure.loki.batch import datetime_to_ns
+from internal.service.dashboard.deriver import MovementEventDeriver
+
+from tests.conftest import FakeTelemetry, ns, run
+
+SPAN = {"span_id": "s1", "account_id": "7", "organization_id": "1", "telegram_user_username": "user"}
+
+
+def _log(timestamp_ns: int, message: str, **fields) -> dict:
+    return {"timestamp_ns": timestamp_ns, "message": message, **fields}
+
+
+def test_restart_keeps_lines_on_the_last_timestamp(make_client):
+    client, _ = make_client()
+    # Последняя наносекунда микросекунды: last_ns + 1 уже в следующей микросекунде
+    last_ns = ns(10) + 999
+    other = _log(last_ns - 5, "noise")
+    start = _log(ns(5), "loom-tg-bot | Начало MenuService.open", **SPAN)
+    # Другой стрим, строка с тем же timestamp, что и последняя полученная до сбоя
+    end = _log(last_ns, "loom-tg-bot | Завершение MenuService.open", **SPAN)
+    received = _log(last_ns, "noise")
+    starts = []
+
+    async def tail(start_time, **kwargs):
+        starts.append(start_time)
+        if len(starts) == 1:
+            for log in (start, other, received):
+                yield log
+            raise RuntimeError("tail оборвался")
+        for log in (start, end, other, received):
+            if log["timestamp_ns"] >= datetime_to_ns(start_time):
+                yield log
+        raise asyncio.CancelledError
+
+    client.tail = tail
+    deriver = MovementEventDeriver(FakeTelemetry(), client, restart_delay=0)
+
+    async def scenario() -> None:
+        try:
+            await deriver.run()
+        except asyncio.CancelledError:
+            pass
+
+    run(scenario())
+
+    assert datetime_to_ns(starts[1]) <= last_ns
+    assert [event["span_id"] for event in deriver.buffer] == ["s1"]
+    assert deriver.buffer[0]["duration_ms"] == 5000.000999
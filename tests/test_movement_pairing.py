@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+from internal.service.dashboard.movement import END_OPERATION, START_OPERATION, SpanPairingEngine
+
+from tests.conftest import ago_ns, movement_entries, ns, run
+
+
+def _log(span_id: str, operation: str, seconds: float) -> dict:
+    return {
+        "span_id": span_id,
+        "message": f"loom-tg-bot | {operation} MenuService.open",
+        "timestamp_ns": ns(seconds),
+        "account_id": "7",
+        "telegram_user_username": "user",
+    }
+
+
+def test_pair_is_emitted_as_soon_as_both_halves_arrive():
+    engine = SpanPairingEngine()
+
+    assert engine.feed(_log("s1", START_OPERATION, 0)) is None
+    assert engine.feed(_log("s2", START_OPERATION, 1)) is None
+    span_id, operations = engine.feed(_log("s1", END_OPERATION, 2))
+
+    assert span_id == "s1"
+    assert operations[START_OPERATION]["timestamp_ns"] == ns(0)
+    assert operations[END_OPERATION]["timestamp_ns"] == ns(2)
+    assert list(engine.pending) == ["s2"]
+    assert (engine.paired, engine.peak_pending) == (1, 2)
+
+
+def test_lines_without_span_or_operation_are_ignored():
+    engine = SpanPairingEngine()
+
+    assert engine.feed({"message": "loom-tg-bot | Начало MenuService.open", "timestamp_ns": ns(0)}) is None
+    assert engine.feed({"span_id": "s1", "message": "other line", "timestamp_ns": ns(0)}) is None
+    assert engine.pending == {}
+
+
+def test_unpaired_spans_older_than_horizon_are_evicted_forward():
+    engine = SpanPairingEngine(horizon=timedelta(seconds=60), direction="forward")
+    engine.feed(_log("old", START_OPERATION, 0))
+    engine.feed(_log("recent", START_OPERATION, 50))
+    engine.feed(_log("other", END_OPERATION, 61))
+
+    assert engine.evict() == 1
+    assert list(engine.pending) == ["recent", "other"]
+    assert engine.evicted == 1
+
+
+def test_unpaired_spans_are_evicted_backward():
+    engine = SpanPairingEngine(horizon=timedelta(seconds=60), direction="backward")
+    engine.feed(_log("old", END_OPERATION, 100))
+    engine.feed(_log("new", END_OPERATION, 50))
+
+    assert engine.evict() == 0
+    engine.feed(_log("newer", END_OPERATION, 39))
+
+    assert engine.evict() == 1
+    assert list(engine.pending) == ["new", "newer"]
+
+
+def test_span_closed_within_horizon_is_paired_after_eviction_pass():
+    engine = SpanPairingEngine(horizon=timedelta(seconds=60))
+    engine.feed(_log("s1", START_OPERATION, 0))
+    engine.feed(_log("s2", START_OPERATION, 30))
+    engine.evict()
+
+    assert engine.feed(_log("s1", END_OPERATION, 59)) is not None
+    assert engine.evicted == 0
+
+
+def test_without_horizon_nothing_is_evicted():
+    engine = SpanPairingEngine(horizon=None)
+    engine.feed(_log("s1", START_OPERATION, 0))
+    engine.feed(_log("s2", START_OPERATION, 10_000))
+
+    assert engine.evict() == 0
+
+
+def test_copy_does_not_share_pending_spans():
+    engine = SpanPairingEngine()
+    engine.feed(_log("s1", START_OPERATION, 0))
+
+    copy = engine.copy()
+    assert copy.feed(_log("s1", END_OPERATION, 1)) is not None
+
+    assert list(engine.pending) == ["s1"]
+    assert (engine.paired, copy.paired) == (0, 1)
+
+
+def test_service_reports_evicted_spans(make_service):
+    service, _ = make_service([
+        # "Начало" вышло за окно: "Завершение" ждёт пару дольше горизонта
+        *movement_entries("lost", 7, ago_ns(4 * 3600), ago_ns(600)),
+        *movement_entries("a", 7, ago_ns(9000), ago_ns(8999)),
+    ], pairing_horizon=timedelta(hours=1))
+
+    result = run(service.get_user_movement_map(7, hours=3))
+
+    assert len(result.movements) == 1
+    assert result.evicted_spans == 1